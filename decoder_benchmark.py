@@ -0,0 +1,1801 @@
+#!/usr/bin/env python3
+"""Benchmarks for the beam search decoder in `myDecoder.py`.
+
+The benchmarks run on synthetic CTC posteriors over the 32-label character alphabet used in
+`test_with_LM.py`, so they need neither a trained model nor a KenLM binary. A small stand-in
+language model is included so that the language model code paths are exercised as well.
+
+Usage:
+
+    python3 decoder_benchmark.py suite --beam-widths 16 64 --n-frames 250 1000 --output run.json
+    python3 decoder_benchmark.py suite --compare run.json
+    python3 decoder_benchmark.py long-form --durations-s 30 120 600
+    python3 decoder_benchmark.py engines --beam-width 80 --n-utterances 20
+    python3 decoder_benchmark.py collapse --collapse-prob 0.99
+    python3 decoder_benchmark.py candidates --vocab-sizes 32 1000 5000 --token-top-k 8
+    python3 decoder_benchmark.py service --workers 1 2 4 --start-method spawn
+    python3 decoder_benchmark.py lm-cache --logits-dir cv_test_logits --kenlm-model lm.bin
+    python3 decoder_benchmark.py ngram-lm --arpa 3-gram.pruned.1e-7.arpa
+    python3 decoder_benchmark.py startup --arpa 3-gram.pruned.1e-7.arpa \
+        --unigrams librispeech-vocab.txt
+    python3 decoder_benchmark.py registry --arpa en.arpa de.arpa --n-decoders 20
+    python3 decoder_benchmark.py unigrams --unigrams librispeech-vocab.txt
+    python3 decoder_benchmark.py lm-batch --beam-width 80
+    python3 decoder_benchmark.py hotwords --n-hotwords 500 --n-frames 50
+    python3 decoder_benchmark.py adaptive-beam --logits-dir cv_test_logits --references test.csv
+    python3 decoder_benchmark.py hybrid --greedy-prob 0.9 --logits-dir cv_test_logits
+    python3 decoder_benchmark.py hybrid --greedy-prob 0.9 --collapse-prob 0.9
+    python3 decoder_benchmark.py deadline --deadline-ms 50 --logits-dir cv_test_logits
+    python3 decoder_benchmark.py grammar --beam-widths 64 16 4 --n-words 20
+    python3 decoder_benchmark.py rescore --logits-dir cv_test_logits --references test.csv \
+        --kenlm-model 3-gram.pruned.1e-7.ngram --nbest-file cv_test_nbest.npz --redecode
+
+Benchmarks that take `--logits-dir` run on saved `.npy` log-posterior matrices instead, e.g. the
+outputs of the acoustic model on the Common Voice test set, and `--kenlm-model` replaces the
+stand-in language model with a real one.
+"""
+
+import argparse
+import csv
+import functools
+import gc
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pyctcdecode.language_model import AbstractLanguageModel, AbstractLMState, HotwordScorer
+from pygtrie import CharTrie  # type: ignore
+
+from myAlphabet import Alphabet
+from myDecoder import (
+    DEFAULT_LM_CACHE_BYTES,
+    ENGINE_REFERENCE,
+    ENGINE_SOA,
+    Beam,
+    BeamSearchDecoderCTC,
+    DecodeSession,
+    _build_hotword_scorer,
+    _collapse_frames,
+    _get_candidate_tokens,
+    build_ctcdecoder,
+    get_hotword_scorer,
+    sum_counters,
+)
+from myGrammar import Grammar
+from myLanguageModel import NgramLanguageModel, NgramModel, UnigramDawg, compile_arpa
+from myLongForm import (
+    DEFAULT_OVERLAP_S,
+    DEFAULT_SAMPLE_RATE,
+    DEFAULT_WINDOW_S,
+    transcribe_long_form,
+)
+from myDecoderService import DecoderService
+from myRescorer import NBestList, redecode_changed, word_edit_distance
+
+logger = logging.getLogger(__name__)
+
+
+# same alphabet as in test_with_LM.py
+LABELS = [" ", "<bos>", "<eos>", "<pad>", "<unk>",
+          "E", "A", "T", "I", "S", "O", "N", "R", "H", "L",
+          "D", "C", "U", "M", "F", "P", "G", "W", "Y", "B",
+          "V", "K", "X", "J", "'", "Z", "Q"]
+
+WORDS = [
+    "THE", "AND", "I", "TO", "OF", "A", "IN", "THAT", "HE", "WAS", "IT", "HIS", "YOU", "WITH",
+    "AS", "FOR", "HAD", "IS", "HER", "NOT", "BUT", "AT", "ON", "SHE", "BE", "HAVE", "BY", "WHICH",
+    "HIM", "THEY", "THIS", "FROM", "ALL", "WERE", "MY", "WE", "ONE", "SO", "SAID", "ME", "THERE",
+    "OR", "AN", "ARE", "NO", "WOULD", "THEIR", "IF", "BEEN", "WHEN", "WHAT", "WILL", "COULD",
+    "STREET", "MORNING", "LITTLE", "SHOULD", "ANOTHER", "BEFORE", "THROUGH", "QUESTION", "DON'T",
+]
+
+FRAME_SHIFT_S = 0.02  # wav2vec2 / HuBERT frame shift
+
+# decoder methods timed by the suite benchmark
+SUITE_METHODS = ("decode", "decode_beams", "decode_batch", "partial_decode_beams")
+
+
+@functools.lru_cache(maxsize=None)
+def _normalized_labels(labels: Tuple[str, ...]) -> List[str]:
+    """Decoder labels, index aligned with the logit columns."""
+    return Alphabet.build_alphabet(list(labels)).labels
+
+
+def make_synthetic_logits(
+    n_frames: int,
+    peakiness: float = 0.95,
+    noise: float = 0.3,
+    seed: int = 0,
+    labels: Sequence[str] = LABELS,
+    max_blank_frames: int = 3,
+) -> np.ndarray:
+    """Make a peaky CTC log-posterior matrix of shape (n_frames, len(labels)).
+
+    A random word sequence is aligned to frames the way CTC models tend to emit it: every
+    character is held for one to three frames and followed by one to `max_blank_frames` blank
+    frames. Each frame puts
+    `peakiness` probability mass on its target token and spreads the rest with Dirichlet noise,
+    where a smaller `noise` concentrates the rest on fewer competing tokens.
+    """
+    rng = np.random.default_rng(seed)
+    normalized_labels = _normalized_labels(tuple(labels))
+    label_ids = {label: n for n, label in enumerate(normalized_labels)}
+    blank_idx = label_ids[""]
+    targets: List[int] = []
+    while len(targets) < n_frames:
+        word = WORDS[rng.integers(len(WORDS))]
+        for char in word + " ":
+            targets.extend([label_ids[char]] * int(rng.integers(1, 4)))
+            # at least one blank is needed between repeated characters
+            targets.extend([blank_idx] * int(rng.integers(1, max_blank_frames + 1)))
+    targets = targets[:n_frames]
+
+    vocab_size = len(normalized_labels)
+    probs = rng.dirichlet(np.full(vocab_size, noise), size=n_frames) * (1.0 - peakiness)
+    probs[np.arange(n_frames), targets] += peakiness
+    return np.log(probs)
+
+
+def load_logits_dir(logits_dir: str, max_utterances: Optional[int] = None) -> List[np.ndarray]:
+    """Load saved log-posterior matrices of shape (time, vocabulary) from `.npy` files."""
+    paths = sorted(Path(logits_dir).glob("*.npy"))[:max_utterances]
+    if not paths:
+        raise ValueError(f"No .npy logit files found in {logits_dir}.")
+    return [np.load(path) for path in paths]
+
+
+def load_references(csv_path: str) -> Dict[str, str]:
+    """Load the reference transcripts of a SpeechBrain data csv, keyed by utterance id."""
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        return {row["ID"]: row["wrd"] for row in csv.DictReader(csv_file)}
+
+
+def word_error_rate(references: Sequence[str], hypotheses: Sequence[str]) -> float:
+    """Corpus word error rate, word-level edit distance over the number of reference words."""
+    n_errors = sum(map(word_edit_distance, references, hypotheses))
+    n_words = sum(len(reference.split()) for reference in references)
+    return n_errors / max(1, n_words)
+
+
+class ToyLMState(AbstractLMState):
+    def __init__(self, history: Tuple[str, ...]) -> None:
+        """Language model state holding the last words."""
+        self.history = history
+
+    def get_mp_safe_state(self) -> "ToyLMState":
+        """Get a multiprocessing-safe version of the state."""
+        return self
+
+    def __eq__(self, other: object) -> bool:
+        """Equality on the word history."""
+        return isinstance(other, ToyLMState) and self.history == other.history
+
+    def __hash__(self) -> int:
+        """Hash of the word history."""
+        return hash(self.history)
+
+
+class ToyLanguageModel(AbstractLanguageModel):
+    def __init__(
+        self,
+        unigrams: Sequence[str] = WORDS,
+        order: int = 3,
+        alpha: float = 0.5,
+        beta: float = 1.5,
+        unk_score_offset: float = -10.0,
+    ) -> None:
+        """Deterministic stand-in n-gram language model for benchmarking.
+
+        Word probabilities are a unigram distribution plus a pseudo-random context bonus derived
+        from a hash of the previous word, so scores depend on the history like a real n-gram model
+        without needing a model file.
+
+        Args:
+            unigrams: known words
+            order: order of the simulated n-gram model
+            alpha: weight for language model during shallow fusion
+            beta: weight for length score adjustment of during scoring
+            unk_score_offset: amount of log score offset for unknown tokens
+        """
+        self._unigrams = set(unigrams)
+        self._prefixes = {word[:n] for word in unigrams for n in range(1, len(word) + 1)}
+        self._order = order
+        self._unigram_logp = -math.log(len(self._unigrams))
+        self.alpha = alpha
+        self.beta = beta
+        self.unk_score_offset = unk_score_offset
+
+    @property
+    def order(self) -> int:
+        """Get the order of the n-gram language model."""
+        return self._order
+
+    def get_start_state(self) -> ToyLMState:
+        """Get initial lm state."""
+        return ToyLMState(("<s>",))
+
+    def score_partial_token(self, partial_token: str) -> float:
+        """Get partial token score."""
+        return 0.0 if partial_token in self._prefixes else self.unk_score_offset
+
+    def score(
+        self, prev_state: AbstractLMState, word: str, is_last_word: bool = False
+    ) -> Tuple[float, ToyLMState]:
+        """Score word conditional on previous lm state."""
+        assert isinstance(prev_state, ToyLMState)
+        context_hash = zlib.crc32((prev_state.history[-1] + " " + word).encode("utf-8"))
+        lm_score = self._unigram_logp + (context_hash % 1000) / 1000.0
+        if word not in self._unigrams:
+            lm_score += self.unk_score_offset
+        if is_last_word:
+            lm_score -= 1.0
+        end_state = ToyLMState((prev_state.history + (word,))[-(self._order - 1) :])
+        return self.alpha * lm_score + self.beta, end_state
+
+
+class PerWordLanguageModel(AbstractLanguageModel):
+    def __init__(self, language_model: AbstractLanguageModel) -> None:
+        """Wrap a language model, hiding its batch scoring so that every word is its own call."""
+        self._language_model = language_model
+        self.n_calls = 0
+
+    @property
+    def order(self) -> int:
+        """Get the order of the n-gram language model."""
+        return self._language_model.order
+
+    def get_start_state(self) -> AbstractLMState:
+        """Get initial lm state."""
+        return self._language_model.get_start_state()
+
+    def score_partial_token(self, partial_token: str) -> float:
+        """Get partial token score."""
+        return self._language_model.score_partial_token(partial_token)
+
+    def score(
+        self, prev_state: AbstractLMState, word: str, is_last_word: bool = False
+    ) -> Tuple[float, AbstractLMState]:
+        """Score word conditional on previous lm state."""
+        self.n_calls += 1
+        return self._language_model.score(prev_state, word, is_last_word=is_last_word)
+
+
+def write_synthetic_arpa(
+    arpa_path: str, words: Sequence[str] = WORDS, n_bigrams: int = 2000, seed: int = 0
+) -> None:
+    """Write a random trigram arpa model over words, for benchmarks that need a model file."""
+    rng = np.random.default_rng(seed)
+    unigrams = ["<unk>", "<s>", "</s>"] + list(words)
+    bigrams = sorted(
+        {
+            (unigrams[first], unigrams[second])
+            for first, second in rng.integers(1, len(unigrams), size=(n_bigrams, 2))
+            if unigrams[second] != "<s>" and unigrams[first] != "</s>"
+        }
+    )
+    trigrams = sorted(
+        {
+            bigrams[idx] + (unigrams[word_idx],)
+            for idx, word_idx in zip(
+                rng.integers(len(bigrams), size=2 * n_bigrams),
+                rng.integers(2, len(unigrams), size=2 * n_bigrams),
+            )
+            if bigrams[idx][1] != "</s>"
+        }
+    )
+    with open(arpa_path, "w", encoding="utf-8") as fi:
+        fi.write("\\data\\\n")
+        for n, ngrams in enumerate((unigrams, bigrams, trigrams), start=1):
+            fi.write(f"ngram {n}={len(ngrams)}\n")
+        fi.write("\n\\1-grams:\n")
+        for word in unigrams:
+            logprob = -99.0 if word == "<s>" else -rng.uniform(1.0, 3.0)
+            fi.write(f"{logprob:.4f}\t{word}\t{-rng.uniform(0.0, 1.0):.4f}\n")
+        fi.write("\n\\2-grams:\n")
+        for bigram in bigrams:
+            fi.write(
+                f"{-rng.uniform(0.3, 2.0):.4f}\t{' '.join(bigram)}\t{-rng.uniform(0.0, 1.0):.4f}\n"
+            )
+        fi.write("\n\\3-grams:\n")
+        for trigram in trigrams:
+            fi.write(f"{-rng.uniform(0.1, 1.5):.4f}\t{' '.join(trigram)}\n")
+        fi.write("\n\\end\\\n")
+
+
+def _time_decode(
+    decoder: BeamSearchDecoderCTC, logits_list: List[np.ndarray], **decode_kwargs: object
+) -> Tuple[float, List[str]]:
+    """Decode all logits and return the total wall time in seconds and the top texts.
+
+    The text is empty if no beams are decoded, i.e. if none completes a text of the grammar.
+    """
+    # warm up
+    decoder.decode_beams(logits_list[0], **decode_kwargs)  # type: ignore
+    texts = []
+    start = time.perf_counter()
+    for logits in logits_list:
+        beams = decoder.decode_beams(logits, **decode_kwargs)  # type: ignore
+        texts.append(beams[0].text if beams else "")
+    return time.perf_counter() - start, texts
+
+
+def _decode_in_chunks(
+    decoder: BeamSearchDecoderCTC, logits: np.ndarray, chunk_frames: int, **decode_kwargs: Any
+) -> str:
+    """Decode logits chunk by chunk with `partial_decode_beams`, as a streaming client would."""
+    beams, cached_lm_scores, cached_p_lm_scores = decoder.get_starting_state()
+    lm_beams = []
+    for start in range(0, len(logits), chunk_frames):
+        is_end = start + chunk_frames >= len(logits)
+        lm_beams = decoder.partial_decode_beams(
+            logits[start : start + chunk_frames],
+            cached_lm_scores,
+            cached_p_lm_scores,
+            beams,
+            start,
+            force_next_word=is_end,
+            is_end=is_end,
+            **decode_kwargs,
+        )
+        beams = [Beam.from_lm_beam(lm_beam) for lm_beam in lm_beams]
+    return lm_beams[0].text
+
+
+def _get_suite_runner(
+    decoder: BeamSearchDecoderCTC,
+    method: str,
+    logits_list: List[np.ndarray],
+    beam_width: int,
+    chunk_frames: int,
+) -> Callable[[], List[str]]:
+    """Get a function decoding all logits with a decoder method and returning the top texts."""
+    if method == "decode":
+        return lambda: [decoder.decode(logits, beam_width=beam_width) for logits in logits_list]
+    if method == "decode_beams":
+        return lambda: [
+            decoder.decode_beams(logits, beam_width=beam_width)[0].text for logits in logits_list
+        ]
+    if method == "decode_batch":
+        return lambda: decoder.decode_batch(None, logits_list, beam_width=beam_width)
+    if method == "partial_decode_beams":
+        return lambda: [
+            _decode_in_chunks(decoder, logits, chunk_frames, beam_width=beam_width)
+            for logits in logits_list
+        ]
+    raise ValueError(f"method must be one of {SUITE_METHODS}. Got {method}.")
+
+
+def benchmark_suite(
+    n_utterances: int,
+    frame_counts: Sequence[int],
+    beam_widths: Sequence[int],
+    methods: Sequence[str] = SUITE_METHODS,
+    peakiness: float = 0.95,
+    noise: float = 0.3,
+    chunk_frames: int = 50,
+    engine: str = ENGINE_REFERENCE,
+    measure_memory: bool = True,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Time the decoder methods across beam widths and utterance lengths.
+
+    Every configuration gets a fresh decoder with the stand-in language model, warmed up on the
+    first utterance, so the language model score cache does not carry over between runs. The
+    peak memory is traced with tracemalloc in a second, untimed pass, since tracing slows down
+    the decoder. The real-time factor assumes a frame shift of FRAME_SHIFT_S.
+
+    Returns:
+        one row per method, beam width and utterance length
+    """
+    alphabet = Alphabet.build_alphabet(LABELS)
+    rows: List[Dict[str, Any]] = []
+    for n_frames in frame_counts:
+        logits_list = [
+            make_synthetic_logits(n_frames, peakiness=peakiness, noise=noise, seed=seed + n)
+            for n in range(n_utterances)
+        ]
+        for beam_width in beam_widths:
+            for method in methods:
+                decoder = BeamSearchDecoderCTC(alphabet, ToyLanguageModel(), engine=engine)
+                # warm up
+                _get_suite_runner(decoder, method, logits_list[:1], beam_width, chunk_frames)()
+                run = _get_suite_runner(decoder, method, logits_list, beam_width, chunk_frames)
+                start = time.perf_counter()
+                run()
+                seconds = time.perf_counter() - start
+                peak_memory_mb: Optional[float] = None
+                if measure_memory:
+                    tracemalloc.start()
+                    run()
+                    peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+                    tracemalloc.stop()
+                decoder.cleanup()
+                n_total_frames = n_frames * n_utterances
+                rows.append(
+                    {
+                        "method": method,
+                        "beam_width": beam_width,
+                        "n_frames": n_frames,
+                        "n_utterances": n_utterances,
+                        "seconds": seconds,
+                        "frames_per_s": n_total_frames / seconds,
+                        "rtf": seconds / (n_total_frames * FRAME_SHIFT_S),
+                        "peak_memory_mb": peak_memory_mb,
+                    }
+                )
+    return rows
+
+
+def compare_suite_results(
+    rows: List[Dict[str, Any]], baseline_rows: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Add the speedup and memory ratio over the matching rows of a baseline run."""
+    baseline = {(row["method"], row["beam_width"], row["n_frames"]): row for row in baseline_rows}
+    for row in rows:
+        baseline_row = baseline.get((row["method"], row["beam_width"], row["n_frames"]))
+        if baseline_row is not None:
+            row["speedup"] = row["frames_per_s"] / baseline_row["frames_per_s"]
+            if row["peak_memory_mb"] is not None and baseline_row["peak_memory_mb"] is not None:
+                row["memory_ratio"] = row["peak_memory_mb"] / baseline_row["peak_memory_mb"]
+    return rows
+
+
+def benchmark_long_form(
+    durations_s: Sequence[float],
+    beam_width: int,
+    window_s: float = DEFAULT_WINDOW_S,
+    overlap_s: float = DEFAULT_OVERLAP_S,
+    measure_memory: bool = True,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Real-time factor and peak memory of long-form transcription as recordings get longer.
+
+    The recording is streamed in one second blocks of silence and a stand-in encoder returns
+    synthetic posteriors for every window, so the timing covers windowing, stitching and
+    incremental decoding. With bounded memory the traced peak stays flat across durations, while
+    decoding the stitched posteriors in one `decode_beams` call grows with the duration.
+    """
+    sample_rate = DEFAULT_SAMPLE_RATE
+    window_logits = [
+        make_synthetic_logits(int(round(window_s / FRAME_SHIFT_S)), seed=seed + n).astype(
+            np.float32
+        )
+        for n in range(4)
+    ]
+    n_calls = [0]
+
+    def encode(window: np.ndarray) -> np.ndarray:
+        n_calls[0] += 1
+        n_frames = int(len(window) / (FRAME_SHIFT_S * sample_rate))
+        return window_logits[n_calls[0] % len(window_logits)][:n_frames]
+
+    def blocks(duration_s: float) -> Iterable[np.ndarray]:
+        for _ in range(int(duration_s)):
+            yield np.zeros(sample_rate, dtype=np.float32)
+
+    rows: List[Dict[str, Any]] = []
+    for duration_s in durations_s:
+        decoder = build_benchmark_decoder()
+        kwargs = dict(window_s=window_s, overlap_s=overlap_s, beam_width=beam_width)
+        result = transcribe_long_form(decoder, encode, blocks(duration_s), **kwargs)
+        row: Dict[str, Any] = {
+            "duration_s": result.audio_seconds,
+            "n_windows": result.n_windows,
+            "seconds": result.seconds,
+            "rtf": result.rtf,
+            "decoder_rtf": result.decoder_seconds / result.audio_seconds,
+            "n_words": len(result.words),
+            "peak_memory_mb": None,
+            "one_shot_peak_memory_mb": None,
+        }
+        if measure_memory:
+            tracemalloc.start()
+            transcribe_long_form(decoder, encode, blocks(duration_s), **kwargs)
+            row["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            # the one-shot decoding holds the posteriors of the whole recording
+            tracemalloc.start()
+            stitched_logits = np.concatenate(
+                [
+                    window_logits[n % len(window_logits)]
+                    for n in range(int(duration_s / (window_s - overlap_s)) + 1)
+                ]
+            )[: int(duration_s / FRAME_SHIFT_S)]
+            decoder.decode_beams(stitched_logits, beam_width=beam_width)
+            row["one_shot_peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        decoder.cleanup()
+        rows.append(row)
+    return rows
+
+
+def benchmark_engines(
+    n_utterances: int,
+    n_frames: int,
+    beam_width: int,
+    with_lm: bool,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Compare the reference and struct-of-arrays engines on identical logits.
+
+    Besides speed and top texts, the hot path counters of both engines are compared per
+    utterance, without the timings. They count the same steps, so they must agree.
+    """
+    logits_list = [make_synthetic_logits(n_frames, seed=seed + n) for n in range(n_utterances)]
+    alphabet = Alphabet.build_alphabet(LABELS)
+    results: Dict[str, float] = {}
+    texts: Dict[str, List[str]] = {}
+    counters: Dict[str, List[Dict[str, float]]] = {}
+    for engine in (ENGINE_REFERENCE, ENGINE_SOA):
+        language_model = ToyLanguageModel() if with_lm else None
+        # without the cross-utterance cache the lm calls only depend on the utterance
+        decoder = BeamSearchDecoderCTC(alphabet, language_model, engine=engine, lm_cache_bytes=0)
+        seconds, texts[engine] = _time_decode(decoder, logits_list, beam_width=beam_width)
+        decoder.reset_counters()
+        for logits in logits_list:
+            decoder.decode_beams(logits, beam_width=beam_width, collect_counters=True)
+        counters[engine] = [
+            {key: value for key, value in call.items() if not key.endswith("seconds")}
+            for call in decoder.get_counters()
+        ]
+        decoder.cleanup()
+        results[f"{engine}_ms_per_utterance"] = 1000.0 * seconds / n_utterances
+    results["speedup"] = (
+        results[f"{ENGINE_REFERENCE}_ms_per_utterance"] / results[f"{ENGINE_SOA}_ms_per_utterance"]
+    )
+    results["top_text_agreement"] = float(
+        np.mean([a == b for a, b in zip(texts[ENGINE_REFERENCE], texts[ENGINE_SOA])])
+    )
+    for reference_counters, soa_counters in zip(counters[ENGINE_REFERENCE], counters[ENGINE_SOA]):
+        mismatches = [
+            key for key, value in reference_counters.items() if soa_counters[key] != value
+        ]
+        if mismatches:
+            logger.warning("Engine counters differ in %s.", ", ".join(mismatches))
+    results["counters_agreement"] = float(
+        np.mean([a == b for a, b in zip(counters[ENGINE_REFERENCE], counters[ENGINE_SOA])])
+    )
+    return results
+
+
+def benchmark_collapse(
+    n_utterances: int,
+    n_frames: int,
+    beam_width: int,
+    collapse_prob: float,
+    peakiness: float,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Compare decoding with and without collapsing blank-dominant and repeated frames."""
+    logits_list = [
+        make_synthetic_logits(n_frames, peakiness=peakiness, seed=seed + n, max_blank_frames=8)
+        for n in range(n_utterances)
+    ]
+    decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    seconds, texts = _time_decode(decoder, logits_list, beam_width=beam_width)
+    collapsed_seconds, collapsed_texts = _time_decode(
+        decoder, logits_list, beam_width=beam_width, collapse_prob=collapse_prob
+    )
+    decoder.cleanup()
+    blank_idx = _normalized_labels(tuple(LABELS)).index("")
+    n_steps = [
+        len(_collapse_frames(logits, collapse_prob, blank_idx)[0]) for logits in logits_list
+    ]
+    return {
+        "frames_per_utterance": float(n_frames),
+        "collapsed_steps_per_utterance": float(np.mean(n_steps)),
+        "ms_per_utterance": 1000.0 * seconds / n_utterances,
+        "collapsed_ms_per_utterance": 1000.0 * collapsed_seconds / n_utterances,
+        "speedup": seconds / collapsed_seconds,
+        "top_text_agreement": float(np.mean([a == b for a, b in zip(texts, collapsed_texts)])),
+    }
+
+
+def _get_frame_candidates(logits: np.ndarray, token_min_logp: float) -> List[List[int]]:
+    """Candidate tokens selected frame by frame, as the decoder did before the vectorized pass."""
+    candidates = []
+    for logit_col in logits:
+        max_idx = logit_col.argmax()
+        candidates.append(sorted(set(np.where(logit_col >= token_min_logp)[0]) | {max_idx}))
+    return candidates
+
+
+def benchmark_candidates(
+    n_utterances: int,
+    n_frames: int,
+    beam_width: int,
+    vocab_sizes: Sequence[int],
+    token_min_logp: float,
+    token_top_k: int,
+    seed: int = 0,
+) -> List[Dict[str, float]]:
+    """Per-frame vs vectorized candidate token selection, and decoding with a top-k cap.
+
+    Selection is timed on random peaky log-posteriors of each vocabulary size, as large as BPE
+    vocabularies get. Decoding is timed on the 32-label synthetic posteriors with and without
+    token_top_k, a low token_min_logp makes many tokens per frame candidates.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for vocab_size in vocab_sizes:
+        probs = rng.dirichlet(np.full(vocab_size, 0.05), size=n_frames)
+        logits = np.log(np.maximum(probs, 1e-30))
+        row: Dict[str, float] = {"vocab_size": float(vocab_size)}
+        start = time.perf_counter()
+        frame_candidates = _get_frame_candidates(logits, token_min_logp)
+        row["per_frame_us"] = 1e6 * (time.perf_counter() - start) / n_frames
+        for name, top_k in (("vectorized", None), ("top_k", token_top_k)):
+            start = time.perf_counter()
+            idxs, offsets = _get_candidate_tokens(logits, token_min_logp, top_k)
+            row[f"{name}_us"] = 1e6 * (time.perf_counter() - start) / n_frames
+            row[f"{name}_candidates_per_frame"] = len(idxs) / n_frames
+        row["speedup"] = row["per_frame_us"] / row["vectorized_us"]
+        idxs, offsets = _get_candidate_tokens(logits, token_min_logp)
+        row["same_candidates"] = float(
+            all(
+                candidates == idxs[offsets[n] : offsets[n + 1]].tolist()
+                for n, candidates in enumerate(frame_candidates)
+            )
+        )
+        rows.append(row)
+
+    logits_list = [
+        make_synthetic_logits(n_frames, peakiness=0.8, noise=1.0, seed=seed + n)
+        for n in range(n_utterances)
+    ]
+    decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    seconds, texts = _time_decode(
+        decoder, logits_list, beam_width=beam_width, token_min_logp=token_min_logp
+    )
+    top_k_seconds, top_k_texts = _time_decode(
+        decoder,
+        logits_list,
+        beam_width=beam_width,
+        token_min_logp=token_min_logp,
+        token_top_k=token_top_k,
+    )
+    decoder.cleanup()
+    rows.append(
+        {
+            "vocab_size": float(len(LABELS)),
+            "ms_per_utterance": 1000.0 * seconds / n_utterances,
+            "top_k_ms_per_utterance": 1000.0 * top_k_seconds / n_utterances,
+            "speedup": seconds / top_k_seconds,
+            "top_text_agreement": float(np.mean([a == b for a, b in zip(texts, top_k_texts)])),
+        }
+    )
+    return rows
+
+
+def build_benchmark_decoder(with_lm: bool = True) -> BeamSearchDecoderCTC:
+    """Build the decoder used by the benchmarks, module-level so that it can be pickled."""
+    language_model = ToyLanguageModel() if with_lm else None
+    return BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), language_model)
+
+
+def benchmark_service(
+    n_utterances: int,
+    n_frames: int,
+    beam_width: int,
+    workers: Sequence[int],
+    start_method: Optional[str],
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Measure decoding throughput of the persistent decoder service as workers are added."""
+    logits_list = [
+        make_synthetic_logits(n_frames, seed=seed + n).astype(np.float32)
+        for n in range(n_utterances)
+    ]
+    decoder = build_benchmark_decoder()
+    start = time.perf_counter()
+    texts = decoder.decode_batch(None, logits_list, beam_width=beam_width)
+    results = {"in_process_utterances_per_s": n_utterances / (time.perf_counter() - start)}
+    decoder.cleanup()
+    for num_workers in workers:
+        with DecoderService(
+            build_benchmark_decoder,
+            vocab_size=len(LABELS),
+            num_workers=num_workers,
+            max_frames=n_frames,
+            mp_context=start_method,
+        ) as service:
+            # warm up, this includes the one-off decoder start up of every worker
+            service.decode_batch(logits_list[:num_workers], beam_width=beam_width)
+            start = time.perf_counter()
+            service_texts = service.decode_batch(logits_list, beam_width=beam_width)
+            seconds = time.perf_counter() - start
+        if service_texts != texts:
+            logger.warning("Decoder service output differs from in-process decoding.")
+        results[f"{num_workers}_workers_utterances_per_s"] = n_utterances / seconds
+    return results
+
+
+def benchmark_lm_cache(
+    logits_list: List[np.ndarray],
+    beam_width: int,
+    lm_cache_bytes: int,
+    kenlm_model_path: Optional[str] = None,
+) -> Dict[str, float]:
+    """Compare decoding a test set with and without the cross-utterance LM score cache.
+
+    There is no warm up here, since the first utterances filling the cache is part of the cost.
+    """
+    results: Dict[str, float] = {}
+    texts: Dict[int, List[str]] = {}
+    for cache_bytes in (0, lm_cache_bytes):
+        if kenlm_model_path is None:
+            decoder = BeamSearchDecoderCTC(
+                Alphabet.build_alphabet(LABELS), ToyLanguageModel(), lm_cache_bytes=cache_bytes
+            )
+        else:
+            decoder = build_ctcdecoder(
+                LABELS, kenlm_model_path, alpha=0.7, beta=1.8, lm_cache_bytes=cache_bytes
+            )
+        start = time.perf_counter()
+        texts[cache_bytes] = [
+            decoder.decode_beams(logits, beam_width=beam_width)[0].text for logits in logits_list
+        ]
+        seconds = time.perf_counter() - start
+        name = "cached" if cache_bytes else "uncached"
+        results[f"{name}_ms_per_utterance"] = 1000.0 * seconds / len(logits_list)
+        stats = decoder.get_lm_cache_stats()
+        if stats is not None:
+            results["hit_rate"] = stats["hits"] / max(1, stats["hits"] + stats["misses"])
+            results.update({key: float(value) for key, value in stats.items()})
+        decoder.cleanup()
+    results["speedup"] = results["uncached_ms_per_utterance"] / results["cached_ms_per_utterance"]
+    results["top_text_agreement"] = float(
+        np.mean([a == b for a, b in zip(texts[0], texts[lm_cache_bytes])])
+    )
+    return results
+
+
+def benchmark_ngram_lm(
+    arpa_path: str, n_words: int = 100000, n_loads: int = 10, seed: int = 0
+) -> Dict[str, float]:
+    """Compile an arpa file and compare loading and scoring against KenLM if it is installed.
+
+    Scores are compared on random word sequences over the model vocabulary, against the
+    unquantized compiled model and against KenLM loading the arpa file.
+    """
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        compiled_dir = str(Path(tmp_dir) / "quantized")
+        start = time.perf_counter()
+        compile_arpa(arpa_path, compiled_dir)
+        results["compile_s"] = time.perf_counter() - start
+        results["compiled_mb"] = (
+            sum(path.stat().st_size for path in Path(compiled_dir).iterdir()) / 2**20
+        )
+        start = time.perf_counter()
+        for _ in range(n_loads):
+            language_model = NgramLanguageModel(NgramModel(compiled_dir))
+        results["load_ms"] = 1000.0 * (time.perf_counter() - start) / n_loads
+        # unweighted natural log scores, comparable to kenlm
+        language_model.reset_params(alpha=1.0, beta=0.0)
+        exact_model = NgramLanguageModel(
+            compile_arpa(arpa_path, str(Path(tmp_dir) / "exact"), quantize_bits=0),
+            alpha=1.0,
+            beta=0.0,
+        )
+
+        vocabulary = list(language_model._ngram_model.unigrams)
+        rng = np.random.default_rng(seed)
+        words = [vocabulary[i] for i in rng.integers(len(vocabulary), size=n_words)]
+        scores: Dict[str, List[float]] = {}
+        for name, model in (("quantized", language_model), ("exact", exact_model)):
+            state = model.get_start_state()
+            scores[name] = []
+            start = time.perf_counter()
+            for word in words:
+                score, state = model.score(state, word)
+                scores[name].append(score)
+            results[f"{name}_us_per_word"] = 1e6 * (time.perf_counter() - start) / n_words
+        results["max_quantization_error"] = float(
+            np.max(np.abs(np.subtract(scores["quantized"], scores["exact"])))
+        )
+    try:
+        import kenlm  # type: ignore
+    except ImportError:
+        logger.warning("kenlm is not installed, skipping the comparison with it.")
+        return results
+    start = time.perf_counter()
+    kenlm_model = kenlm.Model(arpa_path)
+    results["kenlm_load_ms"] = 1000.0 * (time.perf_counter() - start)
+    kenlm_scores = []
+    state, out_state = kenlm.State(), kenlm.State()
+    kenlm_model.BeginSentenceWrite(state)
+    for word in words:
+        kenlm_scores.append(kenlm_model.BaseScore(state, word, out_state) * math.log(10))
+        state, out_state = out_state, state
+    results["max_kenlm_difference"] = float(
+        np.max(np.abs(np.subtract(scores["exact"], kenlm_scores)))
+    )
+    return results
+
+
+def benchmark_startup(
+    arpa_path: Optional[str] = None, unigrams_path: Optional[str] = None, n_loads: int = 10
+) -> Dict[str, float]:
+    """Time building a decoder from an arpa file and a word list vs loading a compiled decoder.
+
+    Building from scratch reads and upper-cases the word list, compiles the arpa file and checks
+    the alphabet coverage, as `test_with_LM.py` did before it saved a compiled decoder. Without
+    an arpa file a synthetic one is used.
+    """
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if arpa_path is None:
+            arpa_path = str(Path(tmp_dir) / "synthetic.arpa")
+            write_synthetic_arpa(arpa_path)
+        start = time.perf_counter()
+        unigrams = None
+        if unigrams_path is not None:
+            with open(unigrams_path, encoding="utf-8") as fi:
+                unigrams = [word.upper() for word in fi.read().strip().split("\n")]
+        compiled_dir = str(Path(tmp_dir) / "lm.ngram")
+        compile_arpa(arpa_path, compiled_dir, unigrams=unigrams)
+        decoder = build_ctcdecoder(LABELS, compiled_dir, unigrams=unigrams)
+        results["build_s"] = time.perf_counter() - start
+
+        artifact_dir = str(Path(tmp_dir) / "decoder")
+        os.makedirs(artifact_dir)
+        start = time.perf_counter()
+        decoder.save_to_dir(artifact_dir, compiled=True)
+        results["save_s"] = time.perf_counter() - start
+        results["artifact_mb"] = (
+            sum(path.stat().st_size for path in Path(artifact_dir).rglob("*") if path.is_file())
+            / 2**20
+        )
+        for name, verify in (("load_ms", False), ("verified_load_ms", True)):
+            start = time.perf_counter()
+            for _ in range(n_loads):
+                loaded_decoder = BeamSearchDecoderCTC.load_from_dir(artifact_dir, verify=verify)
+                loaded_decoder.cleanup()
+            results[name] = 1000.0 * (time.perf_counter() - start) / n_loads
+        results["speedup"] = 1000.0 * results["build_s"] / results["load_ms"]
+
+        # the first decoding pages in the memory-mapped arrays it touches
+        logits = make_synthetic_logits(250)
+        loaded_decoder = BeamSearchDecoderCTC.load_from_dir(artifact_dir)
+        start = time.perf_counter()
+        text = loaded_decoder.decode(logits)
+        results["first_decode_ms"] = 1000.0 * (time.perf_counter() - start)
+        if text != decoder.decode(logits):
+            logger.warning("The loaded decoder decodes differently from the built one.")
+        loaded_decoder.cleanup()
+        decoder.cleanup()
+    return results
+
+
+def benchmark_registry(
+    arpa_paths: Optional[Sequence[str]] = None,
+    n_decoders: int = 20,
+    n_utterances: int = 10,
+    n_frames: int = 250,
+    beam_width: int = 16,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Memory of building many decoders on two language models, and decoding under a budget.
+
+    Decoders are built and dropped in turn on two models, e.g. an English and a German one,
+    and on a copy of the first model's files at another path, which the registry shares by
+    content hash. Then both models decode in turn under a budget that fits only one of them,
+    so every switch evicts the other model and loads it again. Without arpa files two
+    synthetic ones are used.
+    """
+    registry = BeamSearchDecoderCTC.model_registry
+    results: Dict[str, float] = {}
+    logits_list = [make_synthetic_logits(n_frames, seed=seed + n) for n in range(n_utterances)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if arpa_paths is None:
+            arpa_paths = [str(Path(tmp_dir) / f"synthetic_{n}.arpa") for n in range(2)]
+            for n, arpa_path in enumerate(arpa_paths):
+                write_synthetic_arpa(arpa_path, n_bigrams=20000, seed=seed + n)
+        compiled_dirs = [str(Path(tmp_dir) / f"lm_{n}.ngram") for n in range(len(arpa_paths))]
+        for arpa_path, compiled_dir in zip(arpa_paths, compiled_dirs):
+            compile_arpa(arpa_path, compiled_dir)
+        copy_dir = str(Path(tmp_dir) / "copy.ngram")
+        shutil.copytree(compiled_dirs[0], copy_dir)
+        model_dirs = compiled_dirs + [copy_dir]
+        model_bytes = [
+            sum(path.stat().st_size for path in Path(compiled_dir).iterdir())
+            for compiled_dir in compiled_dirs
+        ]
+        results["model_mb"] = sum(model_bytes) / 2**20
+
+        alphabet = Alphabet.build_alphabet(LABELS)
+        decoders = []
+        start = time.perf_counter()
+        for n in range(n_decoders):
+            language_model = NgramLanguageModel(NgramModel(model_dirs[n % len(model_dirs)]))
+            decoders.append(BeamSearchDecoderCTC(alphabet, language_model))
+        results["build_ms"] = 1000.0 * (time.perf_counter() - start) / n_decoders
+        stats = registry.get_stats()
+        results["models"] = stats["models"]
+        results["resident_mb"] = stats["resident_bytes"] / 2**20
+        results["dedup_hits"] = stats["dedup_hits"]
+        del decoders
+        gc.collect()
+        results["models_after_drop"] = registry.get_stats()["models"]
+
+        decoders = [
+            BeamSearchDecoderCTC(alphabet, NgramLanguageModel(NgramModel(compiled_dir)))
+            for compiled_dir in compiled_dirs
+        ]
+        texts: Dict[str, List[str]] = {}
+        for name, max_bytes in (("unlimited", None), ("budget", max(model_bytes))):
+            registry.set_max_bytes(max_bytes)
+            stats = registry.get_stats()
+            texts[name] = []
+            start = time.perf_counter()
+            for logits in logits_list:
+                for decoder in decoders:
+                    texts[name].append(decoder.decode(logits, beam_width=beam_width))
+            results[f"{name}_ms_per_utterance"] = (
+                1000.0 * (time.perf_counter() - start) / (n_utterances * len(decoders))
+            )
+            for counter in ("loads", "evictions"):
+                results[f"{name}_{counter}"] = registry.get_stats()[counter] - stats[counter]
+        registry.set_max_bytes(None)
+        results["text_agreement"] = float(
+            np.mean([a == b for a, b in zip(texts["unlimited"], texts["budget"])])
+        )
+        for decoder in decoders:
+            decoder.cleanup()
+    return results
+
+
+def make_synthetic_vocabulary(n_words: int, seed: int = 0) -> List[str]:
+    """Make upper-case words from random stems and common English endings."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("ETAOINSRHLDCUMFPGWYBVKXJQZ"))
+    letter_probs = 1.0 / np.arange(1, len(letters) + 1)
+    letter_probs /= letter_probs.sum()
+    endings = ["", "S", "ED", "ING", "ER", "ERS", "LY", "NESS", "MENT", "'S", "ION", "IONS"]
+    words: set = set()
+    while len(words) < n_words:
+        stem = "".join(rng.choice(letters, size=rng.integers(2, 9), p=letter_probs))
+        words.update(stem + ending for ending in rng.choice(endings, size=4))
+    return sorted(words)[:n_words]
+
+
+def benchmark_unigrams(
+    unigrams_path: Optional[str] = None,
+    n_words: int = 200000,
+    n_queries: int = 200000,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Unigram set and character trie of LanguageModel vs the array-backed `UnigramDawg`.
+
+    Memory is the heap traced by tracemalloc while building each structure, for the
+    memory-mapped automaton it is what a decoder process allocates on top of the shared pages.
+    Prefix queries are the partial words of random vocabulary words plus misspelled ones, as
+    `score_partial_token` sees them during decoding.
+    """
+    if unigrams_path is None:
+        words = make_synthetic_vocabulary(n_words, seed=seed)
+    else:
+        with open(unigrams_path, encoding="utf-8") as fi:
+            words = [word.upper() for word in fi.read().strip().split("\n")]
+    rng = np.random.default_rng(seed)
+    sampled_words = [words[idx] for idx in rng.integers(len(words), size=n_queries)]
+    prefixes = [word[: rng.integers(1, len(word) + 1)] for word in sampled_words]
+    prefixes[::4] = [prefix + "Q" for prefix in prefixes[::4]]
+    queries = sampled_words[::2] + [word + "Z" for word in sampled_words[1::2]]
+    results: Dict[str, float] = {"n_words": float(len(words))}
+
+    structures: Dict[str, Any] = {}
+    for name, build in (
+        ("trie", lambda: (set(words), CharTrie.fromkeys(words))),
+        ("dawg", lambda: UnigramDawg.from_words(words)),
+    ):
+        start = time.perf_counter()
+        build()
+        results[f"{name}_build_s"] = time.perf_counter() - start
+        # tracing slows down building, so memory is traced in a second, untimed build
+        gc.collect()
+        tracemalloc.start()
+        structures[name] = build()
+        gc.collect()
+        results[f"{name}_mb"] = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        structures["dawg"].save(tmp_dir, "unigrams")
+        results["dawg_file_mb"] = (
+            sum(path.stat().st_size for path in Path(tmp_dir).iterdir()) / 2**20
+        )
+        tracemalloc.start()
+        start = time.perf_counter()
+        structures["mmap"] = UnigramDawg.load(tmp_dir, "unigrams")
+        results["mmap_load_ms"] = 1000.0 * (time.perf_counter() - start)
+        results["mmap_mb"] = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+
+        unigram_set, char_trie = structures["trie"]
+        answers: Dict[str, List[bool]] = {}
+        for name, has_prefix, contains in (
+            ("trie", lambda prefix: char_trie.has_node(prefix) > 0, unigram_set.__contains__),
+            ("dawg", structures["dawg"].has_prefix, structures["dawg"].__contains__),
+            ("mmap", structures["mmap"].has_prefix, structures["mmap"].__contains__),
+        ):
+            start = time.perf_counter()
+            answers[name] = [has_prefix(prefix) for prefix in prefixes]
+            results[f"{name}_prefix_us"] = 1e6 * (time.perf_counter() - start) / n_queries
+            start = time.perf_counter()
+            answers[name] += [contains(word) for word in queries]
+            results[f"{name}_contains_us"] = 1e6 * (time.perf_counter() - start) / n_queries
+        results["memory_ratio"] = results["trie_mb"] / results["dawg_mb"]
+        results["same_answers"] = float(answers["trie"] == answers["dawg"] == answers["mmap"])
+    return results
+
+
+def benchmark_lm_batch(
+    n_utterances: int,
+    n_frames: int,
+    beam_width: int,
+    peakiness: float = 0.8,
+    noise: float = 0.5,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """Compare scoring the words completed in a frame in one batch against one call per word.
+
+    Uses a compiled random trigram model over the benchmark words, which supports batch scoring,
+    and the same model wrapped so that the decoder falls back to scoring each word separately.
+    The cross-utterance score cache is disabled so that every word reaches the language model.
+    Less peaky logits keep more distinct words alive in the beam, which makes the batches larger.
+    """
+    logits_list = [
+        make_synthetic_logits(n_frames, peakiness=peakiness, noise=noise, seed=seed + n)
+        for n in range(n_utterances)
+    ]
+    alphabet = Alphabet.build_alphabet(LABELS)
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        arpa_path = str(Path(tmp_dir) / "synthetic.arpa")
+        write_synthetic_arpa(arpa_path, seed=seed)
+        language_model = NgramLanguageModel(compile_arpa(arpa_path, str(Path(tmp_dir) / "lm")))
+        per_word_language_model = PerWordLanguageModel(language_model)
+        for engine in (ENGINE_REFERENCE, ENGINE_SOA):
+            texts: Dict[str, List[str]] = {}
+            for name, model in (("batched", language_model), ("per_word", per_word_language_model)):
+                decoder = BeamSearchDecoderCTC(alphabet, model, engine=engine, lm_cache_bytes=0)
+                per_word_language_model.n_calls = 0
+                seconds, texts[name] = _time_decode(decoder, logits_list, beam_width=beam_width)
+                decoder.cleanup()
+                results[f"{engine}_{name}_ms_per_utterance"] = 1000.0 * seconds / n_utterances
+            results[f"{engine}_speedup"] = (
+                results[f"{engine}_per_word_ms_per_utterance"]
+                / results[f"{engine}_batched_ms_per_utterance"]
+            )
+            results[f"{engine}_per_word_lm_calls_per_utterance"] = (
+                per_word_language_model.n_calls / n_utterances
+            )
+            results[f"{engine}_top_text_agreement"] = float(
+                np.mean([a == b for a, b in zip(texts["batched"], texts["per_word"])])
+            )
+    return results
+
+
+def benchmark_hotwords(
+    n_utterances: int, n_frames: int, beam_width: int, n_hotwords: int, seed: int = 0
+) -> Dict[str, float]:
+    """Per-utterance cost of compiling the hotword scorer vs reusing the cached one.
+
+    The uncached run clears the scorer cache before every call, which is what decoding did
+    before the scorers were cached. Short utterances make the per-call overhead visible.
+    """
+    rng = np.random.default_rng(seed)
+    letters = list("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    hotwords = list(WORDS[-8:]) + [
+        "".join(rng.choice(letters, size=rng.integers(4, 12))) for _ in range(n_hotwords - 8)
+    ]
+    logits_list = [make_synthetic_logits(n_frames, seed=seed + n) for n in range(n_utterances)]
+    decoder = build_benchmark_decoder()
+    results: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    for _ in range(n_utterances):
+        HotwordScorer.build_scorer(hotwords, weight=10.0)
+    results["build_ms"] = 1000.0 * (time.perf_counter() - start) / n_utterances
+    get_hotword_scorer(hotwords, weight=10.0)
+    start = time.perf_counter()
+    for _ in range(n_utterances):
+        get_hotword_scorer(hotwords, weight=10.0)
+    results["cached_lookup_us"] = 1e6 * (time.perf_counter() - start) / n_utterances
+
+    texts: Dict[str, List[str]] = {}
+    for name in ("uncached", "cached"):
+        texts[name] = []
+        start = time.perf_counter()
+        for logits in logits_list:
+            if name == "uncached":
+                _build_hotword_scorer.cache_clear()
+            texts[name].append(decoder.decode(logits, beam_width=beam_width, hotwords=hotwords))
+        results[f"{name}_ms_per_utterance"] = (
+            1000.0 * (time.perf_counter() - start) / n_utterances
+        )
+    results["overhead_removed_ms"] = (
+        results["uncached_ms_per_utterance"] - results["cached_ms_per_utterance"]
+    )
+    results["text_agreement"] = float(
+        np.mean([a == b for a, b in zip(texts["uncached"], texts["cached"])])
+    )
+    decoder.cleanup()
+    return results
+
+
+def benchmark_adaptive_beam(
+    logits_list: List[np.ndarray],
+    beam_width: int,
+    fixed_beam_widths: Sequence[int],
+    min_beam_widths: Sequence[int],
+    references: Optional[List[str]] = None,
+) -> Dict[str, float]:
+    """Compare WER and throughput of fixed beam widths against entropy-adaptive beam widths.
+
+    The adaptive runs vary the width of each frame between a minimum and `beam_width`. Without
+    reference transcripts the top texts of the fixed `beam_width` run serve as references, so
+    the WER measures the search errors introduced by the narrower beams.
+    """
+    decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    runs = [(f"fixed_{width}", width, None) for width in fixed_beam_widths]
+    runs += [(f"adaptive_{width}_{beam_width}", beam_width, width) for width in min_beam_widths]
+    # warm up
+    decoder.decode_beams(logits_list[0], beam_width=beam_width)
+    texts: Dict[str, List[str]] = {}
+    results: Dict[str, float] = {}
+    for name, width, min_width in [("fixed_full", beam_width, None)] + runs:
+        decoder.reset_beam_width_stats()
+        start = time.perf_counter()
+        texts[name] = [
+            decoder.decode_beams(logits, beam_width=width, min_beam_width=min_width)[0].text
+            for logits in logits_list
+        ]
+        seconds = time.perf_counter() - start
+        stats = decoder.get_beam_width_stats()
+        if references is None:
+            references = texts[name]
+        results[f"{name}_wer"] = word_error_rate(references, texts[name])
+        results[f"{name}_utterances_per_s"] = len(logits_list) / seconds
+        results[f"{name}_mean_beam_width"] = stats["mean_beam_width"]
+    decoder.cleanup()
+    return results
+
+
+def benchmark_hybrid(
+    logits_list: List[np.ndarray],
+    beam_width: int,
+    greedy_prob: float,
+    collapse_prob: Optional[float] = None,
+    chunk_frames: int = 50,
+) -> Dict[str, float]:
+    """Compare full beam search against hybrid greedy/beam decoding of confident segments.
+
+    The hybrid decoding is also run through a `DecodeSession` in chunks of `chunk_frames`
+    frames, with the same `collapse_prob`. The session must return the same top text and word
+    frames as decoding all logits at once.
+    """
+    decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    seconds, texts = _time_decode(decoder, logits_list, beam_width=beam_width)
+    decoder.reset_greedy_stats()
+    hybrid_seconds, hybrid_texts = _time_decode(
+        decoder, logits_list, beam_width=beam_width, greedy_prob=greedy_prob
+    )
+    stats = decoder.get_greedy_stats()
+    decode_kwargs = dict(
+        beam_width=beam_width, greedy_prob=greedy_prob, collapse_prob=collapse_prob
+    )
+    session_agreement = []
+    for logits in logits_list:
+        beam = decoder.decode_beams(logits, **decode_kwargs)[0]  # type: ignore [arg-type]
+        session = DecodeSession(decoder, **decode_kwargs)  # type: ignore [arg-type]
+        for start in range(0, len(logits), chunk_frames):
+            session.push(logits[start : start + chunk_frames])
+        session_beam = session.finish()[0]
+        session_agreement.append(
+            (beam.text, beam.text_frames) == (session_beam.text, session_beam.text_frames)
+        )
+    decoder.cleanup()
+    return {
+        "ms_per_utterance": 1000.0 * seconds / len(logits_list),
+        "hybrid_ms_per_utterance": 1000.0 * hybrid_seconds / len(logits_list),
+        "speedup": seconds / hybrid_seconds,
+        "greedy_fraction": stats["greedy_fraction"],
+        "top_text_agreement": float(np.mean([a == b for a, b in zip(texts, hybrid_texts)])),
+        "session_agreement": float(np.mean(session_agreement)),
+    }
+
+
+def benchmark_rescore(
+    logits_list: List[np.ndarray],
+    references: Optional[List[str]],
+    beam_width: int,
+    n_best: int,
+    alphas: Sequence[float],
+    betas: Sequence[float],
+    kenlm_model_path: Optional[str] = None,
+    nbest_path: Optional[str] = None,
+    redecode: bool = False,
+) -> Dict[str, float]:
+    """Grid search alpha and beta by rescoring N-best lists of a single decoding pass.
+
+    The N-best lists are loaded from nbest_path if it exists and saved there otherwise. Without
+    reference transcripts the texts decoded without language model serve as references.
+    """
+    if kenlm_model_path is None:
+        decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    else:
+        decoder = build_ctcdecoder(LABELS, kenlm_model_path, alpha=0.7, beta=1.8)
+    if references is None:
+        acoustic_decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS))
+        references = [acoustic_decoder.decode(logits) for logits in logits_list]
+        acoustic_decoder.cleanup()
+    results: Dict[str, float] = {}
+    start = time.perf_counter()
+    if nbest_path is not None and Path(nbest_path).exists():
+        nbest_list = NBestList.load(nbest_path)
+    else:
+        nbest_list = NBestList.from_decoder(
+            decoder, logits_list, n_best=n_best, beam_width=beam_width
+        )
+        if nbest_path is not None:
+            nbest_list.save(nbest_path)
+    results["nbest_seconds"] = time.perf_counter() - start
+    results["decoded_wer"] = word_error_rate(
+        references, [texts[0] if texts else "" for texts in nbest_list.texts]
+    )
+    start = time.perf_counter()
+    grid_result = nbest_list.grid_search(references, alphas, betas)
+    results["grid_points"] = grid_result.wers.size
+    results["grid_seconds"] = time.perf_counter() - start
+    results["best_alpha"] = grid_result.alpha
+    results["best_beta"] = grid_result.beta
+    results["rescored_wer"] = grid_result.wer
+    if redecode:
+        start = time.perf_counter()
+        texts, changed_idxs = redecode_changed(
+            decoder,
+            logits_list,
+            nbest_list,
+            grid_result.alpha,
+            grid_result.beta,
+            beam_width=beam_width,
+        )
+        results["redecode_seconds"] = time.perf_counter() - start
+        results["redecoded_fraction"] = len(changed_idxs) / max(1, len(logits_list))
+        results["redecoded_wer"] = word_error_rate(references, texts)
+    decoder.cleanup()
+    return results
+
+
+def _get_latencies(
+    decoder: BeamSearchDecoderCTC, logits_list: List[np.ndarray], **decode_kwargs: object
+) -> Tuple[np.ndarray, List[str]]:
+    """Decode all logits and return the per-utterance latencies in milliseconds and top texts."""
+    # warm up
+    decoder.decode_beams(logits_list[0], **decode_kwargs)  # type: ignore
+    latencies = []
+    texts = []
+    for logits in logits_list:
+        start = time.perf_counter()
+        texts.append(decoder.decode_beams(logits, **decode_kwargs)[0].text)  # type: ignore
+        latencies.append(1000.0 * (time.perf_counter() - start))
+    return np.asarray(latencies), texts
+
+
+def benchmark_deadline(
+    logits_list: List[np.ndarray], beam_width: int, deadline_ms: float
+) -> Dict[str, float]:
+    """Compare latency percentiles of unbounded decoding against decoding with a deadline."""
+    decoder = BeamSearchDecoderCTC(Alphabet.build_alphabet(LABELS), ToyLanguageModel())
+    latencies, texts = _get_latencies(decoder, logits_list, beam_width=beam_width)
+    deadline_latencies, deadline_texts = _get_latencies(
+        decoder, logits_list, beam_width=beam_width, deadline_ms=deadline_ms
+    )
+    decoder.reset_deadline_stats()
+    # stats of the timed calls only, without the warm up
+    for logits in logits_list:
+        decoder.decode_beams(logits, beam_width=beam_width, deadline_ms=deadline_ms)
+    stats = decoder.get_deadline_stats()
+    decoder.cleanup()
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "deadline_p50_ms": float(np.percentile(deadline_latencies, 50)),
+        "deadline_p95_ms": float(np.percentile(deadline_latencies, 95)),
+        "missed_fraction": stats["missed_fraction"],
+        "degraded_fraction": stats["degraded_fraction"],
+        "degraded_step_fraction": stats["degraded_step_fraction"],
+        "top_text_agreement": float(np.mean([a == b for a, b in zip(texts, deadline_texts)])),
+    }
+
+
+def benchmark_grammar(
+    logits_list: List[np.ndarray], beam_widths: Sequence[int], n_words: int
+) -> Dict[str, float]:
+    """Compare unconstrained decoding against decoding constrained to a word list.
+
+    The grammar is a loop over the first `n_words` benchmark words, which cover every word of
+    the synthetic utterances if `n_words` is the full list. The top texts of the widest
+    unconstrained run serve as references, so the WER of a constrained run with a narrow beam
+    shows how much of the search the grammar makes unnecessary. Synthetic utterances can end
+    mid-word, the constrained decoding then returns no text, which counts as not accepted.
+    """
+    alphabet = Alphabet.build_alphabet(LABELS)
+    decoder = BeamSearchDecoderCTC(alphabet, ToyLanguageModel())
+    grammar = Grammar.from_words(WORDS[:n_words])
+    start = time.perf_counter()
+    grammar.get_token_automaton(alphabet)
+    results: Dict[str, float] = {"automaton_ms": 1000.0 * (time.perf_counter() - start)}
+    references: Optional[List[str]] = None
+    for beam_width in sorted(beam_widths, reverse=True):
+        for name, run_grammar in (("plain", None), ("grammar", grammar)):
+            seconds, texts = _time_decode(
+                decoder, logits_list, beam_width=beam_width, grammar=run_grammar
+            )
+            decoder.reset_counters()
+            for logits in logits_list:
+                decoder.decode_beams(
+                    logits, beam_width=beam_width, grammar=run_grammar, collect_counters=True
+                )
+            counters = sum_counters(decoder.get_counters())
+            if references is None:
+                references = texts
+            prefix = f"{name}_{beam_width}"
+            results[f"{prefix}_ms_per_utterance"] = 1000.0 * seconds / len(logits_list)
+            results[f"{prefix}_expanded_per_frame"] = counters["beams_expanded"] / max(
+                counters["frames"], 1
+            )
+            results[f"{prefix}_wer"] = word_error_rate(references, texts)
+            results[f"{prefix}_accepted"] = float(np.mean([grammar.accepts(t) for t in texts]))
+    decoder.cleanup()
+    return results
+
+
+def _print_results(title: str, results: Dict[str, float]) -> None:
+    print(title)
+    for key, value in results.items():
+        print(f"  {key:>32}: {value:.3f}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    suite_parser = subparsers.add_parser(
+        "suite", help="frames/s, real-time factor and peak memory of the decoder methods"
+    )
+    suite_parser.add_argument("--n-utterances", type=int, default=10)
+    suite_parser.add_argument("--n-frames", type=int, nargs="+", default=[250, 1000])
+    suite_parser.add_argument("--beam-widths", type=int, nargs="+", default=[16, 64])
+    suite_parser.add_argument("--methods", nargs="+", choices=SUITE_METHODS, default=SUITE_METHODS)
+    suite_parser.add_argument("--peakiness", type=float, default=0.95)
+    suite_parser.add_argument("--noise", type=float, default=0.3)
+    suite_parser.add_argument("--chunk-frames", type=int, default=50)
+    suite_parser.add_argument(
+        "--engine", choices=[ENGINE_REFERENCE, ENGINE_SOA], default=ENGINE_REFERENCE
+    )
+    suite_parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    suite_parser.add_argument("--output", help="json file to save the results to")
+    suite_parser.add_argument("--compare", help="json file of an earlier run to compare with")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    long_form_parser = subparsers.add_parser(
+        "long-form", help="real-time factor and peak memory of windowed long-form transcription"
+    )
+    long_form_parser.add_argument("--durations-s", type=float, nargs="+", default=[30, 120])
+    long_form_parser.add_argument("--beam-width", type=int, default=16)
+    long_form_parser.add_argument("--window-s", type=float, default=DEFAULT_WINDOW_S)
+    long_form_parser.add_argument("--overlap-s", type=float, default=DEFAULT_OVERLAP_S)
+    long_form_parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    long_form_parser.add_argument("--seed", type=int, default=0)
+    engines_parser = subparsers.add_parser(
+        "engines", help="reference vs struct-of-arrays decoding engine"
+    )
+    engines_parser.add_argument("--n-utterances", type=int, default=20)
+    engines_parser.add_argument("--n-frames", type=int, default=250)
+    engines_parser.add_argument("--beam-width", type=int, default=80)
+    engines_parser.add_argument("--seed", type=int, default=0)
+    collapse_parser = subparsers.add_parser(
+        "collapse", help="frame run collapsing pre-pass vs full frame rate decoding"
+    )
+    collapse_parser.add_argument("--n-utterances", type=int, default=20)
+    collapse_parser.add_argument("--n-frames", type=int, default=250)
+    collapse_parser.add_argument("--beam-width", type=int, default=80)
+    collapse_parser.add_argument("--collapse-prob", type=float, default=0.99)
+    collapse_parser.add_argument("--peakiness", type=float, default=0.995)
+    collapse_parser.add_argument("--seed", type=int, default=0)
+    candidates_parser = subparsers.add_parser(
+        "candidates", help="per-frame vs vectorized candidate token selection, top-k cap"
+    )
+    candidates_parser.add_argument("--n-utterances", type=int, default=20)
+    candidates_parser.add_argument("--n-frames", type=int, default=250)
+    candidates_parser.add_argument("--beam-width", type=int, default=16)
+    candidates_parser.add_argument(
+        "--vocab-sizes", type=int, nargs="+", default=[32, 256, 1000, 5000]
+    )
+    candidates_parser.add_argument("--token-min-logp", type=float, default=-8.0)
+    candidates_parser.add_argument("--token-top-k", type=int, default=8)
+    candidates_parser.add_argument("--seed", type=int, default=0)
+    service_parser = subparsers.add_parser(
+        "service", help="decoder service throughput as the number of workers grows"
+    )
+    service_parser.add_argument("--n-utterances", type=int, default=64)
+    service_parser.add_argument("--n-frames", type=int, default=250)
+    service_parser.add_argument("--beam-width", type=int, default=80)
+    service_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    service_parser.add_argument("--start-method", choices=["fork", "spawn", "forkserver"])
+    service_parser.add_argument("--seed", type=int, default=0)
+    lm_cache_parser = subparsers.add_parser(
+        "lm-cache", help="cross-utterance language model score cache vs per-utterance caching"
+    )
+    lm_cache_parser.add_argument("--n-utterances", type=int, default=100)
+    lm_cache_parser.add_argument("--n-frames", type=int, default=250)
+    lm_cache_parser.add_argument("--beam-width", type=int, default=80)
+    lm_cache_parser.add_argument("--lm-cache-bytes", type=int, default=DEFAULT_LM_CACHE_BYTES)
+    lm_cache_parser.add_argument("--logits-dir", help="directory of saved .npy logits")
+    lm_cache_parser.add_argument("--kenlm-model", help="KenLM model, defaults to the stand-in lm")
+    lm_cache_parser.add_argument("--seed", type=int, default=0)
+    ngram_lm_parser = subparsers.add_parser(
+        "ngram-lm", help="compiled memory-mapped n-gram model, load time and scoring"
+    )
+    ngram_lm_parser.add_argument("--arpa", required=True, help="arpa file to compile")
+    ngram_lm_parser.add_argument("--n-words", type=int, default=100000)
+    ngram_lm_parser.add_argument("--seed", type=int, default=0)
+    startup_parser = subparsers.add_parser(
+        "startup", help="building a decoder from an arpa file vs loading a compiled decoder"
+    )
+    startup_parser.add_argument("--arpa", help="arpa file, defaults to a synthetic one")
+    startup_parser.add_argument("--unigrams", help="word list with one word per line")
+    startup_parser.add_argument("--n-loads", type=int, default=10)
+    registry_parser = subparsers.add_parser(
+        "registry", help="language model registry, shared models and decoding under a budget"
+    )
+    registry_parser.add_argument("--arpa", nargs="+", help="arpa files, default two synthetic")
+    registry_parser.add_argument("--n-decoders", type=int, default=20)
+    registry_parser.add_argument("--n-utterances", type=int, default=10)
+    registry_parser.add_argument("--n-frames", type=int, default=250)
+    registry_parser.add_argument("--beam-width", type=int, default=16)
+    registry_parser.add_argument("--seed", type=int, default=0)
+    unigrams_parser = subparsers.add_parser(
+        "unigrams", help="unigram set and character trie vs the array-backed unigram automaton"
+    )
+    unigrams_parser.add_argument("--unigrams", help="word list, defaults to a synthetic one")
+    unigrams_parser.add_argument("--n-words", type=int, default=200000)
+    unigrams_parser.add_argument("--n-queries", type=int, default=200000)
+    unigrams_parser.add_argument("--seed", type=int, default=0)
+    lm_batch_parser = subparsers.add_parser(
+        "lm-batch", help="batched language model scoring per frame vs one call per word"
+    )
+    lm_batch_parser.add_argument("--n-utterances", type=int, default=20)
+    lm_batch_parser.add_argument("--n-frames", type=int, default=250)
+    lm_batch_parser.add_argument("--beam-width", type=int, default=80)
+    lm_batch_parser.add_argument("--peakiness", type=float, default=0.8)
+    lm_batch_parser.add_argument("--noise", type=float, default=0.5)
+    lm_batch_parser.add_argument("--seed", type=int, default=0)
+    hotwords_parser = subparsers.add_parser(
+        "hotwords", help="compiling the hotword scorer per utterance vs the cached scorer"
+    )
+    hotwords_parser.add_argument("--n-utterances", type=int, default=50)
+    hotwords_parser.add_argument("--n-frames", type=int, default=50)
+    hotwords_parser.add_argument("--beam-width", type=int, default=16)
+    hotwords_parser.add_argument("--n-hotwords", type=int, default=500)
+    hotwords_parser.add_argument("--seed", type=int, default=0)
+    adaptive_beam_parser = subparsers.add_parser(
+        "adaptive-beam", help="WER vs throughput of entropy-adaptive and fixed beam widths"
+    )
+    adaptive_beam_parser.add_argument("--n-utterances", type=int, default=20)
+    adaptive_beam_parser.add_argument("--n-frames", type=int, default=250)
+    adaptive_beam_parser.add_argument("--beam-width", type=int, default=80)
+    adaptive_beam_parser.add_argument("--fixed-beam-widths", type=int, nargs="+", default=[8, 32])
+    adaptive_beam_parser.add_argument("--min-beam-widths", type=int, nargs="+", default=[4, 16])
+    adaptive_beam_parser.add_argument("--peakiness", type=float, default=0.95)
+    adaptive_beam_parser.add_argument("--logits-dir", help="directory of saved <ID>.npy logits")
+    adaptive_beam_parser.add_argument("--references", help="csv with the ID and wrd columns")
+    adaptive_beam_parser.add_argument("--seed", type=int, default=0)
+    hybrid_parser = subparsers.add_parser(
+        "hybrid", help="greedy decoding of confident segments vs full beam search"
+    )
+    hybrid_parser.add_argument("--n-utterances", type=int, default=20)
+    hybrid_parser.add_argument("--n-frames", type=int, default=250)
+    hybrid_parser.add_argument("--beam-width", type=int, default=80)
+    hybrid_parser.add_argument("--greedy-prob", type=float, default=0.9)
+    hybrid_parser.add_argument("--collapse-prob", type=float, help="also collapse frames")
+    hybrid_parser.add_argument("--chunk-frames", type=int, default=50)
+    hybrid_parser.add_argument("--peakiness", type=float, default=0.95)
+    hybrid_parser.add_argument("--logits-dir", help="directory of saved .npy logits")
+    hybrid_parser.add_argument("--seed", type=int, default=0)
+    deadline_parser = subparsers.add_parser(
+        "deadline", help="latency percentiles with a per-utterance deadline vs unbounded decoding"
+    )
+    deadline_parser.add_argument("--n-utterances", type=int, default=20)
+    deadline_parser.add_argument("--n-frames", type=int, default=250)
+    deadline_parser.add_argument("--beam-width", type=int, default=80)
+    deadline_parser.add_argument("--deadline-ms", type=float, default=50.0)
+    deadline_parser.add_argument("--logits-dir", help="directory of saved .npy logits")
+    deadline_parser.add_argument("--seed", type=int, default=0)
+    grammar_parser = subparsers.add_parser(
+        "grammar", help="decoding constrained to a word list vs unconstrained decoding"
+    )
+    grammar_parser.add_argument("--n-utterances", type=int, default=20)
+    grammar_parser.add_argument("--n-frames", type=int, default=250)
+    grammar_parser.add_argument("--beam-widths", type=int, nargs="+", default=[64, 16, 4])
+    grammar_parser.add_argument("--n-words", type=int, default=len(WORDS))
+    grammar_parser.add_argument("--logits-dir", help="directory of saved .npy logits")
+    grammar_parser.add_argument("--seed", type=int, default=0)
+    rescore_parser = subparsers.add_parser(
+        "rescore", help="alpha/beta grid search by rescoring the N-best lists of one decoding"
+    )
+    rescore_parser.add_argument("--n-utterances", type=int, default=20)
+    rescore_parser.add_argument("--n-frames", type=int, default=250)
+    rescore_parser.add_argument("--beam-width", type=int, default=128)
+    rescore_parser.add_argument("--n-best", type=int, default=32)
+    rescore_parser.add_argument(
+        "--alphas", type=float, nargs="+", default=np.linspace(0.0, 2.0, 21).tolist()
+    )
+    rescore_parser.add_argument(
+        "--betas", type=float, nargs="+", default=np.linspace(-1.0, 4.0, 21).tolist()
+    )
+    rescore_parser.add_argument("--logits-dir", help="directory of saved <ID>.npy logits")
+    rescore_parser.add_argument("--references", help="csv with the ID and wrd columns")
+    rescore_parser.add_argument("--kenlm-model", help="KenLM model, defaults to the stand-in lm")
+    rescore_parser.add_argument("--nbest-file", help=".npz file to load or save the N-best lists")
+    rescore_parser.add_argument(
+        "--redecode", action="store_true", help="decode the changed utterances again"
+    )
+    rescore_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.benchmark == "suite":
+        rows = benchmark_suite(
+            args.n_utterances,
+            args.n_frames,
+            args.beam_widths,
+            args.methods,
+            peakiness=args.peakiness,
+            noise=args.noise,
+            chunk_frames=args.chunk_frames,
+            engine=args.engine,
+            measure_memory=not args.no_memory,
+            seed=args.seed,
+        )
+        if args.compare is not None:
+            with open(args.compare, "r") as fi:
+                rows = compare_suite_results(rows, json.load(fi)["results"])
+        for row in rows:
+            _print_results(
+                f"{row['method']}, beam_width={row['beam_width']}, n_frames={row['n_frames']}:",
+                {key: value for key, value in row.items() if isinstance(value, float)},
+            )
+        if args.output is not None:
+            config = {
+                key: value for key, value in vars(args).items() if key not in ("output", "compare")
+            }
+            config["python"] = platform.python_version()
+            config["numpy"] = np.__version__
+            with open(args.output, "w") as fi:
+                json.dump({"config": config, "results": rows}, fi, indent=2)
+
+    elif args.benchmark == "long-form":
+        rows = benchmark_long_form(
+            args.durations_s,
+            args.beam_width,
+            window_s=args.window_s,
+            overlap_s=args.overlap_s,
+            measure_memory=not args.no_memory,
+            seed=args.seed,
+        )
+        for row in rows:
+            _print_results(
+                f"long-form, {row['duration_s']:.0f} s, beam_width={args.beam_width}:",
+                {key: value for key, value in row.items() if isinstance(value, (int, float))},
+            )
+    elif args.benchmark == "engines":
+        for with_lm in (False, True):
+            results = benchmark_engines(
+                args.n_utterances, args.n_frames, args.beam_width, with_lm, seed=args.seed
+            )
+            _print_results(
+                f"engines, beam_width={args.beam_width}, "
+                f"{'stand-in lm' if with_lm else 'no lm'}:",
+                results,
+            )
+    elif args.benchmark == "collapse":
+        results = benchmark_collapse(
+            args.n_utterances,
+            args.n_frames,
+            args.beam_width,
+            args.collapse_prob,
+            args.peakiness,
+            seed=args.seed,
+        )
+        _print_results(
+            f"collapse, beam_width={args.beam_width}, collapse_prob={args.collapse_prob}:",
+            results,
+        )
+    elif args.benchmark == "candidates":
+        rows = benchmark_candidates(
+            args.n_utterances,
+            args.n_frames,
+            args.beam_width,
+            args.vocab_sizes,
+            args.token_min_logp,
+            args.token_top_k,
+            seed=args.seed,
+        )
+        for row in rows[:-1]:
+            _print_results(f"candidates, vocab_size={row['vocab_size']:.0f}:", row)
+        _print_results(
+            f"candidates, decoding with token_top_k={args.token_top_k}, "
+            f"token_min_logp={args.token_min_logp}:",
+            rows[-1],
+        )
+    elif args.benchmark == "service":
+        results = benchmark_service(
+            args.n_utterances,
+            args.n_frames,
+            args.beam_width,
+            args.workers,
+            args.start_method,
+            seed=args.seed,
+        )
+        _print_results(
+            f"service, beam_width={args.beam_width}, start_method={args.start_method}:", results
+        )
+    elif args.benchmark == "lm-cache":
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+        results = benchmark_lm_cache(
+            logits_list, args.beam_width, args.lm_cache_bytes, args.kenlm_model
+        )
+        _print_results(
+            f"lm-cache, beam_width={args.beam_width}, {len(logits_list)} utterances:", results
+        )
+    elif args.benchmark == "ngram-lm":
+        results = benchmark_ngram_lm(args.arpa, args.n_words, seed=args.seed)
+        _print_results(f"ngram-lm, {args.arpa}:", results)
+    elif args.benchmark == "startup":
+        results = benchmark_startup(args.arpa, args.unigrams, args.n_loads)
+        _print_results(f"startup, {args.arpa or 'synthetic arpa'}:", results)
+    elif args.benchmark == "registry":
+        results = benchmark_registry(
+            args.arpa,
+            args.n_decoders,
+            args.n_utterances,
+            args.n_frames,
+            args.beam_width,
+            seed=args.seed,
+        )
+        _print_results(f"registry, {args.n_decoders} decoders:", results)
+    elif args.benchmark == "unigrams":
+        results = benchmark_unigrams(args.unigrams, args.n_words, args.n_queries, seed=args.seed)
+        _print_results(f"unigrams, {args.unigrams or 'synthetic vocabulary'}:", results)
+    elif args.benchmark == "lm-batch":
+        results = benchmark_lm_batch(
+            args.n_utterances,
+            args.n_frames,
+            args.beam_width,
+            args.peakiness,
+            args.noise,
+            seed=args.seed,
+        )
+        _print_results(f"lm-batch, beam_width={args.beam_width}:", results)
+    elif args.benchmark == "hotwords":
+        results = benchmark_hotwords(
+            args.n_utterances, args.n_frames, args.beam_width, args.n_hotwords, seed=args.seed
+        )
+        _print_results(
+            f"hotwords, {args.n_hotwords} hotwords, n_frames={args.n_frames}:", results
+        )
+    elif args.benchmark == "adaptive-beam":
+        references = None
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, peakiness=args.peakiness, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+            if args.references is not None:
+                transcripts = load_references(args.references)
+                paths = sorted(Path(args.logits_dir).glob("*.npy"))[: args.n_utterances]
+                references = [transcripts[path.stem] for path in paths]
+        results = benchmark_adaptive_beam(
+            logits_list,
+            args.beam_width,
+            args.fixed_beam_widths,
+            args.min_beam_widths,
+            references,
+        )
+        _print_results(
+            f"adaptive-beam, beam_width={args.beam_width}, {len(logits_list)} utterances:", results
+        )
+
+    elif args.benchmark == "hybrid":
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, peakiness=args.peakiness, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+        results = benchmark_hybrid(
+            logits_list, args.beam_width, args.greedy_prob, args.collapse_prob, args.chunk_frames
+        )
+        _print_results(
+            f"hybrid, beam_width={args.beam_width}, greedy_prob={args.greedy_prob}, "
+            f"collapse_prob={args.collapse_prob}:",
+            results,
+        )
+
+    elif args.benchmark == "deadline":
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+        results = benchmark_deadline(logits_list, args.beam_width, args.deadline_ms)
+        _print_results(
+            f"deadline, beam_width={args.beam_width}, deadline_ms={args.deadline_ms}:", results
+        )
+
+    elif args.benchmark == "grammar":
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+        results = benchmark_grammar(logits_list, args.beam_widths, args.n_words)
+        _print_results(f"grammar, {args.n_words} words, {len(logits_list)} utterances:", results)
+
+    elif args.benchmark == "rescore":
+        references = None
+        if args.logits_dir is None:
+            logits_list = [
+                make_synthetic_logits(args.n_frames, seed=args.seed + n)
+                for n in range(args.n_utterances)
+            ]
+        else:
+            logits_list = load_logits_dir(args.logits_dir, args.n_utterances)
+            if args.references is not None:
+                transcripts = load_references(args.references)
+                paths = sorted(Path(args.logits_dir).glob("*.npy"))[: args.n_utterances]
+                references = [transcripts[path.stem] for path in paths]
+        results = benchmark_rescore(
+            logits_list,
+            references,
+            args.beam_width,
+            args.n_best,
+            args.alphas,
+            args.betas,
+            args.kenlm_model,
+            args.nbest_file,
+            args.redecode,
+        )
+        _print_results(
+            f"rescore, beam_width={args.beam_width}, n_best={args.n_best}, "
+            f"{len(logits_list)} utterances:",
+            results,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,13 @@ SPECIAL_TOKEN_PTN = re.compile(r"^[<\[].+[>\]]$")
 BLANK_TOKEN_PTN = re.compile(r"^[<\[]pad[>\]]$", flags=re.IGNORECASE)
 UNK_TOKEN_PTN = re.compile(r"^[<\[]unk[>\]]$", flags=re.IGNORECASE)
 
+# token classes of the normalized labels, used by the decoder for integer dispatch
+TOKEN_BLANK = 0  # CTC blank ''
+TOKEN_SPACE = 1  # word separator ' ' of a regular alphabet
+TOKEN_WORD_START = 2  # bpe token that starts a new word, e.g. '▁the'
+TOKEN_WORD_INTERNAL = 3  # token that continues the current word
+TOKEN_NEVER_EMIT = 4  # special token that CTC does not emit, e.g. '<bos>' or '<eos>'
+
 logger = logging.getLogger(__name__)
 
 
@@ -120,11 +127,29 @@ def _verify_alphabet(labels: List[str], is_bpe: bool) -> None:
         raise ValueError("Space token ' ' found in vocabulary even though it looks like BPE.")
 
 
+def _get_token_classes(labels: List[str], is_bpe: bool) -> List[int]:
+    """Classify normalized labels, blank and unk tokens are already substituted at this point."""
+    token_classes = []
+    for label in labels:
+        if label == "":
+            token_classes.append(TOKEN_BLANK)
+        elif SPECIAL_TOKEN_PTN.match(label):
+            token_classes.append(TOKEN_NEVER_EMIT)
+        elif is_bpe and label[:1] == BPE_TOKEN:
+            token_classes.append(TOKEN_WORD_START)
+        elif not is_bpe and label == " ":
+            token_classes.append(TOKEN_SPACE)
+        else:
+            token_classes.append(TOKEN_WORD_INTERNAL)
+    return token_classes
+
+
 class Alphabet:
     def __init__(self, labels: List[str], is_bpe: bool) -> None:
         """Init."""
         self._labels = labels
         self._is_bpe = is_bpe
+        self._token_classes = _get_token_classes(labels, is_bpe)
 
     @property
     def is_bpe(self) -> bool:
@@ -136,6 +161,11 @@ class Alphabet:
         """Deep copy of the labels."""
         return self._labels[:]  # this is a copy
 
+    @property
+    def token_classes(self) -> List[int]:
+        """Token class of each label, one of the `TOKEN_*` constants."""
+        return self._token_classes[:]  # this is a copy
+
     @classmethod
     def build_alphabet(cls, labels: List[str]) -> "Alphabet":
         """Make an alphabet from labels in standardized format for decoder."""
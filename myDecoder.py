@@ -1,9 +1,12 @@
-
 from __future__ import annotations, division
 
+from collections import OrderedDict
+import copy
 import dataclasses
 import functools
 import heapq
+import itertools
+import json
 import logging
 import math
 import multiprocessing as mp
@@ -11,6 +14,7 @@ from multiprocessing.pool import Pool
 import os
 from pathlib import Path
 import sys
+import time
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -24,11 +28,30 @@ from typing import (
     TypeVar,
     Union,
 )
+import weakref
 
 import numpy as np
 from numpy.typing import NBitBase, NDArray
 
-from myAlphabet import BPE_TOKEN, Alphabet, verify_alphabet_coverage
+from myAlphabet import (
+    BPE_TOKEN,
+    TOKEN_BLANK,
+    TOKEN_NEVER_EMIT,
+    TOKEN_SPACE,
+    TOKEN_WORD_START,
+    Alphabet,
+    verify_alphabet_coverage,
+)
+from myGrammar import Grammar, TokenAutomaton
+from myLanguageModel import (
+    COMPILED_LM_SUFFIX,
+    BatchLanguageModel,
+    DawgLanguageModel,
+    LanguageModelRegistry,
+    NgramLanguageModel,
+    NgramModel,
+    get_content_hash,
+)
 from pyctcdecode.constants import (
     DEFAULT_ALPHA,
     DEFAULT_BEAM_WIDTH,
@@ -59,6 +82,9 @@ except ImportError:
         "kenlm python bindings are not installed. Most likely you want to install it using: "
         "pip install https://github.com/kpu/kenlm/archive/master.zip"
     )
+    _KENLM_AVAILABLE = False
+else:
+    _KENLM_AVAILABLE = True
 
 # type hints
 # store frame information for each word, where frame is the logit index of (start_frame, end_frame)
@@ -66,11 +92,107 @@ Frames = Tuple[int, int]
 WordFrames = Tuple[str, Frames]
 
 
+class TextTrie:
+    def __init__(self, lm_order: int = 1) -> None:
+        """Append-only prefix trie of the words of all beam texts of an utterance.
+
+        Beams refer to nodes of the trie instead of holding their text as a string, so extending a
+        text by a word is a dictionary lookup and texts can be hashed and compared by identity.
+        The last words of a text that can still affect n-gram scoring are interned to an integer
+        context id when a node is created, which makes history pruning an integer lookup as well.
+
+        Args:
+            lm_order: order of the n-gram language model, defines how many words a context holds
+        """
+        self.lm_order = lm_order
+        self.n_history = max(1, lm_order - 1)
+        self.context_words: List[Tuple[str, ...]] = [()]
+        self._context_ids: Dict[Tuple[str, ...], int] = {(): 0}
+        self.root = TextNode(self, None, "")
+
+    def get_context_id(self, parent_context_id: int, word: str) -> int:
+        """Get the id of the context after appending word to a context."""
+        context = (self.context_words[parent_context_id] + (word,))[-self.n_history :]
+        context_id = self._context_ids.get(context)
+        if context_id is None:
+            context_id = len(self.context_words)
+            self.context_words.append(context)
+            self._context_ids[context] = context_id
+        return context_id
+
+    def release(self) -> None:
+        """Break the links from parents to children of a trie that is no longer used.
+
+        Nodes refer to their parent and their children, so a dropped trie is only freed by a full
+        garbage collection. Unlinking it lets reference counting free it right away, which keeps
+        the memory of long decoding sessions flat.
+        """
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node._children is not None:  # pylint: disable=protected-access
+                nodes.extend(node._children.values())  # pylint: disable=protected-access
+                node._children = None  # pylint: disable=protected-access
+        self.context_words = [()]
+        self._context_ids = {(): 0}
+
+
+class TextNode:
+    """Node of a TextTrie, standing for the text made of the words on the path from the root."""
+
+    __slots__ = ("trie", "parent", "word", "n_words", "context_id", "_children")
+
+    def __init__(self, trie: TextTrie, parent: Optional[TextNode], word: str) -> None:
+        """Init, use `TextTrie.root` and `TextNode.extend` to get nodes."""
+        self.trie = trie
+        self.parent = parent
+        self.word = word
+        self.n_words = 0 if parent is None else parent.n_words + 1
+        self.context_id = 0 if parent is None else trie.get_context_id(parent.context_id, word)
+        self._children: Optional[Dict[str, TextNode]] = None
+
+    def extend(self, word: str) -> TextNode:
+        """Get the node of this text followed by word, an empty word leaves the text unchanged."""
+        if len(word) == 0:
+            return self
+        if self._children is None:
+            self._children = {}
+        node = self._children.get(word)
+        if node is None:
+            node = TextNode(self.trie, self, word)
+            self._children[word] = node
+        return node
+
+    @property
+    def context(self) -> Tuple[str, ...]:
+        """Last words of the text that can affect n-gram scoring."""
+        return self.trie.context_words[self.context_id]
+
+    @property
+    def words(self) -> List[str]:
+        """Words of the text."""
+        words = []
+        node: Optional[TextNode] = self
+        while node is not None and node.parent is not None:
+            words.append(node.word)
+            node = node.parent
+        return words[::-1]
+
+    @property
+    def text(self) -> str:
+        """Text of the node, built from the words on the path from the root."""
+        return " ".join(self.words)
+
+    def __repr__(self) -> str:
+        """Repr."""
+        return f"TextNode({self.text!r})"
+
+
 @dataclasses.dataclass(frozen=True)
 class Beam:
     """Contains all the info needed for decoding a beam."""
 
-    text: str
+    text_node: TextNode
     next_word: str
     partial_word: str
     last_char: Optional[str]
@@ -82,7 +204,7 @@ class Beam:
     def from_lm_beam(cls, lm_beam: LMBeam) -> "Beam":
         """Create a Beam from an LMBeam by stripping out the LM score."""
         return Beam(
-            text=lm_beam.text,
+            text_node=lm_beam.text_node,
             next_word=lm_beam.next_word,
             partial_word=lm_beam.partial_word,
             last_char=lm_beam.last_char,
@@ -91,6 +213,11 @@ class Beam:
             logit_score=lm_beam.logit_score,
         )
 
+    @property
+    def text(self) -> str:
+        """Text of the completed words, only built on request."""
+        return self.text_node.text
+
 
 @dataclasses.dataclass(frozen=True)
 class LMBeam(Beam):
@@ -108,6 +235,7 @@ class OutputBeam:
     text_frames: List[WordFrames]
     logit_score: float  # Cumulative logit score
     lm_score: float  # Cumulative language model + logit score
+    counters: Optional[Dict[str, float]] = None  # hot path counters, see `collect_counters`
 
     def get_mp_safe_beam(self) -> "OutputBeam":
         """Get a multiprocessing-safe version of the beam."""
@@ -118,16 +246,100 @@ class OutputBeam:
         return dataclasses.replace(self, last_lm_state=last_lm_state)
 
 
+@dataclasses.dataclass(frozen=True)
+class DeadlineReport:
+    """Outcome of a decoding call with a `deadline_ms` latency budget."""
+
+    deadline_ms: float
+    elapsed_ms: float  # wall time of the decoding call
+    degraded: bool  # whether the beam width or pruning threshold were tightened
+    degraded_steps: int  # decoding steps run with a reduced beam width or pruning threshold
+    n_steps: int  # decoding steps of the call
+    min_beam_width: int  # smallest beam width used
+    max_beam_prune_logp: float  # tightest pruning threshold used
+
+
+@dataclasses.dataclass
+class DecodeCounters:
+    """Hot path counters of a decoding call, collected with `collect_counters=True`."""
+
+    frames: int = 0  # decoding steps
+    beams_expanded: int = 0  # candidate beams from extending the live beams by a token
+    beams_merged: int = 0  # candidates merged into one with the same prefix
+    beams_pruned_score: int = 0  # beams scoring below the best one + beam_prune_logp
+    beams_pruned_width: int = 0  # beams beyond the beam width
+    beams_pruned_history: int = 0  # beams removed by history pruning
+    lm_lookups: int = 0  # words whose language model score was needed
+    lm_calls: int = 0  # words scored by the language model, the other lookups hit a cache
+    expand_seconds: float = 0.0  # time spent expanding and merging beams
+    lm_seconds: float = 0.0  # time spent in language model scoring
+    seconds: float = 0.0  # wall time of the decoding call
+
+    def count_frame(
+        self, n_expanded: int, n_merged: int, n_kept: int, n_trimmed: int, n_beams: int
+    ) -> None:
+        """Add the beam counts of a decoding step, from expansion down to the surviving beams."""
+        self.frames += 1
+        self.beams_expanded += n_expanded
+        self.beams_merged += n_expanded - n_merged
+        self.beams_pruned_score += n_merged - n_kept
+        self.beams_pruned_width += n_kept - n_trimmed
+        self.beams_pruned_history += n_trimmed - n_beams
+
+    def to_dict(self) -> Dict[str, float]:
+        """Get the counters as a dictionary, including the language model cache hits."""
+        counters = dataclasses.asdict(self)
+        counters["lm_cache_hits"] = self.lm_lookups - self.lm_calls
+        return counters
+
+
+def sum_counters(counters_list: Iterable[Dict[str, float]]) -> Dict[str, float]:
+    """Sum the counters of several decoding calls, e.g. the `OutputBeam.counters` of a batch."""
+    total: Dict[str, float] = DecodeCounters().to_dict()
+    for counters in counters_list:
+        for key, value in counters.items():
+            total[key] += value
+    return total
+
+
 # Key for the language model score cache
 # text, is_eos
-LMScoreCacheKey = Tuple[str, bool]
-# LM score with hotword score, raw LM score, AbstracatLMState
-LMScoreCacheValue = Tuple[float, float, AbstractLMState]
+LMScoreCacheKey = Tuple[TextNode, bool]
+# LM score with hotword score, raw LM score, AbstracatLMState (None without language model)
+LMScoreCacheValue = Tuple[float, float, Optional[AbstractLMState]]
 LMScoreCache = Dict[LMScoreCacheKey, LMScoreCacheValue]
+# Key for the cross-utterance language model score cache
+# last words of the history (at most LM order - 1), word, is_eos
+SharedLMScoreKey = Tuple[Tuple[str, ...], str, bool]
+# LM score of the word, AbstractLMState after the word
+SharedLMScoreValue = Tuple[float, AbstractLMState]
 
 # constants
 NULL_FRAMES: Frames = (-1, -1)  # placeholder that gets replaced with positive integer frame indices
-EMPTY_START_BEAM = Beam("", "", "", None, [], NULL_FRAMES, 0.0)
+
+# decoding engines
+ENGINE_REFERENCE = "reference"  # one Beam dataclass per hypothesis and frame
+ENGINE_SOA = "soa"  # live beam set kept in preallocated struct-of-arrays
+DECODING_ENGINES = (ENGINE_REFERENCE, ENGINE_SOA)
+
+# byte budget of the cross-utterance language model score cache, 0 disables it
+DEFAULT_LM_CACHE_BYTES = 64 * 1024 * 1024
+# approximate size of a cache entry without its strings: ordered dict slot, key and value tuples,
+# score float and language model state
+_LM_CACHE_ENTRY_BYTES = 480
+
+# deadline: tightest pruning threshold the beam_prune_logp is raised to when running late
+DEADLINE_MAX_PRUNE_LOGP = -1.0
+# deadline: decoding steps timed after an adjustment before the projection is trusted again
+DEADLINE_MIN_TIMED_STEPS = 4
+
+# number of compiled hotword scorers kept per process, see `get_hotword_scorer`
+HOTWORD_SCORER_CACHE_SIZE = 32
+
+# adaptive beam width: frame posterior entropy (nats) at which 1 - 1/e of the extra width is used
+ADAPTIVE_BEAM_ENTROPY_SCALE = 0.5
+# adaptive beam width: candidates within this log score of the best one count as competing
+ADAPTIVE_BEAM_SCORE_MARGIN = -2.0
 
 
 # Generic float type
@@ -143,6 +355,203 @@ FloatVar = TypeVar("FloatVar", bound=NpFloat)
 Shape = TypeVar("Shape")
 
 
+class SharedLMScoreCache:
+    def __init__(self, lm_order: int, max_bytes: int = DEFAULT_LM_CACHE_BYTES) -> None:
+        """Process-level LRU cache of language model word scores shared across utterances.
+
+        For an n-gram model the score of a word and the state after it only depend on the last
+        n - 1 words of the history, so these are used as the key instead of the full text. That
+        way frequent words and prefixes like "THE" or "AND I" are scored once per process instead
+        of once per utterance. Least recently used entries are evicted once the approximate size
+        of the cache exceeds max_bytes.
+
+        Args:
+            lm_order: order of the language model, defines how many history words are kept
+            max_bytes: approximate memory budget of the cache in bytes
+        """
+        self._n_history = max(1, lm_order - 1)
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[SharedLMScoreKey, SharedLMScoreValue]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        """Get the number of cached scores."""
+        return len(self._entries)
+
+    @property
+    def n_history(self) -> int:
+        """Number of history words that are part of the key."""
+        return self._n_history
+
+    @staticmethod
+    def _entry_bytes(key: SharedLMScoreKey) -> int:
+        """Approximate memory used by a cache entry."""
+        history, word, _ = key
+        return _LM_CACHE_ENTRY_BYTES + 8 * len(history) + sum(map(len, history)) + len(word)
+
+    def score(
+        self,
+        language_model: AbstractLanguageModel,
+        history: Sequence[str],
+        prev_state: AbstractLMState,
+        word: str,
+        is_last_word: bool = False,
+    ) -> SharedLMScoreValue:
+        """Score a word with the language model, using the cached score if available.
+
+        Args:
+            language_model: language model the cache belongs to
+            history: words preceding the word, prev_state is the language model state after them
+            prev_state: language model state to score the word from
+            word: word to score
+            is_last_word: whether the word ends the sentence
+
+        Returns:
+            language model score of the word and the language model state after it
+        """
+        key = (tuple(history[-self._n_history :]), word, is_last_word)
+        value = self._entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = language_model.score(prev_state, word, is_last_word=is_last_word)
+        self._add(key, value)
+        return value
+
+    def _add(self, key: SharedLMScoreKey, value: SharedLMScoreValue) -> None:
+        """Add a score, evicting the least recently used ones if the cache is full."""
+        self._entries[key] = value
+        self.size_bytes += self._entry_bytes(key)
+        while self.size_bytes > self._max_bytes and self._entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self.size_bytes -= self._entry_bytes(old_key)
+            self.evictions += 1
+
+    def score_batch(
+        self,
+        language_model: AbstractLanguageModel,
+        queries: Sequence[Tuple[Sequence[str], AbstractLMState, str]],
+        is_last_word: bool = False,
+    ) -> List[SharedLMScoreValue]:
+        """Score words of several beams, scoring all cache misses in a single batch.
+
+        Args:
+            language_model: language model the cache belongs to
+            queries: history words, language model state after them and word to score
+            is_last_word: whether the words end the sentence
+
+        Returns:
+            language model score and end state for each query
+        """
+        keys = [
+            (tuple(history[-self._n_history :]), word, is_last_word) for history, _, word in queries
+        ]
+        values: List[Optional[SharedLMScoreValue]] = []
+        misses: Dict[SharedLMScoreKey, Tuple[AbstractLMState, str]] = {}
+        for key, (_, prev_state, word) in zip(keys, queries):
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            if value is None and key not in misses:
+                self.misses += 1
+                misses[key] = (prev_state, word)
+            else:
+                self.hits += 1
+            values.append(value)
+        if not misses:
+            return values  # type: ignore [return-value]
+        scored = dict(
+            zip(misses, _score_lm_queries(language_model, list(misses.values()), is_last_word))
+        )
+        for key, value in scored.items():
+            self._add(key, value)
+        return [scored[key] if value is None else value for key, value in zip(keys, values)]
+
+    def clear(self) -> None:
+        """Remove all cached scores, e.g. after the language model parameters changed."""
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get hit, miss and eviction counters and the current size of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+        }
+
+
+def _score_lm_queries(
+    language_model: AbstractLanguageModel,
+    queries: Sequence[Tuple[AbstractLMState, str]],
+    is_last_word: bool = False,
+) -> List[Tuple[float, AbstractLMState]]:
+    """Score distinct (state, word) pairs, in one call if the language model supports batches."""
+    if isinstance(language_model, BatchLanguageModel):
+        return language_model.score_batch(queries, is_last_word=is_last_word)
+    return [
+        language_model.score(prev_state, word, is_last_word=is_last_word)
+        for prev_state, word in queries
+    ]
+
+
+def _score_words(
+    language_model: AbstractLanguageModel,
+    queries: Sequence[Tuple[Sequence[str], AbstractLMState, str]],
+    is_last_word: bool = False,
+    lm_score_cache: Optional[SharedLMScoreCache] = None,
+    counters: Optional[DecodeCounters] = None,
+) -> List[Tuple[float, AbstractLMState]]:
+    """Score the words completed by several beams at once.
+
+    Queries with the same language model state and word are scored once, and all distinct ones
+    are passed to the language model in a single batch if it is a `BatchLanguageModel`.
+
+    Args:
+        language_model: language model to score with
+        queries: history words, language model state after them and word to score
+        is_last_word: whether the words end the sentence
+        lm_score_cache: cross-utterance score cache to look the scores up in first
+        counters: hot path counters to add the language model calls to
+
+    Returns:
+        language model score and end state for each query
+    """
+    if lm_score_cache is not None:
+        n_misses = lm_score_cache.misses
+        values = lm_score_cache.score_batch(language_model, queries, is_last_word=is_last_word)
+        if counters is not None:
+            counters.lm_calls += lm_score_cache.misses - n_misses
+        return values
+    unique_queries: Dict[Tuple[AbstractLMState, str], int] = {}
+    for _, prev_state, word in queries:
+        unique_queries.setdefault((prev_state, word), len(unique_queries))
+    if counters is not None:
+        counters.lm_calls += len(unique_queries)
+    values = _score_lm_queries(language_model, list(unique_queries), is_last_word)
+    return [values[unique_queries[(prev_state, word)]] for _, prev_state, word in queries]
+
+
+def _list_artifact_files(filepath: str) -> List[str]:
+    """List the files of a saved decoder relative to its directory, without the manifest."""
+    relpaths = []
+    for dirpath, dirnames, filenames in os.walk(filepath):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and not d.startswith("__")]
+        for filename in filenames:
+            relpath = os.path.relpath(os.path.join(dirpath, filename), filepath)
+            is_manifest = relpath == BeamSearchDecoderCTC._MANIFEST_SERIALIZED_FILENAME
+            if not filename.startswith(".") and not is_manifest:
+                relpaths.append(relpath.replace(os.sep, "/"))
+    return sorted(relpaths)
+
+
 def _get_valid_pool(pool: Optional[Pool]) -> Optional[Pool]:
     """Return the pool if the pool is appropriate for multiprocessing."""
     if pool is not None and isinstance(
@@ -197,6 +606,97 @@ def _log_softmax(
     return out
 
 
+def _get_log_probs(logits: NDArray[NpFloat], is_log_probs: bool = False) -> NDArray[NpFloat]:
+    """Make sure we have clipped log probs as input.
+
+    Args:
+        logits: logit matrix of token logits, probabilities or log probabilities
+        is_log_probs: whether the input already holds normalized log probabilities, e.g. log-softmax
+            outputs, in which case the normalization probe and log-softmax are skipped
+
+    Returns:
+        logit matrix of token log probabilities
+    """
+    if is_log_probs:
+        return np.clip(logits, np.log(MIN_TOKEN_CLIP_P), 0)
+    if math.isclose(logits.sum(axis=1).mean(), 1):
+        # input looks like probabilities, so take log
+        return np.log(np.clip(logits, MIN_TOKEN_CLIP_P, 1))
+    # convert logits into log probs
+    return np.clip(_log_softmax(logits, axis=1), np.log(MIN_TOKEN_CLIP_P), 0)
+
+
+def split_padded_batch(logits: Any, relative_lens: Any) -> List[NDArray[NpFloat]]:
+    """Split a padded batch of logit matrices into views of their valid frames.
+
+    Args:
+        logits: padded logits of shape (batch, time, vocabulary), numpy array or torch tensor
+        relative_lens: length of each utterance relative to the padded length, as in speechbrain
+
+    Returns:
+        list of logit matrices without their padding frames
+    """
+    # torch tensors are converted without importing torch
+    if hasattr(logits, "detach"):
+        logits = logits.detach().cpu().numpy()
+    if hasattr(relative_lens, "detach"):
+        relative_lens = relative_lens.detach().cpu().numpy()
+    logits = np.asarray(logits)
+    if logits.ndim != 3:
+        raise ValueError(
+            "Input logits have %s dimensions, but need 3: (batch, time, vocabulary)" % logits.ndim
+        )
+    relative_lens = np.asarray(relative_lens, dtype=np.float64)
+    if relative_lens.shape != (len(logits),):
+        raise ValueError(
+            "Got %s relative lengths for a batch of %s logit matrices."
+            % (relative_lens.shape, len(logits))
+        )
+    n_frames = np.clip(np.rint(relative_lens * logits.shape[1]), 1, logits.shape[1]).astype(int)
+    return [utterance_logits[:length] for utterance_logits, length in zip(logits, n_frames)]
+
+
+def _collapse_frames(
+    logits: NDArray[NpFloat], min_prob: float, blank_idx: int
+) -> Tuple[NDArray[NpFloat], NDArray[np.int64]]:
+    """Collapse runs of frames dominated by the same token into single decoding steps.
+
+    A run is a sequence of consecutive frames whose argmax token, blank or not, has probability of
+    at least min_prob. Since a repeated token and a repeated blank both collapse to a single CTC
+    output, such a run is replaced by one step in which the dominant token carries the exact sum of
+    its log probs over the run. In a blank run another token keeps the log prob of the first frame
+    plus the blank log probs over the remaining frames, which is the exact score of that token
+    followed by blanks. In a token run the dominant token cannot follow another token without
+    adding to the text, so another token only gets its best single frame of the run.
+
+    Args:
+        logits: logit matrix of token log probabilities
+        min_prob: minimum probability of the argmax token for a frame to be part of a run
+        blank_idx: index of the blank token, -1 if there is none
+
+    Returns:
+        collapsed logit matrix, and the (start_frame, end_frame) span of each of its rows
+    """
+    max_idxs = logits.argmax(axis=1)
+    max_logps = logits[np.arange(len(logits)), max_idxs]
+    is_dominant = max_logps >= math.log(min_prob)
+    is_run_start = np.ones(len(logits), dtype=bool)
+    is_run_start[1:] = ~(is_dominant[1:] & is_dominant[:-1] & (max_idxs[1:] == max_idxs[:-1]))
+    run_starts = np.flatnonzero(is_run_start)
+    run_ends = np.append(run_starts[1:], len(logits))
+    run_logps = np.add.reduceat(max_logps, run_starts) - max_logps[run_starts]
+    collapsed_logits = logits[run_starts] + run_logps[:, None]
+    run_tokens = max_idxs[run_starts]
+    token_runs = np.flatnonzero((run_tokens != blank_idx) & (run_ends - run_starts > 1))
+    if len(token_runs) > 0:
+        run_maxes = np.maximum.reduceat(logits, run_starts, axis=0)[token_runs]
+        run_maxes[np.arange(len(token_runs)), run_tokens[token_runs]] = collapsed_logits[
+            token_runs, run_tokens[token_runs]
+        ]
+        collapsed_logits[token_runs] = run_maxes
+    return collapsed_logits, np.stack([run_starts, run_ends], axis=1)
+
+
 def _merge_tokens(token_1: str, token_2: str) -> str:
     """Fast, whitespace safe merging of tokens."""
     if len(token_2) == 0:
@@ -208,11 +708,58 @@ def _merge_tokens(token_1: str, token_2: str) -> str:
     return text
 
 
+def _get_empty_start_beam(lm_order: int) -> Beam:
+    """Get the beam to start decoding from, its text is the root of a new text trie."""
+    return Beam(TextTrie(lm_order).root, "", "", None, [], NULL_FRAMES, 0.0)
+
+
+@functools.lru_cache(maxsize=HOTWORD_SCORER_CACHE_SIZE)
+def _build_hotword_scorer(hotwords: Tuple[str, ...], weight: float) -> HotwordScorer:
+    """Compile the regex and character trie of a hotword scorer."""
+    return HotwordScorer.build_scorer(hotwords, weight=weight)
+
+
+def get_hotword_scorer(
+    hotwords: Optional[Iterable[str]] = None, weight: float = DEFAULT_HOTWORD_WEIGHT
+) -> HotwordScorer:
+    """Get the scorer of hotwords and weight, compiled once per process and then cached.
+
+    Decoding calls with the same hotword list share one scorer, so the regex and trie are not
+    compiled again per utterance. Worker processes keep their own cache and compile each list
+    once, forked workers inherit the scorers compiled before the fork.
+    """
+    return _build_hotword_scorer(tuple(hotwords or ()), float(weight))
+
+
+def _get_hotword_score(
+    text_node: TextNode, hotword_scorer: HotwordScorer, cached_scores: LMScoreCache
+) -> float:
+    """Get the hotword score of a text, accumulated per word in the score cache.
+
+    Only used without language model, in which case the cache holds hotword scores only.
+    """
+    # walk up to the closest text with a known score
+    unscored_nodes = []
+    node: Optional[TextNode] = text_node
+    score = 0.0
+    while node is not None:
+        cached_score = cached_scores.get((node, False))
+        if cached_score is not None:
+            score = cached_score[0]
+            break
+        unscored_nodes.append(node)
+        node = node.parent
+    for node in reversed(unscored_nodes):
+        score += hotword_scorer.score(node.word)
+        cached_scores[(node, False)] = (score, 0.0, None)
+    return score
+
+
 def _merge_beams(beams: List[Beam]) -> List[Beam]:
     """Merge beams with same prefix together."""
     beam_dict = {}
     for beam in beams:
-        new_text = _merge_tokens(beam.text, beam.next_word)
+        new_text = beam.text_node.extend(beam.next_word)
         hash_idx = (new_text, beam.partial_word, beam.last_char)
         if hash_idx not in beam_dict:
             beam_dict[hash_idx] = beam
@@ -224,7 +771,9 @@ def _merge_beams(beams: List[Beam]) -> List[Beam]:
     return list(beam_dict.values())
 
 
-def _prune_history(beams: List[LMBeam], lm_order: int) -> List[Beam]:
+def _prune_history(
+    beams: List[LMBeam], grammar_tracker: Optional[_GrammarTracker] = None
+) -> List[Beam]:
     """Filter out beams that are the same over max_ngram history.
 
     Since n-gram language models have a finite history when scoring a new token, we can use that
@@ -233,61 +782,845 @@ def _prune_history(beams: List[LMBeam], lm_order: int) -> List[Beam]:
     some amount of beam diversity. If more than the top beam is used in the output it should
     potentially be disabled.
 
+    The history that can still affect lm scoring going forward is the context of the text node,
+    which keeps the last lm_order - 1 words (at least 1 word) of the text trie.
+
     Args:
         beams: list of LMBeam
-        lm_order: int, the order of the n-gram model
+        grammar_tracker: grammar states of the beams for grammar constrained decoding
 
     Returns:
         list of Beam
     """
-    # let's keep at least 1 word of history
-    min_n_history = max(1, lm_order - 1)
     seen_hashes = set()
     filtered_beams = []
     # for each beam after this, check if we need to add it
     for lm_beam in beams:
         # hash based on history that can still affect lm scoring going forward
-        hash_idx = (
-            tuple(lm_beam.text.split()[-min_n_history:]),
+        hash_idx: Tuple[Any, ...] = (
+            lm_beam.text_node.context_id,
             lm_beam.partial_word,
             lm_beam.last_char,
         )
+        if grammar_tracker is not None:
+            # beams with the same recent history can still be in different grammar states
+            hash_idx += (grammar_tracker.get_state(lm_beam.text_node, lm_beam.partial_word),)
         if hash_idx not in seen_hashes:
             filtered_beams.append(Beam.from_lm_beam(lm_beam))
             seen_hashes.add(hash_idx)
     return filtered_beams
 
 
+def _get_frame_bounds(
+    n_steps: int, processed_frames: int, frame_spans: Optional[NDArray[np.int64]]
+) -> Tuple[Sequence[int], Sequence[int]]:
+    """Get the start and end frame of each decoding step."""
+    if frame_spans is None:
+        return (
+            range(processed_frames, processed_frames + n_steps),
+            range(processed_frames + 1, processed_frames + n_steps + 1),
+        )
+    return (
+        (frame_spans[:, 0] + processed_frames).tolist(),
+        (frame_spans[:, 1] + processed_frames).tolist(),
+    )
+
+
+def _get_frame_entropies(logits: NDArray[NpFloat]) -> NDArray[np.float64]:
+    """Get the posterior entropy in nats of each frame of a log probability matrix."""
+    probs = np.exp(logits)
+    # masked out tokens have -inf log probs and contribute nothing
+    return -(probs * np.where(probs > 0, logits, 0.0)).sum(axis=1)  # type: ignore [no-any-return]
+
+
+def _get_adaptive_beam_width(
+    frame_entropy: float,
+    scores: Union[Sequence[float], NDArray[np.float64]],
+    max_score: float,
+    min_beam_width: int,
+    beam_width: int,
+) -> int:
+    """Get the beam width of a frame between min_beam_width and beam_width.
+
+    The width grows with the posterior entropy of the frame and with the number of candidate
+    beams that score close to the best one, so confident frames with a clear best hypothesis
+    keep few beams and ambiguous frames keep up to beam_width.
+    """
+    n_competing = np.count_nonzero(np.asarray(scores) >= max_score + ADAPTIVE_BEAM_SCORE_MARGIN)
+    uncertainty = max(
+        1.0 - math.exp(-frame_entropy / ADAPTIVE_BEAM_ENTROPY_SCALE), n_competing / beam_width
+    )
+    return min_beam_width + int(round((beam_width - min_beam_width) * min(1.0, uncertainty)))
+
+
+def _get_greedy_spans(
+    logits: NDArray[NpFloat], greedy_prob: float, blank_idx: int
+) -> List[Tuple[int, int, bool]]:
+    """Split a log probability matrix into spans decoded greedily or with beam search.
+
+    Frames whose blank has at least greedy_prob probability cut the matrix into segments. A
+    segment in which every frame's argmax token has at least greedy_prob probability is decoded
+    greedily, as are the confident blank frames themselves, the other segments with beam search.
+    Consecutive frames of the same kind are merged into one span.
+
+    Returns:
+        list of (start, end, is_greedy) row spans covering the matrix
+    """
+    max_idxs = logits.argmax(axis=1)
+    is_confident = logits[np.arange(len(logits)), max_idxs] >= math.log(greedy_prob)
+    is_cut = is_confident & (max_idxs == blank_idx)
+    # frames between two cuts share a segment id, a segment is greedy if none of its frames is
+    # uncertain
+    segment_ids = np.cumsum(is_cut)
+    uncertain_segments = np.unique(segment_ids[~is_confident])
+    is_greedy = is_cut | ~np.isin(segment_ids, uncertain_segments)
+    span_starts = np.flatnonzero(np.diff(is_greedy.astype(np.int8), prepend=-1))
+    span_ends = np.append(span_starts[1:], len(logits))
+    return [
+        (start, end, bool(is_greedy[start]))
+        for start, end in zip(span_starts.tolist(), span_ends.tolist())
+    ]
+
+
+def _check_beam_widths(beam_width: int, min_beam_width: Optional[int]) -> None:
+    """Check that the adaptive beam width range is valid."""
+    if min_beam_width is not None and not 1 <= min_beam_width <= beam_width:
+        raise ValueError(
+            f"min_beam_width must be between 1 and beam_width ({beam_width}). "
+            f"Got {min_beam_width}."
+        )
+
+
+def _get_candidate_tokens(
+    logits: NDArray[NpFloat],
+    token_min_logp: float,
+    top_k: Optional[int] = None,
+    required_idx: Optional[int] = None,
+) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """Get the tokens expanded at every frame in one pass over the logit matrix.
+
+    A frame's candidates are the tokens with at least token_min_logp, limited to its top_k
+    tokens if set, and always its argmax token. They are stored in compressed sparse row
+    layout: the candidates of frame t are idxs[offsets[t] : offsets[t + 1]] in ascending order.
+
+    Args:
+        logits: log probabilities of shape (n_frames, n_tokens)
+        token_min_logp: tokens below this log probability are skipped unless they are the argmax
+        top_k: if set, at most this many tokens with the highest log probabilities per frame
+        required_idx: if set, a token that is a candidate at every frame
+
+    Returns:
+        candidate token indices and the offsets of the frames in them
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be at least 1. Got {top_k}.")
+    frame_idxs = np.arange(len(logits))
+    is_candidate = logits >= token_min_logp
+    if top_k is not None:
+        # only frames with more candidates than top_k need to be partitioned
+        capped_idxs = np.flatnonzero(is_candidate.sum(axis=1) > top_k)
+        if len(capped_idxs) > 0:
+            capped_logits = logits[capped_idxs]
+            top_idxs = np.argpartition(capped_logits, -top_k, axis=1)[:, -top_k:]
+            is_top = np.zeros(capped_logits.shape, dtype=bool)
+            is_top[np.arange(len(capped_idxs))[:, None], top_idxs] = True
+            is_candidate[capped_idxs] = is_top & is_candidate[capped_idxs]
+    # the argmax is set last, ties at the top_k cut may have left it out
+    is_candidate[frame_idxs, logits.argmax(axis=1)] = True
+    if required_idx is not None:
+        is_candidate[:, required_idx] = True
+    offsets = np.zeros(len(logits) + 1, dtype=np.int64)
+    np.cumsum(is_candidate.sum(axis=1), out=offsets[1:])
+    return np.nonzero(is_candidate)[1], offsets
+
+
+class _DeadlineBudget:
+    """Shrinks the beam width and tightens pruning when decoding is projected to miss a deadline.
+
+    Before every decoding step the time per step measured since the last adjustment is
+    extrapolated to the remaining steps. If that overruns the time left, the beam width is halved
+    and the pruning threshold moved halfway towards 0, at most up to DEADLINE_MAX_PRUNE_LOGP.
+    Once the deadline has passed the remaining steps run with a single beam. Adjustments are
+    never undone, so the steps decoded so far stay comparable.
+    """
+
+    def __init__(
+        self,
+        deadline_ms: float,
+        n_steps: int,
+        beam_width: int,
+        beam_prune_logp: float,
+        start_time: Optional[float] = None,
+    ) -> None:
+        """Init, start_time is a `time.perf_counter` value and defaults to now."""
+        self._deadline_ms = deadline_ms
+        self._start_time = time.perf_counter() if start_time is None else start_time
+        self._deadline = self._start_time + deadline_ms / 1000.0
+        self._n_steps = n_steps
+        self._beam_width = beam_width
+        self._beam_prune_logp = beam_prune_logp
+        self._initial_beam_width = beam_width
+        self._initial_beam_prune_logp = beam_prune_logp
+        self._steps_done = 0
+        self._degraded_steps = 0
+        self._timed_start_time = self._start_time
+        self._timed_start_step = 0
+
+    @property
+    def degraded(self) -> bool:
+        """Whether the beam width or pruning threshold have been tightened."""
+        return (
+            self._beam_width < self._initial_beam_width
+            or self._beam_prune_logp > self._initial_beam_prune_logp
+        )
+
+    def _tighten(self, now: float) -> None:
+        """Halve the beam width and move the pruning threshold halfway towards 0."""
+        self._beam_width = max(1, self._beam_width // 2)
+        self._beam_prune_logp = max(
+            self._beam_prune_logp, min(self._beam_prune_logp / 2, DEADLINE_MAX_PRUNE_LOGP)
+        )
+        self._timed_start_time = now
+        self._timed_start_step = self._steps_done
+
+    def next_step(self) -> Tuple[int, float]:
+        """Get the beam width and pruning threshold of the next decoding step."""
+        now = time.perf_counter()
+        if now >= self._deadline:
+            self._beam_width = 1
+            self._beam_prune_logp = max(self._beam_prune_logp, DEADLINE_MAX_PRUNE_LOGP)
+        else:
+            n_timed_steps = self._steps_done - self._timed_start_step
+            if n_timed_steps >= DEADLINE_MIN_TIMED_STEPS and self._beam_width > 1:
+                step_seconds = (now - self._timed_start_time) / n_timed_steps
+                if step_seconds * (self._n_steps - self._steps_done) > self._deadline - now:
+                    self._tighten(now)
+        self._steps_done += 1
+        if self.degraded:
+            self._degraded_steps += 1
+        return self._beam_width, self._beam_prune_logp
+
+    def get_report(self) -> DeadlineReport:
+        """Get the report of the decoding call so far."""
+        return DeadlineReport(
+            deadline_ms=self._deadline_ms,
+            elapsed_ms=1000.0 * (time.perf_counter() - self._start_time),
+            degraded=self.degraded,
+            degraded_steps=self._degraded_steps,
+            n_steps=self._steps_done,
+            min_beam_width=self._beam_width,
+            max_beam_prune_logp=self._beam_prune_logp,
+        )
+
+
+def _grow_array(array: NDArray[Any], min_size: int, fill_value: Any) -> NDArray[Any]:
+    """Return an array with room for at least min_size rows, doubling the capacity if needed."""
+    if len(array) >= min_size:
+        return array
+    new_array = np.full(
+        (max(min_size, 2 * len(array)),) + array.shape[1:], fill_value, dtype=array.dtype
+    )
+    new_array[: len(array)] = array
+    return new_array
+
+
+class _GrammarTracker:
+    def __init__(self, automaton: TokenAutomaton, labels: List[str], root_state: int) -> None:
+        """Grammar states of the beam texts of a decoding call.
+
+        The state of a beam only depends on its words and partial word, so it is cached per text
+        node and per text node and partial word, like the language model scores.
+
+        Args:
+            automaton: automaton of the grammar over the tokens of the alphabet
+            labels: normalized alphabet labels, index aligned with the logit columns
+            root_state: grammar state of the text before the beams, the root of their text trie
+        """
+        self.automaton = automaton
+        self._grammar = automaton.grammar
+        self._labels = labels
+        self._root_state = root_state
+        self._node_states: Dict[TextNode, int] = {}
+        self._states: Dict[Tuple[TextNode, str], int] = {}
+
+    def get_node_state(self, text_node: TextNode) -> int:
+        """Get the grammar state after the words of a text."""
+        # walk up to the closest text with a known state
+        unvisited_nodes = []
+        node = text_node
+        state = self._root_state
+        while node.parent is not None:
+            cached_state = self._node_states.get(node)
+            if cached_state is not None:
+                state = cached_state
+                break
+            unvisited_nodes.append(node)
+            node = node.parent
+        for node in reversed(unvisited_nodes):
+            state = self._grammar.advance(state, " " + node.word)
+            self._node_states[node] = state
+        return state
+
+    def get_state(self, text_node: TextNode, partial_word: str) -> int:
+        """Get the grammar state of a beam, a beam without partial word is at a word start."""
+        key = (text_node, partial_word)
+        state = self._states.get(key)
+        if state is None:
+            state = self._grammar.advance(self.get_node_state(text_node), " " + partial_word)
+            self._states[key] = state
+        return state
+
+    def is_final(self, text_node: TextNode) -> bool:
+        """Whether the grammar accepts the words of a text."""
+        return self._grammar.is_final(self.get_node_state(text_node))
+
+    def get_token_beams(self, beams: List[Beam], idx_list: List[int]) -> List[List[Beam]]:
+        """Get the beams the grammar allows each token to extend, in the order of idx_list."""
+        states = np.array(
+            [
+                self.get_state(beam.text_node.extend(beam.next_word), beam.partial_word)
+                for beam in beams
+            ],
+            dtype=np.int64,
+        )
+        is_allowed = self.automaton.next_states(
+            states[None, :], np.asarray(idx_list, dtype=np.int64)[:, None]
+        ) >= 0
+        # repeated tokens leave the text unchanged
+        return [
+            [
+                beam
+                for beam, is_beam_allowed in zip(beams, token_allowed)
+                if is_beam_allowed or beam.last_char == self._labels[idx_char]
+            ]
+            for idx_char, token_allowed in zip(idx_list, is_allowed.tolist())
+        ]
+
+
+class _ArrayBeamSearch:
+    """Struct-of-arrays beam search state used by the `soa` decoding engine.
+
+    The live beam set is kept in preallocated arrays of logit scores, last token ids, partial word
+    ids, partial word frames and parent pointers into an append-only word history and word frames
+    chain. Partial words and words are interned to integer ids, so that a word boundary adds a node
+    instead of copying frame lists, and merging, lm scoring and history pruning are done on integer
+    keys. History nodes map onto the text trie of the beams, whose context ids are used for history
+    pruning. Beams are only materialized again by `to_beams`.
+    """
+
+    def __init__(
+        self,
+        labels: List[str],
+        token_classes: List[int],
+        language_model: Optional[AbstractLanguageModel],
+        hotword_scorer: HotwordScorer,
+        beams: Sequence[Beam],
+        beam_width: int,
+        prune_history: bool,
+        cached_lm_scores: LMScoreCache,
+        cached_p_lm_scores: Dict[str, float],
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
+    ) -> None:
+        """Init.
+
+        Args:
+            labels: normalized alphabet labels, index aligned with the logit columns
+            token_classes: token class of each label, see `Alphabet.token_classes`
+            language_model: optional language model used for word and partial word scoring
+            hotword_scorer: scorer for hotwords
+            beams: beams to continue decoding from
+            beam_width: maximum number of beams at each step in decoding
+            prune_history: prune beams based on shared recent history at the cost of beam diversity
+            cached_lm_scores: language model score cache, used for the starting beams
+            cached_p_lm_scores: partial token score cache
+            lm_score_cache: optional cross-utterance word score cache, only valid if the texts
+                of the beams are the full history from the language model start state
+            counters: optional hot path counters to add the decoding steps to
+            with_frames: whether to keep track of the frames of words and partial words
+            grammar_tracker: if set, only the tokens the grammar allows are expanded
+        """
+        self._labels = labels
+        self._label_ids = {label: n for n, label in enumerate(labels)}
+        self._token_classes = np.asarray(token_classes, dtype=np.int64)
+        self._language_model = language_model
+        self._hotword_scorer = hotword_scorer
+        self._beam_width = beam_width
+        self._prune_history = prune_history
+        self._cached_lm_scores = cached_lm_scores
+        self._cached_p_lm_scores = cached_p_lm_scores
+        self._lm_score_cache = lm_score_cache
+        self._counters = counters
+        self._with_frames = with_frames
+        self._grammar_tracker = grammar_tracker
+
+        # interned partial words, id 0 is the empty partial word
+        vocab_size = len(labels)
+        self._partial_texts: List[str] = [""]
+        self._partial_ids: Dict[str, int] = {"": 0}
+        self._partial_extensions = np.full((64, vocab_size), -1, dtype=np.int64)
+        self._partial_scores = np.full(64, np.nan)
+        self._partial_scores[0] = 0.0
+
+        # append-only word history, node 0 is the root of the text trie of the beams
+        root = beams[0].text_node.trie.root
+        self._node_text_nodes: List[TextNode] = [root]
+        self._node_parents: List[int] = [-1]
+        self._node_children: Dict[Tuple[int, int], int] = {}
+        self._node_raw_scores: List[float] = [0.0]
+        self._node_hotword_scores: List[float] = [0.0]
+        self._node_lm_states: List[Optional[AbstractLMState]] = [None]
+        self._node_scores = np.zeros(64)
+        self._node_contexts = np.zeros(64, dtype=np.int64)
+        # append-only word frames, kept apart from the history so merged beams keep their own
+        self._frame_parents: List[int] = [-1]
+        self._frame_values: List[Frames] = [NULL_FRAMES]
+        if language_model is not None:
+            root_score, root_raw_score, root_state = cached_lm_scores[(root, False)]
+            self._node_scores[0] = root_score
+            self._node_raw_scores[0] = root_raw_score
+            self._node_lm_states[0] = root_state
+
+        # live beam set
+        capacity = max(beam_width, len(beams))
+        self._n_beams = 0
+        self._scores = np.zeros(capacity)
+        self._last_tokens = np.full(capacity, -1, dtype=np.int64)
+        self._partials = np.zeros(capacity, dtype=np.int64)
+        self._parents = np.zeros(capacity, dtype=np.int64)
+        self._word_frames = np.zeros(capacity, dtype=np.int64)
+        self._start_frames = np.full(capacity, -1, dtype=np.int64)
+        self._end_frames = np.full(capacity, -1, dtype=np.int64)
+        self._grammar_states = np.zeros(capacity, dtype=np.int64)
+        for beam in beams:
+            self._add_beam(beam)
+
+    @property
+    def n_beams(self) -> int:
+        """Number of live beams."""
+        return self._n_beams
+
+    def _intern_partial(self, text: str) -> int:
+        """Get the id of a partial word, adding it if it is new."""
+        partial_id = self._partial_ids.get(text)
+        if partial_id is None:
+            partial_id = len(self._partial_texts)
+            self._partial_texts.append(text)
+            self._partial_ids[text] = partial_id
+            self._partial_extensions = _grow_array(self._partial_extensions, partial_id + 1, -1)
+            self._partial_scores = _grow_array(self._partial_scores, partial_id + 1, np.nan)
+        return partial_id
+
+    def _extend_partials(
+        self, partials: NDArray[np.int64], tokens: NDArray[np.int64]
+    ) -> NDArray[np.int64]:
+        """Append tokens to partial words, looking up known extensions in a single gather."""
+        extended = self._partial_extensions[partials, tokens]
+        for n in np.flatnonzero(extended < 0):
+            partial_id, token = partials[n], tokens[n]
+            new_id = self._partial_extensions[partial_id, token]
+            if new_id < 0:
+                new_id = self._intern_partial(self._partial_texts[partial_id] + self._labels[token])
+                self._partial_extensions[partial_id, token] = new_id
+            extended[n] = new_id
+        return extended
+
+    def _get_partial_scores(self, partials: NDArray[np.int64]) -> NDArray[np.float64]:
+        """Get the partial word scores, scoring words that have not been seen yet."""
+        scores = self._partial_scores[partials]
+        missing = np.isnan(scores)
+        if missing.any():
+            for partial_id in np.unique(partials[missing]):
+                word_part = self._partial_texts[partial_id]
+                if self._language_model is None:
+                    score = self._hotword_scorer.score_partial_token(word_part)
+                elif word_part in self._hotword_scorer:
+                    # if prefix available in hotword trie use that, otherwise default to char trie
+                    score = self._hotword_scorer.score_partial_token(word_part)
+                else:
+                    score = self._language_model.score_partial_token(word_part)
+                self._partial_scores[partial_id] = score
+            scores = self._partial_scores[partials]
+        return scores
+
+    def _add_nodes(
+        self, parents: NDArray[np.int64], word_ids: NDArray[np.int64]
+    ) -> NDArray[np.int64]:
+        """Get the history nodes for words following parents, scoring all new words in one batch."""
+        word_scores: Dict[Tuple[int, int], Tuple[float, AbstractLMState]] = {}
+        pairs = list(zip(parents.tolist(), word_ids.tolist()))
+        if self._language_model is not None:
+            new_pairs = list(
+                dict.fromkeys(pair for pair in pairs if pair not in self._node_children)
+            )
+            if new_pairs:
+                queries = [
+                    (
+                        self._node_text_nodes[parent].context,
+                        self._node_lm_states[parent],
+                        self._partial_texts[word_id],
+                    )
+                    for parent, word_id in new_pairs
+                ]
+                scores = _score_words(
+                    self._language_model,
+                    queries,  # type: ignore [arg-type]
+                    lm_score_cache=self._lm_score_cache,
+                    counters=self._counters,
+                )
+                word_scores = dict(zip(new_pairs, scores))
+        return np.array(
+            [
+                self._add_node(parent, word_id, lm_word_score=word_scores.get((parent, word_id)))
+                for parent, word_id in pairs
+            ],
+            dtype=np.int64,
+        )
+
+    def _add_node(
+        self,
+        parent: int,
+        word_id: int,
+        cached_lm_score: Optional[LMScoreCacheValue] = None,
+        lm_word_score: Optional[Tuple[float, AbstractLMState]] = None,
+    ) -> int:
+        """Get the history node for a word following parent, scoring it if it is new."""
+        node = self._node_children.get((parent, word_id))
+        if node is not None:
+            return node
+        node = len(self._node_text_nodes)
+        self._node_children[(parent, word_id)] = node
+        word = self._partial_texts[word_id]
+        parent_text_node = self._node_text_nodes[parent]
+        text_node = parent_text_node.extend(word)
+        self._node_text_nodes.append(text_node)
+        self._node_parents.append(parent)
+        self._node_scores = _grow_array(self._node_scores, node + 1, 0.0)
+        self._node_contexts = _grow_array(self._node_contexts, node + 1, 0)
+        # the last words of the history are all that can affect lm scoring going forward
+        self._node_contexts[node] = text_node.context_id
+        # hotword matches never cross word boundaries so they can be accumulated per word
+        hotword_score = self._node_hotword_scores[parent] + self._hotword_scorer.score(word)
+        self._node_hotword_scores.append(hotword_score)
+        if self._language_model is None:
+            self._node_raw_scores.append(0.0)
+            self._node_lm_states.append(None)
+            self._node_scores[node] = hotword_score
+        else:
+            if cached_lm_score is None:
+                if lm_word_score is None:
+                    query = (parent_text_node.context, self._node_lm_states[parent], word)
+                    if self._counters is not None:
+                        self._counters.lm_lookups += 1
+                    lm_word_score = _score_words(
+                        self._language_model,
+                        [query],  # type: ignore [list-item]
+                        lm_score_cache=self._lm_score_cache,
+                        counters=self._counters,
+                    )[0]
+                score, end_state = lm_word_score
+                raw_lm_score = self._node_raw_scores[parent] + score
+                cached_lm_score = (raw_lm_score + hotword_score, raw_lm_score, end_state)
+            self._node_scores[node] = cached_lm_score[0]
+            self._node_raw_scores.append(cached_lm_score[1])
+            self._node_lm_states.append(cached_lm_score[2])
+        return node
+
+    def _add_frames(self, parent: int, frames: Frames) -> int:
+        """Append the frames of a completed word to a word frames chain."""
+        self._frame_parents.append(parent)
+        self._frame_values.append(frames)
+        return len(self._frame_values) - 1
+
+    def _add_beam(self, beam: Beam) -> None:
+        """Add a beam to the live beam set."""
+        text_nodes = []
+        text_node = beam.text_node.extend(beam.next_word)
+        while text_node.parent is not None:
+            text_nodes.append(text_node)
+            text_node = text_node.parent
+        node = 0
+        for text_node in reversed(text_nodes):
+            node = self._add_node(
+                node,
+                self._intern_partial(text_node.word),
+                cached_lm_score=self._cached_lm_scores.get((text_node, False)),
+            )
+        frame_node = 0
+        for frames in beam.text_frames:
+            frame_node = self._add_frames(frame_node, frames)
+        idx = self._n_beams
+        self._scores[idx] = beam.logit_score
+        self._last_tokens[idx] = -1 if beam.last_char is None else self._label_ids[beam.last_char]
+        self._partials[idx] = self._intern_partial(beam.partial_word)
+        self._parents[idx] = node
+        self._word_frames[idx] = frame_node
+        self._start_frames[idx], self._end_frames[idx] = beam.partial_frames
+        if self._grammar_tracker is not None:
+            self._grammar_states[idx] = self._grammar_tracker.get_state(
+                beam.text_node.extend(beam.next_word), beam.partial_word
+            )
+        self._n_beams += 1
+
+    def step(
+        self,
+        frame_idx: int,
+        frame_end: int,
+        logit_col: NDArray[NpFloat],
+        idx_list: NDArray[np.int64],
+        beam_prune_logp: float,
+        min_beam_width: Optional[int] = None,
+        frame_entropy: float = 0.0,
+        beam_width: Optional[int] = None,
+    ) -> int:
+        """Expand, merge, score and prune the live beam set for one frame.
+
+        The beams are expanded by the candidate tokens of the frame in idx_list, see
+        `_get_candidate_tokens`.
+
+        Returns:
+            beam width used for the frame, adaptive between min_beam_width and the beam width
+            if min_beam_width is set, the beam width defaults to the one of the beam search
+        """
+        counters = self._counters
+        if counters is not None:
+            start_time = time.perf_counter()
+        n_beams = self._n_beams
+
+        # expand every (token, beam) pair
+        tokens = np.repeat(idx_list, n_beams)
+        beam_idxs = np.arange(len(tokens)) % n_beams
+        if self._grammar_tracker is not None:
+            # only the tokens the grammar allows are expanded, repeated tokens keep the text
+            grammar_states = self._grammar_states[beam_idxs]
+            grammar_states = np.where(
+                tokens == self._last_tokens[beam_idxs],
+                grammar_states,
+                self._grammar_tracker.automaton.next_states(grammar_states, tokens),
+            )
+            allowed_idxs = np.flatnonzero(grammar_states >= 0)
+            tokens = tokens[allowed_idxs]
+            beam_idxs = beam_idxs[allowed_idxs]
+            grammar_states = grammar_states[allowed_idxs]
+        logit_scores = self._scores[beam_idxs] + logit_col[tokens]
+        partials = self._partials[beam_idxs]
+        parents = self._parents[beam_idxs]
+        word_frames = self._word_frames[beam_idxs]
+        start_frames = self._start_frames[beam_idxs]
+        end_frames = self._end_frames[beam_idxs]
+        token_classes = self._token_classes[tokens]
+        is_blank = token_classes == TOKEN_BLANK
+        is_repeat = ~is_blank & (tokens == self._last_tokens[beam_idxs])
+        is_space = ~is_blank & ~is_repeat & (token_classes == TOKEN_SPACE)
+        is_char = ~(is_blank | is_repeat | is_space)
+        # repeated token only extends the frames of the partial word
+        if self._with_frames:
+            end_frames[is_repeat] = frame_end
+        # space token moves the partial word into the history
+        space_idxs = np.flatnonzero(is_space)
+        word_idxs = space_idxs[partials[space_idxs] > 0]
+        if counters is not None:
+            lm_start_time = time.perf_counter()
+        parents[word_idxs] = self._add_nodes(parents[word_idxs], partials[word_idxs])
+        if counters is not None:
+            lm_seconds = time.perf_counter() - lm_start_time
+        partials[space_idxs] = 0
+        # general update of continuing token without space
+        char_idxs = np.flatnonzero(is_char)
+        partials[char_idxs] = self._extend_partials(partials[char_idxs], tokens[char_idxs])
+        if self._with_frames:
+            for n in word_idxs:
+                word_frames[n] = self._add_frames(
+                    int(word_frames[n]), (int(start_frames[n]), int(end_frames[n]))
+                )
+            start_frames[space_idxs] = -1
+            end_frames[space_idxs] = -1
+            start_frames[char_idxs] = np.where(
+                start_frames[char_idxs] < 0, frame_idx, start_frames[char_idxs]
+            )
+            end_frames[char_idxs] = frame_end
+
+        # merge beams with same prefix together, keeping the frames of the last one
+        n_partials = len(self._partial_texts)
+        vocab_size = len(self._labels)
+        merge_keys = (parents * n_partials + partials) * vocab_size + tokens
+        order = np.argsort(merge_keys, kind="stable")
+        sorted_keys = merge_keys[order]
+        is_group_end = np.empty(len(order), dtype=bool)
+        np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=is_group_end[:-1])
+        is_group_end[-1] = True
+        group_ends = np.flatnonzero(is_group_end)
+        group_starts = np.concatenate(([0], group_ends[:-1] + 1))
+        merged_scores = np.logaddexp.reduceat(logit_scores[order], group_starts)
+        merged_idxs = order[group_ends]
+
+        # lm scoring and beam pruning
+        if counters is not None:
+            lm_start_time = time.perf_counter()
+            counters.expand_seconds += lm_start_time - start_time - lm_seconds
+            if self._language_model is not None:
+                # words are looked up per merged beam, as in the reference engine
+                is_word = np.zeros(len(tokens), dtype=bool)
+                is_word[word_idxs] = True
+                counters.lm_lookups += int(is_word[merged_idxs].sum())
+        merged_parents = parents[merged_idxs]
+        merged_partials = partials[merged_idxs]
+        lm_scores = (
+            merged_scores
+            + self._node_scores[merged_parents]
+            + self._get_partial_scores(merged_partials)
+        )
+        if counters is not None:
+            counters.lm_seconds += time.perf_counter() - lm_start_time + lm_seconds
+        # remove beam outliers
+        max_score = lm_scores.max()
+        keep = np.flatnonzero(lm_scores >= max_score + beam_prune_logp)
+        n_kept = len(keep)
+        if beam_width is None:
+            beam_width = self._beam_width
+        if min_beam_width is not None:
+            beam_width = _get_adaptive_beam_width(
+                frame_entropy,
+                lm_scores[keep],
+                max_score,
+                min(min_beam_width, beam_width),
+                beam_width,
+            )
+        # beam pruning by taking highest N prefixes and then filtering down
+        keep = keep[np.argsort(-lm_scores[keep], kind="stable")][:beam_width]
+        n_trimmed = len(keep)
+        # prune history
+        if self._prune_history:
+            history_keys = (
+                self._node_contexts[merged_parents[keep]] * n_partials + merged_partials[keep]
+            ) * vocab_size + tokens[merged_idxs[keep]]
+            if self._grammar_tracker is None:
+                _, first_idxs = np.unique(history_keys, return_index=True)
+            else:
+                # beams with the same recent history can still be in different grammar states
+                _, first_idxs = np.unique(
+                    np.stack([history_keys, grammar_states[merged_idxs[keep]]]),
+                    axis=1,
+                    return_index=True,
+                )
+            keep = keep[np.sort(first_idxs)]
+
+        n_beams = len(keep)
+        kept_idxs = merged_idxs[keep]
+        self._scores[:n_beams] = merged_scores[keep]
+        self._last_tokens[:n_beams] = tokens[kept_idxs]
+        self._partials[:n_beams] = partials[kept_idxs]
+        self._parents[:n_beams] = parents[kept_idxs]
+        self._word_frames[:n_beams] = word_frames[kept_idxs]
+        self._start_frames[:n_beams] = start_frames[kept_idxs]
+        self._end_frames[:n_beams] = end_frames[kept_idxs]
+        if self._grammar_tracker is not None:
+            self._grammar_states[:n_beams] = grammar_states[kept_idxs]
+        self._n_beams = n_beams
+        if counters is not None:
+            counters.count_frame(len(tokens), len(merged_idxs), n_kept, n_trimmed, n_beams)
+        return beam_width
+
+    def to_beams(self) -> List[Beam]:
+        """Materialize the live beam set and fill the score caches needed to finalize it."""
+        beams = []
+        for idx in range(self._n_beams):
+            node = int(self._parents[idx])
+            frames = []
+            frame_node = int(self._word_frames[idx])
+            while frame_node > 0:
+                frames.append(self._frame_values[frame_node])
+                frame_node = self._frame_parents[frame_node]
+            partial_id = int(self._partials[idx])
+            last_token = int(self._last_tokens[idx])
+            if self._language_model is not None:
+                # prefixes are cached as well, like the reference engine does while scoring
+                history_node = node
+                while history_node > 0:
+                    cache_key = (self._node_text_nodes[history_node], False)
+                    if cache_key in self._cached_lm_scores:
+                        break
+                    self._cached_lm_scores[cache_key] = (
+                        float(self._node_scores[history_node]),
+                        self._node_raw_scores[history_node],
+                        self._node_lm_states[history_node],
+                    )
+                    history_node = self._node_parents[history_node]
+                if partial_id > 0 and not np.isnan(self._partial_scores[partial_id]):
+                    self._cached_p_lm_scores[self._partial_texts[partial_id]] = float(
+                        self._partial_scores[partial_id]
+                    )
+            beams.append(
+                Beam(
+                    text_node=self._node_text_nodes[node],
+                    next_word="",
+                    partial_word=self._partial_texts[partial_id],
+                    last_char=None if last_token < 0 else self._labels[last_token],
+                    text_frames=frames[::-1],
+                    partial_frames=(int(self._start_frames[idx]), int(self._end_frames[idx])),
+                    logit_score=float(self._scores[idx]),
+                )
+            )
+        return beams
+
+
 class BeamSearchDecoderCTC:
-    # Note that we store the language model (large object) as a class variable.
+    # Note that we store the language model (large object) in a class-level registry.
     # The advantage of this is that during multiprocessing they won't cause and overhead in time.
-    # This somewhat breaks conventional garbage collection which is why there are
-    # specific functions for cleaning up the class variables manually if space needs to be freed up.
-    # Specifically we create a random dictionary key during object instantiation which becomes the
-    # storage key for the class variable model_container. This allows for multiple model instances
-    # to be loaded at the same time.
-    model_container: Dict[bytes, Optional[AbstractLanguageModel]] = {}
+    # Each decoder holds a handle to its model in the registry, which is released when the
+    # decoder is garbage collected or cleaned up. The registry shares identical models between
+    # decoders and can evict unused ones under a memory budget, see `LanguageModelRegistry`.
+    model_registry = LanguageModelRegistry()
 
     # serialization filenames
     _ALPHABET_SERIALIZED_FILENAME = "alphabet.json"
     _LANGUAGE_MODEL_SERIALIZED_DIRECTORY = "language_model"
+    _MANIFEST_SERIALIZED_FILENAME = "manifest.json"
+    _ARTIFACT_FORMAT_VERSION = 1
 
     def __init__(
         self,
         alphabet: Alphabet,
         language_model: Optional[AbstractLanguageModel] = None,
+        engine: str = ENGINE_REFERENCE,
+        lm_cache_bytes: int = DEFAULT_LM_CACHE_BYTES,
     ) -> None:
         """CTC beam search decoder for token logit matrix.
 
         Args:
             alphabet: class containing the labels for input logit matrices
             language_model: convenience class to store language model functionality
+            engine: beam search implementation, one of `reference` (a Beam object per hypothesis)
+                or `soa` (live beam set kept in preallocated arrays, regular alphabets only)
+            lm_cache_bytes: memory budget of the language model score cache shared across
+                utterances, 0 disables the cache
         """
+        if engine not in DECODING_ENGINES:
+            raise ValueError(
+                f"Unknown decoding engine {engine}. Expected one of {DECODING_ENGINES}"
+            )
+        if engine == ENGINE_SOA and alphabet.is_bpe:
+            raise ValueError(f"Decoding engine {engine} does not support BPE alphabets.")
+        self._engine = engine
         self._alphabet = alphabet
         self._idx2vocab = {n: c for n, c in enumerate(self._alphabet.labels)}
+        self._blank_idx = self._alphabet.labels.index("") if "" in self._alphabet.labels else -1
+        self._token_classes = self._alphabet.token_classes
+        self._never_emit_idxs = np.flatnonzero(
+            np.asarray(self._token_classes) == TOKEN_NEVER_EMIT
+        )
         self._is_bpe = alphabet.is_bpe
-        self._model_key = os.urandom(16)
-        BeamSearchDecoderCTC.model_container[self._model_key] = language_model
+        self._lm_cache_bytes = lm_cache_bytes
+        self._model_key = BeamSearchDecoderCTC.model_registry.register(language_model)
+        self._release_model: Optional[weakref.finalize] = weakref.finalize(
+            self, BeamSearchDecoderCTC.model_registry.release, self._model_key
+        )
+        self.reset_beam_width_stats()
+        self.reset_greedy_stats()
+        self.reset_deadline_stats()
+        self.reset_counters()
 
     def reset_params(
         self,
@@ -310,22 +1643,202 @@ class BeamSearchDecoderCTC:
             params["unk_score_offset"] = unk_score_offset
         if lm_score_boundary is not None:
             params["score_boundary"] = lm_score_boundary
-        language_model.reset_params(**params)
+        # a model shared with other decoders is copied, the score cache moves with the model
+        BeamSearchDecoderCTC.model_registry.reset_params(self._model_key, **params)
 
     @classmethod
     def clear_class_models(cls) -> None:
-        """Clear all models from class variable."""
-        cls.model_container = {}
+        """Clear all models from the registry."""
+        cls.model_registry.clear()
 
     def cleanup(self) -> None:
-        """Manual cleanup of models in class variable."""
-        if self._model_key in BeamSearchDecoderCTC.model_container:
-            del BeamSearchDecoderCTC.model_container[self._model_key]
+        """Manual cleanup of the model in the registry."""
+        if self._release_model is not None:
+            self._release_model()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Get the state for pickling, e.g. to a pool worker, which uses the registry as is."""
+        state = self.__dict__.copy()
+        # copies in other processes do not hold a handle of their own
+        del state["_release_model"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restore from a pickled state."""
+        self.__dict__.update(state)
+        self._release_model = None
 
     @property
     def _language_model(self) -> Optional[AbstractLanguageModel]:
         """Retrieve the language model."""
-        return BeamSearchDecoderCTC.model_container[self._model_key]
+        return BeamSearchDecoderCTC.model_registry.get(self._model_key)
+
+    @property
+    def _lm_score_cache(self) -> Optional[SharedLMScoreCache]:
+        """Retrieve the cross-utterance language model score cache."""
+        language_model = self._language_model
+        if language_model is None or self._lm_cache_bytes <= 0:
+            return None
+        return BeamSearchDecoderCTC.model_registry.get_score_cache(  # type: ignore [no-any-return]
+            self._model_key,
+            lambda: SharedLMScoreCache(language_model.order, max_bytes=self._lm_cache_bytes),
+        )
+
+    def score_text(self, text: str) -> Tuple[float, int]:
+        """Get the unweighted language model score and the number of words of a decoded text.
+
+        The language model adds alpha * lm_score + beta * n_words to the acoustic score of a
+        finished hypothesis, so N-best lists can be rescored for other alpha and beta without
+        decoding again, see `myRescorer.py`. Hotword scores are not included.
+        """
+        words = text.split()
+        language_model = self._language_model
+        if language_model is None:
+            return 0.0, len(words)
+        # score with an unweighted copy, the model may be shared with other decoders through
+        # the registry and the shared score cache holds weighted scores
+        language_model = copy.copy(language_model)
+        language_model.alpha, language_model.beta = 1.0, 0.0  # type: ignore [attr-defined]
+        lm_state = language_model.get_start_state()
+        lm_score = 0.0
+        for n, word in enumerate(words, start=1):
+            word_score, lm_state = language_model.score(
+                lm_state, word, is_last_word=n == len(words)
+            )
+            lm_score += word_score
+        return lm_score, len(words)
+
+    def get_lm_cache_stats(self) -> Optional[Dict[str, int]]:
+        """Get the counters of the cross-utterance language model score cache, if there is one."""
+        lm_score_cache = self._lm_score_cache
+        return None if lm_score_cache is None else lm_score_cache.get_stats()
+
+    def _record_beam_widths(self, n_frames: int, beam_width_sum: int, n_beams_sum: int) -> None:
+        """Add the beam widths and numbers of live beams of decoded frames to the statistics."""
+        self._n_frames_decoded += n_frames
+        self._beam_width_sum += beam_width_sum
+        self._n_beams_sum += n_beams_sum
+
+    def get_beam_width_stats(self) -> Dict[str, float]:
+        """Get the number of decoded frames, the average beam width and number of live beams.
+
+        With `min_beam_width` the beam width varies per frame, so the average beam width is the
+        effective width of the adaptive beam. Only frames decoded in this process are counted,
+        decoding with a multiprocessing pool or `DecoderService` happens in other processes.
+        """
+        n_frames = max(1, self._n_frames_decoded)
+        return {
+            "frames": self._n_frames_decoded,
+            "mean_beam_width": self._beam_width_sum / n_frames,
+            "mean_n_beams": self._n_beams_sum / n_frames,
+        }
+
+    def reset_beam_width_stats(self) -> None:
+        """Reset the beam width statistics."""
+        self._n_frames_decoded = 0
+        self._beam_width_sum = 0
+        self._n_beams_sum = 0
+
+    def get_greedy_stats(self) -> Dict[str, float]:
+        """Get the number of frames decoded in hybrid mode and the fraction decoded greedily.
+
+        Only frames decoded with `greedy_prob` set are counted, in the original frame indices.
+        """
+        return {
+            "frames": self._n_hybrid_frames,
+            "greedy_frames": self._n_greedy_frames,
+            "greedy_fraction": self._n_greedy_frames / max(1, self._n_hybrid_frames),
+        }
+
+    def reset_greedy_stats(self) -> None:
+        """Reset the hybrid decoding statistics."""
+        self._n_hybrid_frames = 0
+        self._n_greedy_frames = 0
+
+    def _record_deadline_report(self, report: DeadlineReport) -> None:
+        """Keep the report of a call with a deadline and add it to the statistics."""
+        self._last_deadline_report = report
+        self._n_deadline_calls += 1
+        self._n_degraded_calls += report.degraded
+        self._n_missed_deadlines += report.elapsed_ms > report.deadline_ms
+        self._n_deadline_steps += report.n_steps
+        self._n_degraded_steps += report.degraded_steps
+
+    @property
+    def last_deadline_report(self) -> Optional[DeadlineReport]:
+        """Report of the last call decoded with `deadline_ms` set, None if there was none."""
+        return self._last_deadline_report
+
+    def get_deadline_stats(self) -> Dict[str, float]:
+        """Get how often calls with `deadline_ms` set were degraded and missed their deadline.
+
+        Only calls decoded in this process are counted.
+        """
+        n_calls = max(1, self._n_deadline_calls)
+        return {
+            "calls": self._n_deadline_calls,
+            "degraded_fraction": self._n_degraded_calls / n_calls,
+            "missed_fraction": self._n_missed_deadlines / n_calls,
+            "degraded_step_fraction": self._n_degraded_steps / max(1, self._n_deadline_steps),
+        }
+
+    def reset_deadline_stats(self) -> None:
+        """Reset the deadline statistics and the last deadline report."""
+        self._last_deadline_report: Optional[DeadlineReport] = None
+        self._n_deadline_calls = 0
+        self._n_degraded_calls = 0
+        self._n_missed_deadlines = 0
+        self._n_deadline_steps = 0
+        self._n_degraded_steps = 0
+
+    def _record_counters(self, counters: DecodeCounters) -> Dict[str, float]:
+        """Keep the hot path counters of a call and return them as a dictionary."""
+        counter_values = counters.to_dict()
+        self._counters.append(counter_values)
+        return counter_values
+
+    def get_counters(self) -> List[Dict[str, float]]:
+        """Get the hot path counters of every call decoded with `collect_counters=True`.
+
+        There is one entry per call of `decode_beams` or `partial_decode_beams`, so one per
+        utterance of the batch methods, in decoding order; `sum_counters` aggregates them. Only
+        calls decoded in this process are kept, with a multiprocessing pool the counters come
+        back on the `OutputBeam.counters` of `decode_beams_batch` instead.
+        """
+        return list(self._counters)
+
+    def reset_counters(self) -> None:
+        """Remove the kept hot path counters."""
+        self._counters: List[Dict[str, float]] = []
+
+    def _get_grammar_tracker(
+        self, grammar: Optional[Grammar], grammar_state: Optional[int] = None
+    ) -> Optional[_GrammarTracker]:
+        """Get the tracker of the grammar states of the beams of a decoding call."""
+        if grammar is None:
+            return None
+        return _GrammarTracker(
+            grammar.get_token_automaton(self._alphabet),
+            self._alphabet.labels,
+            grammar.start if grammar_state is None else grammar_state,
+        )
+
+    def _get_required_token(self, grammar_tracker: Optional[_GrammarTracker]) -> Optional[int]:
+        """Get the token expanded at every frame, the blank when decoding with a grammar.
+
+        Blanks leave every text in the grammar, so no frame can leave the search without beams.
+        """
+        if grammar_tracker is None or self._blank_idx < 0:
+            return None
+        return self._blank_idx
+
+    def _get_log_probs(self, logits: NDArray[NpFloat], is_log_probs: bool) -> NDArray[NpFloat]:
+        """Get clipped log probs with the columns of never emitted tokens masked out."""
+        logits = _get_log_probs(logits, is_log_probs)
+        if len(self._never_emit_idxs) > 0:
+            # _get_log_probs returns a new array, so the input logits are left untouched
+            logits[:, self._never_emit_idxs] = -np.inf
+        return logits
 
     def _check_logits_dimension(
         self,
@@ -350,6 +1863,8 @@ class BeamSearchDecoderCTC:
         cached_lm_scores: Dict[LMScoreCacheKey, LMScoreCacheValue],
         cached_partial_token_scores: Dict[str, float],
         is_eos: bool = False,
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        counters: Optional[DecodeCounters] = None,
     ) -> List[LMBeam]:
         """Update score by averaging logit_score and lm_score."""
         # get language model and see if exists
@@ -358,17 +1873,17 @@ class BeamSearchDecoderCTC:
         if language_model is None:
             new_beams = []
             for beam in beams:
-                new_text = _merge_tokens(beam.text, beam.next_word)
+                new_text = beam.text_node.extend(beam.next_word)
                 # note that usually this gets scaled with alpha
                 lm_hw_score = (
                     beam.logit_score
-                    + hotword_scorer.score(new_text)
+                    + _get_hotword_score(new_text, hotword_scorer, cached_lm_scores)
                     + hotword_scorer.score_partial_token(beam.partial_word)
                 )
 
                 new_beams.append(
                     LMBeam(
-                        text=new_text,
+                        text_node=new_text,
                         next_word="",
                         partial_word=beam.partial_word,
                         last_char=beam.last_char,
@@ -380,20 +1895,48 @@ class BeamSearchDecoderCTC:
                 )
             return new_beams
 
-        new_beams = []
-        for beam in beams:
-            # fast token merge
-            new_text = _merge_tokens(beam.text, beam.next_word)
+        # collect the words completed in this frame and score them in one batch
+        new_texts = [beam.text_node.extend(beam.next_word) for beam in beams]
+        if counters is not None:
+            counters.lm_lookups += sum(
+                is_eos or new_text is not beam.text_node for beam, new_text in zip(beams, new_texts)
+            )
+        pending_beams: Dict[LMScoreCacheKey, Beam] = {}
+        for beam, new_text in zip(beams, new_texts):
             cache_key = (new_text, is_eos)
             if cache_key not in cached_lm_scores:
-                _, prev_raw_lm_score, start_state = cached_lm_scores[(beam.text, False)]
-                score, end_state = language_model.score(
-                    start_state, beam.next_word, is_last_word=is_eos
+                pending_beams.setdefault(cache_key, beam)
+        if pending_beams:
+            queries = [
+                (
+                    beam.text_node.context,
+                    cached_lm_scores[(beam.text_node, False)][2],
+                    beam.next_word,
                 )
+                for beam in pending_beams.values()
+            ]
+            scores = _score_words(
+                language_model,
+                queries,  # type: ignore [arg-type]
+                is_last_word=is_eos,
+                lm_score_cache=lm_score_cache,
+                counters=counters,
+            )
+            for (cache_key, beam), (score, end_state) in zip(pending_beams.items(), scores):
+                prev_lm_hw_score, prev_raw_lm_score, _ = cached_lm_scores[(beam.text_node, False)]
                 raw_lm_score = prev_raw_lm_score + score
-                lm_hw_score = raw_lm_score + hotword_scorer.score(new_text)
+                # hotword matches never cross word boundaries so they can be accumulated per word
+                lm_hw_score = (
+                    raw_lm_score
+                    + prev_lm_hw_score
+                    - prev_raw_lm_score
+                    + hotword_scorer.score(beam.next_word)
+                )
                 cached_lm_scores[cache_key] = (lm_hw_score, raw_lm_score, end_state)
-            lm_score, _, _ = cached_lm_scores[cache_key]
+
+        new_beams = []
+        for beam, new_text in zip(beams, new_texts):
+            lm_score, _, _ = cached_lm_scores[(new_text, is_eos)]
             word_part = beam.partial_word
             if len(word_part) > 0:
                 if word_part not in cached_partial_token_scores:
@@ -410,7 +1953,7 @@ class BeamSearchDecoderCTC:
 
             new_beams.append(
                 LMBeam(
-                    text=new_text,
+                    text_node=new_text,
                     next_word="",
                     partial_word=word_part,
                     last_char=beam.last_char,
@@ -435,33 +1978,112 @@ class BeamSearchDecoderCTC:
         cached_lm_scores: LMScoreCache,
         cached_p_lm_scores: Dict[str, float],
         processed_frames: int = 0,
+        frame_spans: Optional[NDArray[np.int64]] = None,
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline: Optional[_DeadlineBudget] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
     ) -> List[Beam]:
-        """Decode logits for a set of beams with warmed score caches."""
-        language_model = self._language_model
+        """Decode logits for a set of beams with warmed score caches.
+
+        Without with_frames the beams carry no word frames, which saves a frame list copy per
+        word boundary and beam.
+        """
+        _check_beam_widths(beam_width, min_beam_width)
+        # a greedy span only expands the argmax token, which the grammar may not allow
+        if greedy_prob is not None and grammar_tracker is None:
+            return self._partial_decode_logits_hybrid(
+                logits,
+                beams,
+                beam_width,
+                beam_prune_logp,
+                token_min_logp,
+                prune_history,
+                hotword_scorer,
+                cached_lm_scores,
+                cached_p_lm_scores,
+                greedy_prob,
+                processed_frames=processed_frames,
+                frame_spans=frame_spans,
+                lm_score_cache=lm_score_cache,
+                min_beam_width=min_beam_width,
+                token_top_k=token_top_k,
+                deadline=deadline,
+                counters=counters,
+                with_frames=with_frames,
+                grammar_tracker=grammar_tracker,
+            )
+        if min_beam_width is None:
+            frame_entropies = np.zeros(len(logits))
+        else:
+            frame_entropies = _get_frame_entropies(logits)
+        if self._engine == ENGINE_SOA:
+            return self._partial_decode_logits_soa(
+                logits,
+                beams,
+                beam_width,
+                beam_prune_logp,
+                token_min_logp,
+                prune_history,
+                hotword_scorer,
+                cached_lm_scores,
+                cached_p_lm_scores,
+                processed_frames=processed_frames,
+                frame_spans=frame_spans,
+                lm_score_cache=lm_score_cache,
+                min_beam_width=min_beam_width,
+                frame_entropies=frame_entropies,
+                token_top_k=token_top_k,
+                deadline=deadline,
+                counters=counters,
+                with_frames=with_frames,
+                grammar_tracker=grammar_tracker,
+            )
+        token_classes = self._token_classes
+        beam_width_sum = n_beams_sum = 0
+        candidate_idxs, candidate_offsets = _get_candidate_tokens(
+            logits, token_min_logp, token_top_k, self._get_required_token(grammar_tracker)
+        )
+        idx_lists = candidate_idxs.tolist()
         # bpe we can also have trailing word boundaries ▁⁇▁ so we may need to remember breaks
         force_next_break = False
-        for frame_idx, logit_col in enumerate(logits, start=processed_frames):
-            max_idx = logit_col.argmax()
-            idx_list = set(np.where(logit_col >= token_min_logp)[0]) | {max_idx}
+        for frame_idx, frame_end, logit_col, frame_entropy, start, end in zip(
+            *_get_frame_bounds(len(logits), processed_frames, frame_spans),
+            logits,
+            frame_entropies,
+            candidate_offsets[:-1].tolist(),
+            candidate_offsets[1:].tolist(),
+        ):
+            if counters is not None:
+                start_time = time.perf_counter()
+            frame_beam_width, frame_prune_logp = beam_width, beam_prune_logp
+            if deadline is not None:
+                frame_beam_width, frame_prune_logp = deadline.next_step()
             new_beams: List[Beam] = []
-            for idx_char in idx_list:
+            frame_idx_list = idx_lists[start:end]
+            if grammar_tracker is None:
+                frame_beams: Iterable[List[Beam]] = itertools.repeat(beams)
+            else:
+                frame_beams = grammar_tracker.get_token_beams(beams, frame_idx_list)
+            for idx_char, token_beams in zip(frame_idx_list, frame_beams):
                 p_char = logit_col[idx_char]
                 char = self._idx2vocab[idx_char]
-                for beam in beams:
+                token_class = token_classes[idx_char]
+                for beam in token_beams:
                     # if only blank token or same token
-                    if char == "" or beam.last_char == char:
-                        if char == "":
-                            new_end_frame = beam.partial_frames[0]
-                        else:
-                            new_end_frame = frame_idx + 1
+                    if token_class == TOKEN_BLANK or beam.last_char == char:
                         new_part_frames = (
                             beam.partial_frames
-                            if char == ""
-                            else (beam.partial_frames[0], new_end_frame)
+                            if token_class == TOKEN_BLANK or not with_frames
+                            else (beam.partial_frames[0], frame_end)
                         )
                         new_beams.append(
                             Beam(
-                                text=beam.text,
+                                text_node=beam.text_node,
                                 next_word=beam.next_word,
                                 partial_word=beam.partial_word,
                                 last_char=char,
@@ -471,41 +2093,45 @@ class BeamSearchDecoderCTC:
                             )
                         )
                     # if bpe and leading space char
-                    elif self._is_bpe and (char[:1] == BPE_TOKEN or force_next_break):
+                    elif token_class == TOKEN_WORD_START or force_next_break:
                         force_next_break = False
                         # some tokens are bounded on both sides like ▁⁇▁
                         clean_char = char
-                        if char[:1] == BPE_TOKEN:
+                        if token_class == TOKEN_WORD_START:
                             clean_char = clean_char[1:]
                         if char[-1:] == BPE_TOKEN:
                             clean_char = clean_char[:-1]
-                            force_next_break = True
+                            # the break would carry over to whichever beam is expanded next,
+                            # which the token automaton of a grammar cannot follow
+                            force_next_break = grammar_tracker is None
                         new_frame_list = (
                             beam.text_frames
-                            if beam.partial_word == ""
+                            if beam.partial_word == "" or not with_frames
                             else beam.text_frames + [beam.partial_frames]
                         )
                         new_beams.append(
                             Beam(
-                                text=beam.text,
+                                text_node=beam.text_node,
                                 next_word=beam.partial_word,
                                 partial_word=clean_char,
                                 last_char=char,
                                 text_frames=new_frame_list,
-                                partial_frames=(frame_idx, frame_idx + 1),
+                                partial_frames=(
+                                    (frame_idx, frame_end) if with_frames else NULL_FRAMES
+                                ),
                                 logit_score=beam.logit_score + p_char,
                             )
                         )
                     # if not bpe and space char
-                    elif not self._is_bpe and char == " ":
+                    elif token_class == TOKEN_SPACE:
                         new_frame_list = (
                             beam.text_frames
-                            if beam.partial_word == ""
+                            if beam.partial_word == "" or not with_frames
                             else beam.text_frames + [beam.partial_frames]
                         )
                         new_beams.append(
                             Beam(
-                                text=beam.text,
+                                text_node=beam.text_node,
                                 next_word=beam.partial_word,
                                 partial_word="",
                                 last_char=char,
@@ -516,14 +2142,15 @@ class BeamSearchDecoderCTC:
                         )
                     # general update of continuing token without space
                     else:
-                        new_part_frames = (
-                            (frame_idx, frame_idx + 1)
-                            if beam.partial_frames[0] < 0
-                            else (beam.partial_frames[0], frame_idx + 1)
-                        )
+                        if not with_frames:
+                            new_part_frames = NULL_FRAMES
+                        elif beam.partial_frames[0] < 0:
+                            new_part_frames = (frame_idx, frame_end)
+                        else:
+                            new_part_frames = (beam.partial_frames[0], frame_end)
                         new_beams.append(
                             Beam(
-                                beam.text,
+                                beam.text_node,
                                 beam.next_word,
                                 beam.partial_word + char,
                                 char,
@@ -534,27 +2161,185 @@ class BeamSearchDecoderCTC:
                         )
 
             # lm scoring and beam pruning
+            if counters is not None:
+                n_expanded = len(new_beams)
             new_beams = _merge_beams(new_beams)
+            if counters is not None:
+                lm_start_time = time.perf_counter()
+                counters.expand_seconds += lm_start_time - start_time
             scored_beams = self._get_lm_beams(
                 new_beams,
                 hotword_scorer,
                 cached_lm_scores,
                 cached_p_lm_scores,
+                lm_score_cache=lm_score_cache,
+                counters=counters,
             )
+            if counters is not None:
+                counters.lm_seconds += time.perf_counter() - lm_start_time
             # remove beam outliers
             max_score = max([b.lm_score for b in scored_beams])
-            scored_beams = [b for b in scored_beams if b.lm_score >= max_score + beam_prune_logp]
+            scored_beams = [b for b in scored_beams if b.lm_score >= max_score + frame_prune_logp]
+            if min_beam_width is not None:
+                frame_beam_width = _get_adaptive_beam_width(
+                    frame_entropy,
+                    [b.lm_score for b in scored_beams],
+                    max_score,
+                    min(min_beam_width, frame_beam_width),
+                    frame_beam_width,
+                )
             # beam pruning by taking highest N prefixes and then filtering down
-            trimmed_beams = _sort_and_trim_beams(scored_beams, beam_width)
+            trimmed_beams = _sort_and_trim_beams(scored_beams, frame_beam_width)
             # prune history and remove lm score from beams
             if prune_history:
-                lm_order = 1 if language_model is None else language_model.order
-                beams = _prune_history(trimmed_beams, lm_order=lm_order)
+                beams = _prune_history(trimmed_beams, grammar_tracker)
             else:
                 beams = [Beam.from_lm_beam(b) for b in trimmed_beams]
+            if counters is not None:
+                counters.count_frame(
+                    n_expanded, len(new_beams), len(scored_beams), len(trimmed_beams), len(beams)
+                )
+            beam_width_sum += frame_beam_width
+            n_beams_sum += len(beams)
+
+        self._record_beam_widths(len(logits), beam_width_sum, n_beams_sum)
+        return beams
+
+    def _partial_decode_logits_hybrid(
+        self,
+        logits: NDArray[NpFloat],
+        beams: List[Beam],
+        beam_width: int,
+        beam_prune_logp: float,
+        token_min_logp: float,
+        prune_history: bool,
+        hotword_scorer: HotwordScorer,
+        cached_lm_scores: LMScoreCache,
+        cached_p_lm_scores: Dict[str, float],
+        greedy_prob: float,
+        processed_frames: int = 0,
+        frame_spans: Optional[NDArray[np.int64]] = None,
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        min_beam_width: Optional[int] = None,
+        token_top_k: Optional[int] = None,
+        deadline: Optional[_DeadlineBudget] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
+    ) -> List[Beam]:
+        """Decode confident spans greedily and run beam search on the uncertain ones only.
 
+        The beams and score caches are carried from span to span, so the language model context
+        crosses span boundaries. In a greedy span the argmax runs are collapsed into single steps
+        and each beam is only extended by the argmax token, which appends the greedy output of
+        the span to every beam while the language model keeps scoring the completed words.
+        """
+        if frame_spans is None:
+            frame_spans = np.stack([np.arange(len(logits)), np.arange(1, len(logits) + 1)], axis=1)
+        # the spans of collapsed frames are relative to the logits too
+        frame_spans = frame_spans + processed_frames
+        for start, end, is_greedy in _get_greedy_spans(logits, greedy_prob, self._blank_idx):
+            span_logits = logits[start:end]
+            span_frames = frame_spans[start:end]
+            n_frames = int(span_frames[-1, 1] - span_frames[0, 0])
+            self._n_hybrid_frames += n_frames
+            if is_greedy:
+                self._n_greedy_frames += n_frames
+                span_logits, run_spans = _collapse_frames(span_logits, greedy_prob, self._blank_idx)
+                # map the runs back to the (start_frame, end_frame) of the original frames
+                span_frames = np.stack(
+                    [span_frames[run_spans[:, 0], 0], span_frames[run_spans[:, 1] - 1, 1]], axis=1
+                )
+            beams = self._partial_decode_logits(
+                span_logits,
+                beams,
+                beam_width,
+                beam_prune_logp,
+                # log probs never exceed 0, so only the argmax token of each step is expanded
+                0.0 if is_greedy else token_min_logp,
+                prune_history,
+                hotword_scorer,
+                cached_lm_scores,
+                cached_p_lm_scores,
+                frame_spans=span_frames,
+                lm_score_cache=lm_score_cache,
+                min_beam_width=None if is_greedy else min_beam_width,
+                token_top_k=token_top_k,
+                deadline=deadline,
+                counters=counters,
+                with_frames=with_frames,
+                grammar_tracker=grammar_tracker,
+            )
         return beams
 
+    def _partial_decode_logits_soa(
+        self,
+        logits: NDArray[NpFloat],
+        beams: List[Beam],
+        beam_width: int,
+        beam_prune_logp: float,
+        token_min_logp: float,
+        prune_history: bool,
+        hotword_scorer: HotwordScorer,
+        cached_lm_scores: LMScoreCache,
+        cached_p_lm_scores: Dict[str, float],
+        processed_frames: int = 0,
+        frame_spans: Optional[NDArray[np.int64]] = None,
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        min_beam_width: Optional[int] = None,
+        frame_entropies: Optional[NDArray[np.float64]] = None,
+        token_top_k: Optional[int] = None,
+        deadline: Optional[_DeadlineBudget] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
+    ) -> List[Beam]:
+        """Decode logits for a set of beams using the struct-of-arrays beam state."""
+        if frame_entropies is None:
+            frame_entropies = np.zeros(len(logits))
+        beam_search = _ArrayBeamSearch(
+            self._alphabet.labels,
+            self._token_classes,
+            self._language_model,
+            hotword_scorer,
+            beams,
+            beam_width,
+            prune_history,
+            cached_lm_scores,
+            cached_p_lm_scores,
+            lm_score_cache=lm_score_cache,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
+        )
+        candidate_idxs, candidate_offsets = _get_candidate_tokens(
+            logits, token_min_logp, token_top_k, self._get_required_token(grammar_tracker)
+        )
+        beam_width_sum = n_beams_sum = 0
+        for frame_idx, frame_end, logit_col, frame_entropy, start, end in zip(
+            *_get_frame_bounds(len(logits), processed_frames, frame_spans),
+            logits,
+            frame_entropies,
+            candidate_offsets[:-1].tolist(),
+            candidate_offsets[1:].tolist(),
+        ):
+            step_beam_width, step_prune_logp = beam_width, beam_prune_logp
+            if deadline is not None:
+                step_beam_width, step_prune_logp = deadline.next_step()
+            beam_width_sum += beam_search.step(
+                frame_idx,
+                frame_end,
+                logit_col,
+                candidate_idxs[start:end],
+                step_prune_logp,
+                min_beam_width=min_beam_width,
+                frame_entropy=frame_entropy,
+                beam_width=step_beam_width,
+            )
+            n_beams_sum += beam_search.n_beams
+        self._record_beam_widths(len(logits), beam_width_sum, n_beams_sum)
+        return beam_search.to_beams()
+
     def _finalize_beams(
         self,
         beams: Sequence[Beam],
@@ -565,6 +2350,10 @@ class BeamSearchDecoderCTC:
         cached_p_lm_scores: Dict[str, float],
         force_next_word: bool = False,
         is_end: bool = False,
+        lm_score_cache: Optional[SharedLMScoreCache] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
     ) -> List[LMBeam]:
         """Perform final language model scoring and sorting."""
         if force_next_word or is_end:
@@ -572,12 +2361,12 @@ class BeamSearchDecoderCTC:
             for beam in beams:
                 new_token_times = (
                     beam.text_frames
-                    if beam.partial_word == ""
+                    if beam.partial_word == "" or not with_frames
                     else beam.text_frames + [beam.partial_frames]
                 )
                 new_beams.append(
                     Beam(
-                        text=beam.text,
+                        text_node=beam.text_node,
                         next_word=beam.partial_word,
                         partial_word="",
                         last_char=None,
@@ -589,12 +2378,25 @@ class BeamSearchDecoderCTC:
             new_beams = _merge_beams(new_beams)
         else:
             new_beams = list(beams)
+        if is_end and grammar_tracker is not None:
+            # only texts the grammar accepts are output, there are none e.g. when the audio stops
+            # in the middle of a phrase
+            new_beams = [
+                beam
+                for beam in new_beams
+                if grammar_tracker.is_final(beam.text_node.extend(beam.next_word))
+            ]
+            if not new_beams:
+                logger.warning("No beam ends in a complete text of the grammar, nothing decoded.")
+                return []
         scored_beams = self._get_lm_beams(
             new_beams,
             hotword_scorer,
             cached_lm_scores,
             cached_p_lm_scores,
             is_eos=is_end,
+            lm_score_cache=lm_score_cache,
+            counters=counters,
         )
         # remove beam outliers
         max_score = max([b.lm_score for b in scored_beams])
@@ -610,11 +2412,22 @@ class BeamSearchDecoderCTC:
         prune_history: bool,
         hotword_scorer: HotwordScorer,
         lm_start_state: Optional[AbstractLMState] = None,
+        frame_spans: Optional[NDArray[np.int64]] = None,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline: Optional[_DeadlineBudget] = None,
+        counters: Optional[DecodeCounters] = None,
+        with_frames: bool = True,
+        grammar_tracker: Optional[_GrammarTracker] = None,
     ) -> List[OutputBeam]:
         """Perform beam search decoding."""
         # local dictionaries to cache scores during decoding
         # we can pass in an input start state to keep the decoder stateful and working on realtime
         language_model = self._language_model
+        # start with single beam to expand on
+        lm_order = 1 if language_model is None else language_model.order
+        beams = [_get_empty_start_beam(lm_order)]
         if language_model is None:
             cached_lm_scores: LMScoreCache = {}
         else:
@@ -622,10 +2435,11 @@ class BeamSearchDecoderCTC:
                 start_state = language_model.get_start_state()
             else:
                 start_state = lm_start_state
-            cached_lm_scores = {("", False): (0.0, 0.0, start_state)}
+            cached_lm_scores = {(beams[0].text_node, False): (0.0, 0.0, start_state)}
         cached_p_lm_scores: Dict[str, float] = {}
-        # start with single beam to expand on
-        beams = [EMPTY_START_BEAM]
+        # cached scores across utterances are keyed by the text history, which is only valid
+        # when starting from the default start state
+        lm_score_cache = self._lm_score_cache if lm_start_state is None else None
 
         beams = self._partial_decode_logits(
             logits,
@@ -637,6 +2451,15 @@ class BeamSearchDecoderCTC:
             hotword_scorer,
             cached_lm_scores,
             cached_p_lm_scores,
+            frame_spans=frame_spans,
+            lm_score_cache=lm_score_cache,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline=deadline,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
         )
         trimmed_beams = self._finalize_beams(
             beams,
@@ -647,6 +2470,10 @@ class BeamSearchDecoderCTC:
             cached_p_lm_scores,
             force_next_word=True,
             is_end=True,
+            lm_score_cache=lm_score_cache,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
         )
 
         # remove unnecessary information from beams
@@ -654,11 +2481,11 @@ class BeamSearchDecoderCTC:
             OutputBeam(
                 text=_normalize_whitespace(lm_beam.text),
                 last_lm_state=(
-                    cached_lm_scores[(lm_beam.text, True)][-1]
-                    if (lm_beam.text, True) in cached_lm_scores
+                    cached_lm_scores[(lm_beam.text_node, True)][-1]
+                    if (lm_beam.text_node, True) in cached_lm_scores
                     else None
                 ),
-                text_frames=list(zip(lm_beam.text.split(), lm_beam.text_frames)),
+                text_frames=list(zip(lm_beam.text_node.words, lm_beam.text_frames)),
                 logit_score=lm_beam.logit_score,
                 lm_score=lm_beam.lm_score,  # same as logit_score if lm is missing
             )
@@ -668,13 +2495,14 @@ class BeamSearchDecoderCTC:
 
     def get_starting_state(self) -> Tuple[List[Beam], LMScoreCache, Dict[str, float]]:
         """Get the starting beams and initial caches."""
-        start_beam = [EMPTY_START_BEAM]
         language_model = self._language_model
+        lm_order = 1 if language_model is None else language_model.order
+        start_beam = [_get_empty_start_beam(lm_order)]
         if language_model is None:
             cached_lm_scores: LMScoreCache = {}
         else:
             start_state = language_model.get_start_state()
-            cached_lm_scores = {("", False): (0.0, 0.0, start_state)}
+            cached_lm_scores = {(start_beam[0].text_node, False): (0.0, 0.0, start_state)}
         cached_p_lm_scores: Dict[str, float] = {}
         return start_beam, cached_lm_scores, cached_p_lm_scores
 
@@ -692,17 +2520,32 @@ class BeamSearchDecoderCTC:
         hotword_scorer: Optional[HotwordScorer] = None,
         force_next_word: bool = False,
         is_end: bool = False,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        with_frames: bool = True,
+        grammar: Optional[Grammar] = None,
+        grammar_state: Optional[int] = None,
     ) -> List[LMBeam]:
         """Decode beams for the given logits, allowing for additional decoding steps."""
+        start_time = time.perf_counter()
         self._check_logits_dimension(logits)
-        hotword_scorer = hotword_scorer or HotwordScorer.build_scorer([], weight=0.0)
-        # make sure we have log probs as input
-        if math.isclose(logits.sum(axis=1).mean(), 1):
-            # input looks like probabilities, so take log
-            logits = np.log(np.clip(logits, MIN_TOKEN_CLIP_P, 1))
-        else:
-            # convert logits into log probs
-            logits = np.clip(_log_softmax(logits, axis=1), np.log(MIN_TOKEN_CLIP_P), 0)
+        hotword_scorer = hotword_scorer or get_hotword_scorer([], weight=0.0)
+        logits = self._get_log_probs(logits, is_log_probs)
+        frame_spans = None
+        if collapse_prob is not None:
+            logits, frame_spans = _collapse_frames(logits, collapse_prob, self._blank_idx)
+        deadline = None
+        if deadline_ms is not None:
+            deadline = _DeadlineBudget(
+                deadline_ms, len(logits), beam_width, beam_prune_logp, start_time
+            )
+        counters = DecodeCounters() if collect_counters else None
+        grammar_tracker = self._get_grammar_tracker(grammar, grammar_state)
         beams = self._partial_decode_logits(
             logits,
             beams,
@@ -714,6 +2557,14 @@ class BeamSearchDecoderCTC:
             cached_lm_scores,
             cached_p_lm_scores,
             processed_frames=processed_frames,
+            frame_spans=frame_spans,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline=deadline,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
         )
         trimmed_beams = self._finalize_beams(
             beams,
@@ -724,7 +2575,15 @@ class BeamSearchDecoderCTC:
             cached_p_lm_scores,
             force_next_word=force_next_word,
             is_end=is_end,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
         )
+        if deadline is not None:
+            self._record_deadline_report(deadline.get_report())
+        if counters is not None:
+            counters.seconds = time.perf_counter() - start_time
+            self._record_counters(counters)
         return trimmed_beams
 
     def decode_beams(
@@ -737,6 +2596,15 @@ class BeamSearchDecoderCTC:
         hotwords: Optional[Iterable[str]] = None,
         hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
         lm_start_state: Optional[AbstractLMState] = None,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        with_frames: bool = True,
+        grammar: Optional[Grammar] = None,
     ) -> List[OutputBeam]:
         """Convert input token logit matrix to decoded beams including meta information.
 
@@ -749,20 +2617,54 @@ class BeamSearchDecoderCTC:
             hotwords: list of words with extra importance, can be OOV for LM
             hotword_weight: weight factor for hotword importance
             lm_start_state: language model start state for stateful predictions
+            collapse_prob: if set, runs of frames whose blank or argmax token has at least this
+                probability are collapsed into a single decoding step before beam search
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: if set, the beam width of each frame adapts between min_beam_width
+                and beam_width to the posterior entropy of the frame and the number of beams
+                scoring close to the best one, see `get_beam_width_stats` for the effective width
+            greedy_prob: if set, hybrid decoding: segments between frames with at least this blank
+                probability are decoded greedily if all their frames have an argmax token with at
+                least this probability, beam search only runs on the other segments, see
+                `get_greedy_stats` for the fraction of frames decoded greedily
+            token_top_k: if set, at most this many tokens with the highest log probabilities
+                are expanded per frame, besides the token_min_logp threshold, which bounds
+                the expansion cost for large vocabularies such as BPE
+            deadline_ms: if set, latency budget of the call in milliseconds: when the remaining
+                frames are projected to overrun it, the beam width is halved and beam_prune_logp
+                tightened on the fly, down to a single beam once it has passed, see
+                `last_deadline_report` and `get_deadline_stats` for how much was degraded
+            collect_counters: whether to count expanded, merged and pruned beams, language model
+                calls and cache hits, and the time spent expanding beams and scoring them with
+                the language model, the counters are set on `OutputBeam.counters` and kept per
+                call by the decoder, see `get_counters`
+            with_frames: whether to keep track of word frames, without them the beams are
+                decoded in a slim mode without frame bookkeeping and `text_frames` is empty
+            grammar: if set, only texts the grammar accepts are decoded, see `myGrammar`: the beams
+                are only extended by the tokens the grammar allows from their state, which
+                shrinks the search so that narrow beams suffice. If no beam ends in a complete
+                text of the grammar, e.g. because the audio stops mid-phrase, no beams are
+                returned. greedy_prob is ignored, a greedy argmax may leave the grammar
 
         Returns:
-            List of beams of type OutputBeam with various meta information
+            List of beams of type OutputBeam with various meta information, empty if a grammar
+            is set and no beam completes a text of it
         """
+        start_time = time.perf_counter()
         self._check_logits_dimension(logits)
         # prepare hotword input
-        hotword_scorer = HotwordScorer.build_scorer(hotwords, weight=hotword_weight)
-        # make sure we have log probs as input
-        if math.isclose(logits.sum(axis=1).mean(), 1):
-            # input looks like probabilities, so take log
-            logits = np.log(np.clip(logits, MIN_TOKEN_CLIP_P, 1))
-        else:
-            # convert logits into log probs
-            logits = np.clip(_log_softmax(logits, axis=1), np.log(MIN_TOKEN_CLIP_P), 0)
+        hotword_scorer = get_hotword_scorer(hotwords, weight=hotword_weight)
+        logits = self._get_log_probs(logits, is_log_probs)
+        frame_spans = None
+        if collapse_prob is not None:
+            logits, frame_spans = _collapse_frames(logits, collapse_prob, self._blank_idx)
+        deadline = None
+        if deadline_ms is not None:
+            deadline = _DeadlineBudget(
+                deadline_ms, len(logits), beam_width, beam_prune_logp, start_time
+            )
+        counters = DecodeCounters() if collect_counters else None
+        grammar_tracker = self._get_grammar_tracker(grammar)
         decoded_beams = self._decode_logits(
             logits,
             beam_width=beam_width,
@@ -771,7 +2673,23 @@ class BeamSearchDecoderCTC:
             prune_history=prune_history,
             hotword_scorer=hotword_scorer,
             lm_start_state=lm_start_state,
+            frame_spans=frame_spans,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline=deadline,
+            counters=counters,
+            with_frames=with_frames,
+            grammar_tracker=grammar_tracker,
         )
+        if deadline is not None:
+            self._record_deadline_report(deadline.get_report())
+        if counters is not None:
+            counters.seconds = time.perf_counter() - start_time
+            counter_values = self._record_counters(counters)
+            decoded_beams = [
+                dataclasses.replace(beam, counters=counter_values) for beam in decoded_beams
+            ]
         return decoded_beams
 
     def _decode_beams_mp_safe(
@@ -783,6 +2701,15 @@ class BeamSearchDecoderCTC:
         prune_history: bool,
         hotwords: Optional[Iterable[str]],
         hotword_weight: float,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        with_frames: bool = True,
+        grammar: Optional[Grammar] = None,
     ) -> List[OutputBeam]:
         """Thing wrapper around self.decode_beams to allow for multiprocessing."""
         decoded_beams = self.decode_beams(
@@ -793,6 +2720,15 @@ class BeamSearchDecoderCTC:
             prune_history=prune_history,
             hotwords=hotwords,
             hotword_weight=hotword_weight,
+            collapse_prob=collapse_prob,
+            is_log_probs=is_log_probs,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline_ms=deadline_ms,
+            collect_counters=collect_counters,
+            with_frames=with_frames,
+            grammar=grammar,
         )
         # remove state to allow multiprocessing
         decoded_beams_mp_safe = [output_beam.get_mp_safe_beam() for output_beam in decoded_beams]
@@ -808,6 +2744,15 @@ class BeamSearchDecoderCTC:
         prune_history: bool = DEFAULT_PRUNE_BEAMS,
         hotwords: Optional[Iterable[str]] = None,
         hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        with_frames: bool = True,
+        grammar: Optional[Grammar] = None,
     ) -> List[List[OutputBeam]]:
         """Use multiprocessing pool to batch decode input logits.
 
@@ -823,10 +2768,22 @@ class BeamSearchDecoderCTC:
             prune_history: prune beams based on shared recent history at the cost of beam diversity
             hotwords: list of words with extra importance, can be OOV for LM
             hotword_weight: weight factor for hotword importance
+            collapse_prob: minimum blank or argmax token probability for frame run collapsing
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: minimum beam width of the entropy-adaptive beam, fixed width if None
+            greedy_prob: minimum frame probability for greedy decoding of confident spans
+            token_top_k: maximum number of tokens expanded per frame, see `decode_beams`
+            deadline_ms: latency budget of each call in milliseconds, see `decode_beams`
+            collect_counters: whether to collect hot path counters, see `decode_beams`
+            with_frames: whether to keep track of word frames, see `decode_beams`
+            grammar: grammar the decoded texts must follow, see `decode_beams`
 
         Returns:
             List of list of multiprocessing-safe OutputBeams with various meta information
         """
+        if hotwords is not None:
+            # reusable across utterances and cheap to send to workers, see `get_hotword_scorer`
+            hotwords = tuple(hotwords)
         valid_pool = _get_valid_pool(pool)
         if valid_pool is None:
             return [
@@ -838,6 +2795,15 @@ class BeamSearchDecoderCTC:
                     hotwords=hotwords,
                     prune_history=prune_history,
                     hotword_weight=hotword_weight,
+                    collapse_prob=collapse_prob,
+                    is_log_probs=is_log_probs,
+                    min_beam_width=min_beam_width,
+                    greedy_prob=greedy_prob,
+                    token_top_k=token_top_k,
+                    deadline_ms=deadline_ms,
+                    collect_counters=collect_counters,
+                    with_frames=with_frames,
+                    grammar=grammar,
                 )
                 for logits in logits_list
             ]
@@ -852,6 +2818,15 @@ class BeamSearchDecoderCTC:
             hotwords=hotwords,
             prune_history=prune_history,
             hotword_weight=hotword_weight,
+            collapse_prob=collapse_prob,
+            is_log_probs=is_log_probs,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline_ms=deadline_ms,
+            collect_counters=collect_counters,
+            with_frames=with_frames,
+            grammar=grammar,
         )
         decoded_beams_list: List[List[OutputBeam]] = valid_pool.map(p_decode, logits_list)
         return decoded_beams_list
@@ -865,6 +2840,14 @@ class BeamSearchDecoderCTC:
         hotwords: Optional[Iterable[str]] = None,
         hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
         lm_start_state: Optional[AbstractLMState] = None,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        grammar: Optional[Grammar] = None,
     ) -> str:
         """Convert input token logit matrix to decoded text.
 
@@ -876,9 +2859,17 @@ class BeamSearchDecoderCTC:
             hotwords: list of words with extra importance, can be OOV for LM
             hotword_weight: weight factor for hotword importance
             lm_start_state: language model start state for stateful predictions
+            collapse_prob: minimum blank or argmax token probability for frame run collapsing
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: minimum beam width of the entropy-adaptive beam, fixed width if None
+            greedy_prob: minimum frame probability for greedy decoding of confident spans
+            token_top_k: maximum number of tokens expanded per frame, see `decode_beams`
+            deadline_ms: latency budget of each call in milliseconds, see `decode_beams`
+            collect_counters: whether to collect hot path counters, see `decode_beams`
+            grammar: grammar the decoded texts must follow, see `decode_beams`
 
         Returns:
-            The decoded text (str)
+            The decoded text (str), empty if a grammar is set and no beam completes a text of it
         """
         decoded_beams = self.decode_beams(
             logits,
@@ -889,7 +2880,19 @@ class BeamSearchDecoderCTC:
             hotwords=hotwords,
             hotword_weight=hotword_weight,
             lm_start_state=lm_start_state,
+            collapse_prob=collapse_prob,
+            is_log_probs=is_log_probs,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline_ms=deadline_ms,
+            collect_counters=collect_counters,
+            grammar=grammar,
+            with_frames=False,  # the word frames of the text are not returned
         )
+        if not decoded_beams:
+            # no text of the grammar was decoded
+            return ""
         return decoded_beams[0].text
 
     def decode_batch(
@@ -901,6 +2904,14 @@ class BeamSearchDecoderCTC:
         token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
         hotwords: Optional[Iterable[str]] = None,
         hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        grammar: Optional[Grammar] = None,
     ) -> List[str]:
         """Use multiprocessing pool to batch decode input logits.
 
@@ -915,10 +2926,21 @@ class BeamSearchDecoderCTC:
             token_min_logp: tokens below this logp are skipped unless they are argmax of frame
             hotwords: list of words with extra importance, can be OOV for LM
             hotword_weight: weight factor for hotword importance
+            collapse_prob: minimum blank or argmax token probability for frame run collapsing
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: minimum beam width of the entropy-adaptive beam, fixed width if None
+            greedy_prob: minimum frame probability for greedy decoding of confident spans
+            token_top_k: maximum number of tokens expanded per frame, see `decode_beams`
+            deadline_ms: latency budget of each call in milliseconds, see `decode_beams`
+            collect_counters: whether to collect hot path counters, see `decode_beams`
+            grammar: grammar the decoded texts must follow, see `decode_beams`
 
         Returns:
             The decoded texts (list of str)
         """
+        if hotwords is not None:
+            # reusable across utterances and cheap to send to workers, see `get_hotword_scorer`
+            hotwords = tuple(hotwords)
         valid_pool = _get_valid_pool(pool)
         if valid_pool is None:
             return [
@@ -929,6 +2951,14 @@ class BeamSearchDecoderCTC:
                     token_min_logp=token_min_logp,
                     hotwords=hotwords,
                     hotword_weight=hotword_weight,
+                    collapse_prob=collapse_prob,
+                    is_log_probs=is_log_probs,
+                    min_beam_width=min_beam_width,
+                    greedy_prob=greedy_prob,
+                    token_top_k=token_top_k,
+                    deadline_ms=deadline_ms,
+                    collect_counters=collect_counters,
+                    grammar=grammar,
                 )
                 for logits in logits_list
             ]
@@ -940,12 +2970,89 @@ class BeamSearchDecoderCTC:
             token_min_logp=token_min_logp,
             hotwords=hotwords,
             hotword_weight=hotword_weight,
+            collapse_prob=collapse_prob,
+            is_log_probs=is_log_probs,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline_ms=deadline_ms,
+            collect_counters=collect_counters,
+            grammar=grammar,
         )
         decoded_text_list: List[str] = valid_pool.map(p_decode, logits_list)
         return decoded_text_list
 
-    def save_to_dir(self, filepath: str) -> None:
-        """Save a decoder to a directory."""
+    def decode_padded_batch(
+        self,
+        pool: Optional[Pool],
+        logits: Any,
+        relative_lens: Any,
+        beam_width: int = DEFAULT_BEAM_WIDTH,
+        beam_prune_logp: float = DEFAULT_PRUNE_LOGP,
+        token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
+        hotwords: Optional[Iterable[str]] = None,
+        hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        grammar: Optional[Grammar] = None,
+    ) -> List[str]:
+        """Batch decode a padded logit batch, decoding only the valid frames of each utterance.
+
+        Args:
+            pool: multiprocessing pool for parallel execution
+            logits: padded logits of shape (batch, time, vocabulary), numpy array or torch tensor
+            relative_lens: length of each utterance relative to the padded length, e.g. the
+                speechbrain `wav_lens`, numpy array or torch tensor
+            beam_width: maximum number of beams at each step in decoding
+            beam_prune_logp: beams that are much worse than best beam will be pruned
+            token_min_logp: tokens below this logp are skipped unless they are argmax of frame
+            hotwords: list of words with extra importance, can be OOV for LM
+            hotword_weight: weight factor for hotword importance
+            collapse_prob: minimum blank or argmax token probability for frame run collapsing
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: minimum beam width of the entropy-adaptive beam, fixed width if None
+            greedy_prob: minimum frame probability for greedy decoding of confident spans
+            token_top_k: maximum number of tokens expanded per frame, see `decode_beams`
+            deadline_ms: latency budget of each call in milliseconds, see `decode_beams`
+            collect_counters: whether to collect hot path counters, see `decode_beams`
+            grammar: grammar the decoded texts must follow, see `decode_beams`
+
+        Returns:
+            The decoded texts (list of str)
+        """
+        return self.decode_batch(
+            pool,
+            split_padded_batch(logits, relative_lens),  # type: ignore [arg-type]
+            beam_width=beam_width,
+            beam_prune_logp=beam_prune_logp,
+            token_min_logp=token_min_logp,
+            hotwords=hotwords,
+            hotword_weight=hotword_weight,
+            collapse_prob=collapse_prob,
+            is_log_probs=is_log_probs,
+            min_beam_width=min_beam_width,
+            greedy_prob=greedy_prob,
+            token_top_k=token_top_k,
+            deadline_ms=deadline_ms,
+            collect_counters=collect_counters,
+            grammar=grammar,
+        )
+
+    def save_to_dir(self, filepath: str, compiled: bool = False) -> None:
+        """Save a decoder to a directory.
+
+        Args:
+            filepath: directory to save to
+            compiled: save a compiled artifact that loads without parsing any text file. A kenlm
+                language model loaded from an arpa file gets compiled into memory-mapped arrays,
+                see `myLanguageModel.compile_arpa`, and a manifest with the content hash of all
+                files is written, see `load_from_dir`.
+        """
         alphabet_path = os.path.join(filepath, self._ALPHABET_SERIALIZED_FILENAME)
         with open(alphabet_path, "w") as fi:
             fi.write(self._alphabet.dumps())
@@ -956,8 +3063,53 @@ class BeamSearchDecoderCTC:
         else:
             lm_path = os.path.join(filepath, self._LANGUAGE_MODEL_SERIALIZED_DIRECTORY)
             os.makedirs(lm_path)
+            if compiled and isinstance(lm, LanguageModel):
+                logger.info("Compiling language model to %s", lm_path)
+                lm = NgramLanguageModel.from_language_model(lm, lm_path)
             logger.info("Saving language model to %s", lm_path)
             lm.save_to_dir(lm_path)
+        if compiled:
+            if lm is not None and not isinstance(lm, NgramLanguageModel):
+                logger.warning("%s is saved in its own format, not compiled.", type(lm).__name__)
+            file_sizes = {
+                relpath: os.path.getsize(os.path.join(filepath, relpath))
+                for relpath in _list_artifact_files(filepath)
+            }
+            manifest = {
+                "format_version": self._ARTIFACT_FORMAT_VERSION,
+                "content_hash": get_content_hash(filepath, sorted(file_sizes)),
+                "file_sizes": file_sizes,
+            }
+            with open(os.path.join(filepath, self._MANIFEST_SERIALIZED_FILENAME), "w") as fi:
+                json.dump(manifest, fi, indent=2)
+
+    @staticmethod
+    def read_manifest(filepath: str) -> Optional[Dict[str, Any]]:
+        """Read the manifest of a compiled decoder directory, None if the directory has none."""
+        manifest_path = os.path.join(filepath, BeamSearchDecoderCTC._MANIFEST_SERIALIZED_FILENAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r") as fi:
+            manifest: Dict[str, Any] = json.load(fi)
+        return manifest
+
+    @staticmethod
+    def _check_manifest(filepath: str, manifest: Dict[str, Any], verify: bool) -> None:
+        """Check the files of a compiled decoder directory against its manifest."""
+        if manifest["format_version"] != BeamSearchDecoderCTC._ARTIFACT_FORMAT_VERSION:
+            raise ValueError(
+                f"Compiled decoder format {manifest['format_version']} is not supported, "
+                f"expected {BeamSearchDecoderCTC._ARTIFACT_FORMAT_VERSION}. Save it again."
+            )
+        file_sizes = {
+            relpath: os.path.getsize(os.path.join(filepath, relpath))
+            for relpath in _list_artifact_files(filepath)
+        }
+        if file_sizes != manifest["file_sizes"]:
+            raise ValueError(f"Files in {filepath} do not match its manifest.")
+        # hashing reads every file, the size check above is enough to catch most stale copies
+        if verify and get_content_hash(filepath, sorted(file_sizes)) != manifest["content_hash"]:
+            raise ValueError(f"Content hash of {filepath} does not match its manifest.")
 
     @staticmethod
     def parse_directory_contents(filepath: str) -> Dict[str, Union[str, None]]:
@@ -974,6 +3126,8 @@ class BeamSearchDecoderCTC:
             filepath, BeamSearchDecoderCTC._ALPHABET_SERIALIZED_FILENAME
         )
         contents.remove(BeamSearchDecoderCTC._ALPHABET_SERIALIZED_FILENAME)
+        if BeamSearchDecoderCTC._MANIFEST_SERIALIZED_FILENAME in contents:
+            contents.remove(BeamSearchDecoderCTC._MANIFEST_SERIALIZED_FILENAME)
         lm_directory: Optional[str]
         if contents:
             if BeamSearchDecoderCTC._LANGUAGE_MODEL_SERIALIZED_DIRECTORY not in contents:
@@ -990,19 +3144,49 @@ class BeamSearchDecoderCTC:
 
     @classmethod
     def load_from_dir(
-        cls, filepath: str, unigram_encoding: Optional[str] = None
+        cls,
+        filepath: str,
+        unigram_encoding: Optional[str] = None,
+        verify: bool = False,
+        alpha: Optional[float] = None,
+        beta: Optional[float] = None,
     ) -> "BeamSearchDecoderCTC":
-        """Load a decoder from a directory."""
+        """Load a decoder from a directory.
+
+        A compiled directory, see `save_to_dir`, loads in milliseconds: the alphabet is stored
+        normalized and the arrays of the language model and its unigrams are memory-mapped.
+
+        Args:
+            filepath: directory the decoder was saved to
+            unigram_encoding: encoding of the unigram file of a kenlm language model
+            verify: check the content hash of a compiled directory, which reads all its files
+            alpha: language model weight replacing the saved one
+            beta: word insertion bonus replacing the saved one
+
+        Returns:
+            instance of BeamSearchDecoderCTC
+        """
+        manifest = cls.read_manifest(filepath)
+        if manifest is not None:
+            cls._check_manifest(filepath, manifest, verify)
+        elif verify:
+            raise ValueError(f"{filepath} has no manifest to verify, save it with compiled=True.")
         filenames = cls.parse_directory_contents(filepath)
         with open(filenames["alphabet"], "r") as fi:  # type: ignore
             alphabet = Alphabet.loads(fi.read())
         if filenames["language_model"] is None:
             language_model = None
+        elif NgramLanguageModel.is_serialized_dir(filenames["language_model"]):
+            language_model = NgramLanguageModel.load_from_dir(filenames["language_model"])
+        elif DawgLanguageModel.is_serialized_dir(filenames["language_model"]):
+            language_model = DawgLanguageModel.load_from_dir(filenames["language_model"])
         else:
             language_model = LanguageModel.load_from_dir(
                 filenames["language_model"], unigram_encoding=unigram_encoding
             )
-        return cls(alphabet, language_model=language_model)
+        decoder = cls(alphabet, language_model=language_model)
+        decoder.reset_params(alpha=alpha, beta=beta)
+        return decoder
 
     @classmethod
     def load_from_hf_hub(  # type: ignore
@@ -1043,6 +3227,242 @@ class BeamSearchDecoderCTC:
         return cls.load_from_dir(cached_directory)
 
 
+@dataclasses.dataclass(frozen=True)
+class DecodeSessionUpdate:
+    """Result of feeding one chunk of logits to a DecodeSession."""
+
+    committed: List[WordFrames]  # words that became final with this chunk
+    partial_text: str  # best current hypothesis for the part that is not committed yet
+    latency_ms: float  # wall time spent decoding the chunk
+
+
+class DecodeSession:
+    def __init__(
+        self,
+        decoder: BeamSearchDecoderCTC,
+        beam_width: int = DEFAULT_BEAM_WIDTH,
+        beam_prune_logp: float = DEFAULT_PRUNE_LOGP,
+        token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
+        prune_history: bool = DEFAULT_PRUNE_BEAMS,
+        hotwords: Optional[Iterable[str]] = None,
+        hotword_weight: float = DEFAULT_HOTWORD_WEIGHT,
+        collapse_prob: Optional[float] = None,
+        is_log_probs: bool = False,
+        min_beam_width: Optional[int] = None,
+        greedy_prob: Optional[float] = None,
+        token_top_k: Optional[int] = None,
+        deadline_ms: Optional[float] = None,
+        collect_counters: bool = False,
+        grammar: Optional[Grammar] = None,
+    ) -> None:
+        """Incremental decoding of a stream of logit chunks with bounded memory.
+
+        Wraps the beams and score caches of `get_starting_state` / `partial_decode_beams`. After
+        every chunk the words that all surviving beams agree on are committed: they can no longer
+        change, so they are emitted and stripped from the beams and cache keys, and cache entries
+        that do not extend the committed prefix are dropped since no beam can reach them anymore.
+
+        Args:
+            decoder: decoder to use
+            beam_width: maximum number of beams at each step in decoding
+            beam_prune_logp: beams that are much worse than best beam will be pruned
+            token_min_logp: tokens below this logp are skipped unless they are argmax of frame
+            prune_history: prune beams based on shared recent history at the cost of beam diversity
+            hotwords: list of words with extra importance, can be OOV for LM
+            hotword_weight: weight factor for hotword importance
+            collapse_prob: minimum blank or argmax token probability for frame run collapsing
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+            min_beam_width: minimum beam width of the entropy-adaptive beam, fixed width if None
+            greedy_prob: minimum frame probability for greedy decoding of confident spans
+            token_top_k: maximum number of tokens expanded per frame, see `decode_beams`
+            deadline_ms: latency budget of each push in milliseconds, see `decode_beams`
+            collect_counters: whether to collect hot path counters, see `decode_beams`
+            grammar: grammar the decoded text must follow, see `decode_beams`
+        """
+        self._decoder = decoder
+        self._beam_width = beam_width
+        self._beam_prune_logp = beam_prune_logp
+        self._token_min_logp = token_min_logp
+        self._prune_history = prune_history
+        self._hotword_scorer = get_hotword_scorer(hotwords, weight=hotword_weight)
+        self._collapse_prob = collapse_prob
+        self._is_log_probs = is_log_probs
+        self._min_beam_width = min_beam_width
+        self._greedy_prob = greedy_prob
+        self._token_top_k = token_top_k
+        self._deadline_ms = deadline_ms
+        self._collect_counters = collect_counters
+        self._grammar = grammar
+        # grammar state of the committed text, the beams continue from it
+        self._grammar_state = None if grammar is None else grammar.start
+        beams, self._cached_lm_scores, self._cached_p_lm_scores = decoder.get_starting_state()
+        self._beams: List[Beam] = list(beams)
+        self._processed_frames = 0
+        self._committed: List[WordFrames] = []
+        self._committed_hotword_score = 0.0
+        self.chunk_latencies_ms: List[float] = []
+
+    @property
+    def committed_text(self) -> str:
+        """Text that is final."""
+        return " ".join(word for word, _ in self._committed)
+
+    @property
+    def processed_frames(self) -> int:
+        """Number of frames decoded so far."""
+        return self._processed_frames
+
+    def _commit(self) -> List[WordFrames]:
+        """Commit the words shared by all beams and drop what they make unreachable."""
+        # deepest text node that all beams descend from
+        text_nodes = [beam.text_node for beam in self._beams]
+        n_common = min(text_node.n_words for text_node in text_nodes)
+        for n, text_node in enumerate(text_nodes):
+            while text_node.n_words > n_common:
+                text_node = text_node.parent  # type: ignore [assignment]
+            text_nodes[n] = text_node
+        while any(text_node is not text_nodes[0] for text_node in text_nodes[1:]):
+            text_nodes = [text_node.parent for text_node in text_nodes]  # type: ignore [misc]
+        commit_node = text_nodes[0]
+        n_common = commit_node.n_words
+        if n_common == 0:
+            return []
+        committed_words = commit_node.words
+        newly_committed = list(zip(committed_words, self._beams[0].text_frames[:n_common]))
+        self._committed.extend(newly_committed)
+        if self._grammar is not None:
+            self._grammar_state = self._grammar.advance(
+                self._grammar_state, " " + " ".join(committed_words)  # type: ignore [arg-type]
+            )
+
+        # move everything below the committed words to a new trie and forget the rest
+        new_text_nodes: Dict[TextNode, Optional[TextNode]] = {
+            commit_node: TextTrie(commit_node.trie.lm_order).root
+        }
+
+        def rebase(text_node: TextNode) -> Optional[TextNode]:
+            path = []
+            while text_node not in new_text_nodes and text_node.n_words > n_common:
+                path.append(text_node)
+                text_node = text_node.parent  # type: ignore [assignment]
+            new_text_node = new_text_nodes.get(text_node)
+            for old_text_node in reversed(path):
+                if new_text_node is not None:
+                    new_text_node = new_text_node.extend(old_text_node.word)
+                new_text_nodes[old_text_node] = new_text_node
+            return new_text_node
+
+        # hotword matches never cross word boundaries, so the committed words contribute the
+        # same hotword score to every beam and can be taken out of the cached scores
+        committed_hotword_score = self._hotword_scorer.score(" ".join(committed_words))
+        self._committed_hotword_score += committed_hotword_score
+        cached_lm_scores: LMScoreCache = {}
+        for (text_node, is_eos), (lm_hw_score, raw_lm_score, lm_state) in (
+            self._cached_lm_scores.items()
+        ):
+            new_text_node = rebase(text_node)
+            if new_text_node is not None:
+                cached_lm_scores[(new_text_node, is_eos)] = (
+                    lm_hw_score - committed_hotword_score,
+                    raw_lm_score,
+                    lm_state,
+                )
+        self._cached_lm_scores = cached_lm_scores
+        self._beams = [
+            dataclasses.replace(
+                beam,
+                text_node=rebase(beam.text_node),
+                text_frames=beam.text_frames[n_common:],
+            )
+            for beam in self._beams
+        ]
+        # partial token scores are cheap to recompute, keep the ones of live beams only
+        partial_words = {beam.partial_word for beam in self._beams}
+        self._cached_p_lm_scores = {
+            word: score for word, score in self._cached_p_lm_scores.items() if word in partial_words
+        }
+        # nothing refers to the old trie anymore
+        commit_node.trie.release()
+        return newly_committed
+
+    def push(self, logits: NDArray[NpFloat]) -> DecodeSessionUpdate:
+        """Decode the next chunk of logits.
+
+        Args:
+            logits: logit matrix of token log probabilities for the next frames
+
+        Returns:
+            newly committed words, current partial hypothesis and latency of the chunk
+        """
+        start = time.perf_counter()
+        self._beams = self._decoder.partial_decode_beams(  # type: ignore [assignment]
+            logits,
+            self._cached_lm_scores,
+            self._cached_p_lm_scores,
+            self._beams,
+            self._processed_frames,
+            beam_width=self._beam_width,
+            beam_prune_logp=self._beam_prune_logp,
+            token_min_logp=self._token_min_logp,
+            prune_history=self._prune_history,
+            hotword_scorer=self._hotword_scorer,
+            collapse_prob=self._collapse_prob,
+            is_log_probs=self._is_log_probs,
+            min_beam_width=self._min_beam_width,
+            greedy_prob=self._greedy_prob,
+            token_top_k=self._token_top_k,
+            deadline_ms=self._deadline_ms,
+            collect_counters=self._collect_counters,
+            grammar=self._grammar,
+            grammar_state=self._grammar_state,
+        )
+        self._processed_frames += len(logits)
+        committed = self._commit()
+        best_beam = self._beams[0]
+        latency_ms = 1000.0 * (time.perf_counter() - start)
+        self.chunk_latencies_ms.append(latency_ms)
+        return DecodeSessionUpdate(
+            committed=committed,
+            partial_text=_merge_tokens(best_beam.text, best_beam.partial_word),
+            latency_ms=latency_ms,
+        )
+
+    def finish(self) -> List[OutputBeam]:
+        """Score the end of the stream and return the final beams for the whole stream.
+
+        With a grammar, no beams are returned if none completes a text of it.
+        """
+        trimmed_beams = self._decoder._finalize_beams(  # pylint: disable=protected-access
+            self._beams,
+            self._beam_width,
+            self._beam_prune_logp,
+            self._hotword_scorer,
+            self._cached_lm_scores,
+            self._cached_p_lm_scores,
+            force_next_word=True,
+            is_end=True,
+            grammar_tracker=self._decoder._get_grammar_tracker(  # pylint: disable=protected-access
+                self._grammar, self._grammar_state
+            ),
+        )
+        committed_text = self.committed_text
+        return [
+            OutputBeam(
+                text=_normalize_whitespace(_merge_tokens(committed_text, lm_beam.text)),
+                last_lm_state=(
+                    self._cached_lm_scores[(lm_beam.text_node, True)][-1]
+                    if (lm_beam.text_node, True) in self._cached_lm_scores
+                    else None
+                ),
+                text_frames=self._committed
+                + list(zip(lm_beam.text_node.words, lm_beam.text_frames)),
+                logit_score=lm_beam.logit_score,
+                lm_score=lm_beam.lm_score + self._committed_hotword_score,
+            )
+            for lm_beam in trimmed_beams
+        ]
+
+
 ##########################################################################################
 # Main entry point and convenience function to create BeamSearchDecoderCTC object ########
 ##########################################################################################
@@ -1056,21 +3476,51 @@ def build_ctcdecoder(
     beta: float = DEFAULT_BETA,
     unk_score_offset: float = DEFAULT_UNK_LOGP_OFFSET,
     lm_score_boundary: bool = DEFAULT_SCORE_LM_BOUNDARY,
+    engine: str = ENGINE_REFERENCE,
+    lm_cache_bytes: int = DEFAULT_LM_CACHE_BYTES,
 ) -> BeamSearchDecoderCTC:
     """Build a BeamSearchDecoderCTC instance with main functionality.
 
     Args:
         labels: class containing the labels for input logit matrices
-        kenlm_model_path: path to kenlm n-gram language model
+        kenlm_model_path: path to kenlm n-gram language model, or to a directory compiled with
+            `myLanguageModel.compile_arpa`, which is used instead of kenlm. Without kenlm, an
+            arpa file gets compiled once into a directory next to it.
         unigrams: list of known word unigrams
         alpha: weight for language model during shallow fusion
         beta: weight for length score adjustment of during scoring
         unk_score_offset: amount of log score offset for unknown tokens
         lm_score_boundary: whether to have kenlm respect boundaries when scoring
+        engine: beam search implementation, `reference` or `soa`
+        lm_cache_bytes: memory budget of the language model score cache shared across
+            utterances, 0 disables the cache
 
     Returns:
         instance of BeamSearchDecoderCTC
     """
+    alphabet = Alphabet.build_alphabet(labels)
+    if kenlm_model_path is not None and (
+        NgramModel.is_compiled_dir(kenlm_model_path)
+        or (kenlm_model_path.endswith(".arpa") and not _KENLM_AVAILABLE)
+    ):
+        # compiled n-gram model, the arpa file is compiled next to it on first use
+        if unigrams is not None:
+            verify_alphabet_coverage(alphabet, unigrams)
+        compiled_dir = kenlm_model_path
+        if not NgramModel.is_compiled_dir(compiled_dir):
+            compiled_dir = os.path.splitext(kenlm_model_path)[0] + COMPILED_LM_SUFFIX
+        language_model: Optional[AbstractLanguageModel] = NgramLanguageModel.from_arpa(
+            kenlm_model_path,
+            compiled_dir,
+            unigrams,
+            alpha=alpha,
+            beta=beta,
+            unk_score_offset=unk_score_offset,
+            score_boundary=lm_score_boundary,
+        )
+        return BeamSearchDecoderCTC(
+            alphabet, language_model, engine=engine, lm_cache_bytes=lm_cache_bytes
+        )
     kenlm_model = None if kenlm_model_path is None else kenlm.Model(kenlm_model_path)
     if kenlm_model_path is not None and kenlm_model_path.endswith(".arpa"):
         logger.info("Using arpa instead of binary LM file, decoder instantiation might be slow.")
@@ -1082,11 +3532,10 @@ def build_ctcdecoder(
                 "Unigrams not provided and cannot be automatically determined from LM file (only "
                 "arpa format). Decoding accuracy might be reduced."
             )
-    alphabet = Alphabet.build_alphabet(labels)
     if unigrams is not None:
         verify_alphabet_coverage(alphabet, unigrams)
     if kenlm_model is not None:
-        language_model: Optional[AbstractLanguageModel] = LanguageModel(
+        language_model = DawgLanguageModel(
             kenlm_model,
             unigrams,
             alpha=alpha,
@@ -1096,4 +3545,6 @@ def build_ctcdecoder(
         )
     else:
         language_model = None
-    return BeamSearchDecoderCTC(alphabet, language_model)
+    return BeamSearchDecoderCTC(
+        alphabet, language_model, engine=engine, lm_cache_bytes=lm_cache_bytes
+    )
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.context import BaseContext
+import queue
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from myDecoder import BeamSearchDecoderCTC, OutputBeam, split_padded_batch
+
+
+logger = logging.getLogger(__name__)
+
+# decoder methods that can be run by the workers
+_DECODE_METHODS = ("decode", "decode_beams")
+
+# task: job id, decode method, ring buffer slot (or None), number of frames, logits if not in the
+# ring buffer, decode kwargs
+_Task = Tuple[int, str, Optional[int], int, Optional[NDArray[np.float32]], Dict[str, Any]]
+# result: job id, ring buffer slot (or None), decoded output, formatted traceback on failure
+_Result = Tuple[int, Optional[int], Any, Optional[str]]
+
+
+def _run_worker(
+    decoder_factory: Callable[[], BeamSearchDecoderCTC],
+    shm_name: str,
+    buffer_shape: Tuple[int, int, int],
+    task_queue: "mp.Queue[Optional[_Task]]",
+    result_queue: "mp.Queue[_Result]",
+) -> None:
+    """Worker loop, the decoder and its language model are loaded once per process."""
+    decoder = decoder_factory()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring_buffer: NDArray[np.float32] = np.ndarray(buffer_shape, dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            job_id, method, slot, n_frames, logits, decode_kwargs = task
+            try:
+                if slot is not None:
+                    logits = ring_buffer[slot, :n_frames]
+                if method == "decode":
+                    output: Any = decoder.decode(logits, **decode_kwargs)
+                else:
+                    output = [
+                        beam.get_mp_safe_beam()
+                        for beam in decoder.decode_beams(logits, **decode_kwargs)
+                    ]
+                result_queue.put((job_id, slot, output, None))
+            except Exception:  # pylint: disable=broad-except
+                result_queue.put((job_id, slot, None, traceback.format_exc()))
+            finally:
+                # drop the view on the shared buffer before the slot gets reused
+                logits = None
+    finally:
+        del ring_buffer
+        shm.close()
+
+
+class DecoderService:
+    def __init__(
+        self,
+        decoder_factory: Callable[[], BeamSearchDecoderCTC],
+        vocab_size: int,
+        num_workers: int = 4,
+        max_frames: int = 1500,
+        n_slots: Optional[int] = None,
+        mp_context: Optional[Union[str, BaseContext]] = None,
+    ) -> None:
+        """Persistent pool of decoder worker processes fed through a shared-memory ring buffer.
+
+        Each worker builds its decoder once with decoder_factory, so the language model and
+        unigrams are loaded a single time per process instead of per batch. Logit matrices are
+        written into a slot of a shared-memory ring buffer and decoded by the workers in place;
+        only the slot index goes through the task queue and only the decoded output comes back.
+        The factory is pickled, so this works with both fork and spawn start methods, e.g. with
+        `functools.partial(build_ctcdecoder, labels, kenlm_model_path=...)` or
+        `functools.partial(BeamSearchDecoderCTC.load_from_dir, path)`.
+
+        Args:
+            decoder_factory: picklable callable returning the decoder used by each worker
+            vocab_size: number of logit columns, i.e. the size of the decoder alphabet
+            num_workers: number of decoder worker processes
+            max_frames: number of frames per ring buffer slot, longer inputs are sent via the queue
+            n_slots: number of ring buffer slots, defaults to twice the number of workers
+            mp_context: multiprocessing context or start method, defaults to the platform default
+        """
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be at least 1. Got {num_workers}.")
+        if isinstance(mp_context, str) or mp_context is None:
+            mp_context = mp.get_context(mp_context)
+        n_slots = n_slots or 2 * num_workers
+        self._buffer_shape = (n_slots, max_frames, vocab_size)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(self._buffer_shape)) * np.dtype(np.float32).itemsize
+        )
+        self._ring_buffer: NDArray[np.float32] = np.ndarray(
+            self._buffer_shape, dtype=np.float32, buffer=self._shm.buf
+        )
+        self._free_slots = list(range(n_slots))
+        self._task_queue: "mp.Queue[Optional[_Task]]" = mp_context.Queue()  # type: ignore
+        self._result_queue: "mp.Queue[_Result]" = mp_context.Queue()  # type: ignore
+        # decoded output and formatted traceback on failure of collected jobs, by job id
+        self._pending_results: Dict[int, Tuple[Any, Optional[str]]] = {}
+        self._next_job_id = 0
+        self._workers = [
+            mp_context.Process(  # type: ignore [attr-defined]
+                target=_run_worker,
+                args=(
+                    decoder_factory,
+                    self._shm.name,
+                    self._buffer_shape,
+                    self._task_queue,
+                    self._result_queue,
+                ),
+                daemon=True,
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def num_workers(self) -> int:
+        """Number of decoder worker processes."""
+        return len(self._workers)
+
+    def __enter__(self) -> "DecoderService":
+        """Enter."""
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Exit."""
+        self.close()
+
+    def _collect_result(self, timeout: float = 1.0) -> None:
+        """Wait for one result and release its ring buffer slot."""
+        while True:
+            try:
+                job_id, slot, output, error = self._result_queue.get(timeout=timeout)
+                break
+            except queue.Empty:
+                dead_workers = [worker for worker in self._workers if not worker.is_alive()]
+                if dead_workers:
+                    raise RuntimeError(
+                        f"{len(dead_workers)} decoder worker(s) exited unexpectedly "
+                        f"(exit codes {[worker.exitcode for worker in dead_workers]})."
+                    )
+        if slot is not None:
+            self._free_slots.append(slot)
+        self._pending_results[job_id] = (output, error)
+
+    def submit(self, logits: NDArray[Any], method: str = "decode", **decode_kwargs: Any) -> int:
+        """Queue a logit matrix for decoding and return its job id.
+
+        Args:
+            logits: logit matrix of token log probabilities
+            method: decoder method to run, `decode` (text) or `decode_beams` (mp-safe beams)
+            decode_kwargs: keyword arguments passed on to the decoder method
+
+        Returns:
+            job id to pass to `result`
+        """
+        if method not in _DECODE_METHODS:
+            raise ValueError(f"method must be one of {_DECODE_METHODS}. Got {method}.")
+        n_frames, vocab_size = logits.shape
+        if vocab_size != self._buffer_shape[2]:
+            raise ValueError(
+                f"Input logits have {vocab_size} columns, but the service expects "
+                f"{self._buffer_shape[2]}."
+            )
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        if n_frames > self._buffer_shape[1]:
+            logger.debug("Logits with %s frames do not fit a ring buffer slot.", n_frames)
+            task: _Task = (job_id, method, None, n_frames, np.asarray(logits), decode_kwargs)
+        else:
+            while not self._free_slots:
+                self._collect_result()
+            slot = self._free_slots.pop()
+            self._ring_buffer[slot, :n_frames] = logits
+            task = (job_id, method, slot, n_frames, None, decode_kwargs)
+        self._task_queue.put(task)
+        return job_id
+
+    def result(self, job_id: int) -> Any:
+        """Wait for and return the decoded output of a submitted job.
+
+        Raises:
+            RuntimeError: if decoding the job failed in the worker, with the worker traceback
+        """
+        while job_id not in self._pending_results:
+            self._collect_result()
+        output, error = self._pending_results.pop(job_id)
+        if error is not None:
+            raise RuntimeError(f"Decoding failed in worker process:\n{error}")
+        return output
+
+    def _get_batch_results(self, job_ids: List[int]) -> List[Any]:
+        """Wait for all jobs of a batch, so a failed job leaves no results of the others behind."""
+        for job_id in job_ids:
+            while job_id not in self._pending_results:
+                self._collect_result()
+        results = [self._pending_results.pop(job_id) for job_id in job_ids]
+        for _, error in results:
+            if error is not None:
+                raise RuntimeError(f"Decoding failed in worker process:\n{error}")
+        return [output for output, _ in results]
+
+    def decode_batch(self, logits_list: Sequence[NDArray[Any]], **decode_kwargs: Any) -> List[str]:
+        """Decode a batch of logit matrices to texts, see `BeamSearchDecoderCTC.decode`."""
+        job_ids = [self.submit(logits, "decode", **decode_kwargs) for logits in logits_list]
+        return self._get_batch_results(job_ids)
+
+    def decode_padded_batch(
+        self, logits: Any, relative_lens: Any, **decode_kwargs: Any
+    ) -> List[str]:
+        """Decode the valid frames of a padded logit batch, see `decode_padded_batch`."""
+        return self.decode_batch(split_padded_batch(logits, relative_lens), **decode_kwargs)
+
+    def decode_beams_batch(
+        self, logits_list: Sequence[NDArray[Any]], **decode_kwargs: Any
+    ) -> List[List[OutputBeam]]:
+        """Decode a batch of logit matrices to mp-safe beams, see `decode_beams`."""
+        job_ids = [self.submit(logits, "decode_beams", **decode_kwargs) for logits in logits_list]
+        return self._get_batch_results(job_ids)
+
+    def close(self) -> None:
+        """Stop the workers and free the shared memory."""
+        if self._shm is None:
+            return
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        del self._ring_buffer
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None  # type: ignore [assignment]
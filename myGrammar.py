@@ -0,0 +1,435 @@
+"""Grammar and word list constraints for the beam search decoder.
+
+A grammar is compiled into a deterministic character automaton over texts of words separated by
+single spaces. `TokenAutomaton` lifts it to the tokens of an `Alphabet`: the decoder looks up
+the state each candidate token leads to from the state of a beam and only expands the tokens
+the grammar allows, so the search never considers texts outside of it.
+
+Grammars are written in a small JSGF-like syntax:
+
+    turn (on | off) the [kitchen | bedroom] lights
+    set a timer for <digit>+ minutes
+
+Words are separated by whitespace, `a | b` are alternatives, `( ... )` groups, `[ ... ]` is
+optional, `*` and `+` repeat the preceding item zero or more and one or more times, and
+`<name>` refers to the rule called name. Rules cannot refer to themselves, directly or not,
+repetitions cover what recursion would be used for in such small grammars.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from myAlphabet import (
+    BPE_TOKEN,
+    TOKEN_BLANK,
+    TOKEN_NEVER_EMIT,
+    TOKEN_SPACE,
+    TOKEN_WORD_START,
+    Alphabet,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# rule references, operators, words and any other single character, which is an error
+_GRAMMAR_TOKEN_PTN = re.compile(r"<[^<>\s]+>|[()\[\]|*+]|[^\s()\[\]|*+<>]+|\S")
+_GRAMMAR_OPERATORS = ("(", ")", "[", "]", "|", "*", "+", "<", ">")
+
+# start and end state of a part of a word automaton under construction
+Fragment = Tuple[int, int]
+
+
+class _WordNfa:
+    """Nondeterministic automaton over words, built fragment by fragment from a grammar."""
+
+    def __init__(self) -> None:
+        """Init."""
+        self.edges: List[List[Tuple[Optional[str], int]]] = []
+
+    def add_state(self) -> int:
+        """Add a state without edges."""
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def add_edge(self, source: int, word: Optional[str], target: int) -> None:
+        """Add an edge, an epsilon edge if word is None."""
+        self.edges[source].append((word, target))
+
+    def add_word(self, word: str, start: int, end: int) -> None:
+        """Add an edge accepting a single word."""
+        if len(word) == 0 or len(word.split()) != 1:
+            raise ValueError(f"Grammar words must be non-empty without whitespace. Got {word!r}.")
+        self.add_edge(start, word, end)
+
+    def skip_epsilon_chain(self, state: int, end: int) -> int:
+        """Follow the states whose only edge is an epsilon edge.
+
+        Such a state adds nothing to a subset besides itself, so word targets are replaced by the
+        end of their chain, which lets the words of alternatives share one closure. The end state
+        is kept since it makes a subset final.
+        """
+        seen = set()
+        while state != end and state not in seen:
+            edges = self.edges[state]
+            if len(edges) != 1 or edges[0][0] is not None:
+                break
+            seen.add(state)
+            state = edges[0][1]
+        return state
+
+    def get_closure(self, states: Iterable[int]) -> FrozenSet[int]:
+        """Get the states reachable from states by epsilon edges."""
+        closure = set(states)
+        stack = list(closure)
+        while stack:
+            for word, target in self.edges[stack.pop()]:
+                if word is None and target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+
+
+def _compile_expression(
+    nfa: _WordNfa, expression: str, rules: Mapping[str, str], rule_stack: Tuple[str, ...] = ()
+) -> Fragment:
+    """Add the fragment of a grammar expression to a word automaton by recursive descent."""
+    tokens = _GRAMMAR_TOKEN_PTN.findall(expression)
+    pos = 0
+
+    def peek() -> Optional[str]:
+        return tokens[pos] if pos < len(tokens) else None
+
+    def parse_alternatives() -> Fragment:
+        nonlocal pos
+        start, end = nfa.add_state(), nfa.add_state()
+        while True:
+            sequence_start, sequence_end = parse_sequence()
+            nfa.add_edge(start, None, sequence_start)
+            nfa.add_edge(sequence_end, None, end)
+            if peek() != "|":
+                return start, end
+            pos += 1
+
+    def parse_sequence() -> Fragment:
+        start = end = nfa.add_state()
+        while peek() not in (None, "|", ")", "]"):
+            item_start, item_end = parse_item()
+            nfa.add_edge(end, None, item_start)
+            end = item_end
+        return start, end
+
+    def parse_item() -> Fragment:
+        nonlocal pos
+        item_start, item_end = parse_atom()
+        while peek() in ("*", "+"):
+            # a loop back repeats the item, a bypass edge makes it optional
+            start, end = nfa.add_state(), nfa.add_state()
+            nfa.add_edge(start, None, item_start)
+            nfa.add_edge(item_end, None, end)
+            nfa.add_edge(item_end, None, item_start)
+            if tokens[pos] == "*":
+                nfa.add_edge(start, None, end)
+            pos += 1
+            item_start, item_end = start, end
+        return item_start, item_end
+
+    def parse_atom() -> Fragment:
+        nonlocal pos
+        token = peek()
+        if token is None or (token in _GRAMMAR_OPERATORS and token not in ("(", "[")):
+            raise ValueError(f"Unexpected {token!r} at token {pos} of grammar {expression!r}.")
+        pos += 1
+        if token in ("(", "["):
+            start, end = parse_alternatives()
+            closing = ")" if token == "(" else "]"
+            if peek() != closing:
+                raise ValueError(f"Missing {closing!r} in grammar {expression!r}.")
+            pos += 1
+            if token == "[":
+                nfa.add_edge(start, None, end)
+            return start, end
+        if token[0] == "<":
+            name = token[1:-1]
+            if name not in rules:
+                raise ValueError(f"Unknown rule <{name}> in grammar {expression!r}.")
+            if name in rule_stack:
+                raise ValueError(
+                    f"Rule <{name}> refers to itself through {' > '.join(rule_stack)}, "
+                    "use * or + for repetitions instead."
+                )
+            return _compile_expression(nfa, rules[name], rules, rule_stack + (name,))
+        start, end = nfa.add_state(), nfa.add_state()
+        nfa.add_word(token, start, end)
+        return start, end
+
+    fragment = parse_alternatives()
+    if pos < len(tokens):
+        raise ValueError(f"Unexpected {tokens[pos]!r} at token {pos} of grammar {expression!r}.")
+    return fragment
+
+
+def _get_token_text(label: str, token_class: int) -> str:
+    """Get the text a token appends to a beam text, a space stands for a word boundary."""
+    if token_class == TOKEN_SPACE:
+        return " "
+    if token_class == TOKEN_WORD_START:
+        text = " " + label[1:]
+        # tokens bounded on both sides like ▁⁇▁ do not break the next word under a grammar
+        if text[-1:] == BPE_TOKEN:
+            text = text[:-1]
+        return text
+    return label
+
+
+class Grammar:
+    def __init__(self, transitions: List[Dict[str, int]], finals: List[bool]) -> None:
+        """Deterministic character automaton of the texts a decoder is allowed to output.
+
+        Texts are words separated by single spaces. A space right after a space or at the start
+        leaves the state unchanged, like repeated word boundaries leave the text of a beam
+        unchanged. State 0 is the start state. Use `parse`, `from_words` or `from_phrases` to
+        build a grammar.
+
+        Args:
+            transitions: state each character leads to from each state
+            finals: whether each state ends an accepted text
+        """
+        self._transitions = transitions
+        self._finals = finals
+        self._token_automata: Dict[Tuple[str, ...], TokenAutomaton] = {}
+
+    @property
+    def start(self) -> int:
+        """Start state."""
+        return 0
+
+    @property
+    def n_states(self) -> int:
+        """Number of states."""
+        return len(self._transitions)
+
+    @property
+    def chars(self) -> FrozenSet[str]:
+        """Characters of the words of the grammar."""
+        return frozenset(char for edges in self._transitions for char in edges if char != " ")
+
+    @classmethod
+    def parse(cls, expression: str, rules: Optional[Mapping[str, str]] = None) -> "Grammar":
+        """Compile a grammar, see the module docstring for the syntax.
+
+        Args:
+            expression: grammar of the whole text
+            rules: expressions of the rules the grammar refers to as <name>
+
+        Returns:
+            compiled grammar
+        """
+        nfa = _WordNfa()
+        start, end = _compile_expression(nfa, expression, rules or {})
+        return cls._from_nfa(nfa, start, end)
+
+    @classmethod
+    def from_words(cls, words: Iterable[str]) -> "Grammar":
+        """Get the grammar of any non-empty sequence of words from a word list."""
+        nfa = _WordNfa()
+        start, end = nfa.add_state(), nfa.add_state()
+        for word in dict.fromkeys(words):
+            nfa.add_word(word, start, end)
+        nfa.add_edge(end, None, start)
+        return cls._from_nfa(nfa, start, end)
+
+    @classmethod
+    def from_phrases(cls, phrases: Iterable[str]) -> "Grammar":
+        """Get the grammar of exactly one of a list of phrases."""
+        nfa = _WordNfa()
+        start, end = nfa.add_state(), nfa.add_state()
+        for phrase in phrases:
+            phrase_end = start
+            for word in phrase.split():
+                word_end = nfa.add_state()
+                nfa.add_word(word, phrase_end, word_end)
+                phrase_end = word_end
+            nfa.add_edge(phrase_end, None, end)
+        return cls._from_nfa(nfa, start, end)
+
+    @classmethod
+    def _from_nfa(cls, nfa: _WordNfa, start: int, end: int) -> "Grammar":
+        """Determinize a word automaton and spell its words out into a character automaton."""
+        # subset construction over words, a subset is identified by its states with word edges
+        # and whether it is final, states with epsilon edges only make no difference
+        has_words = [any(word is not None for word, _ in edges) for edges in nfa.edges]
+        subset_ids: Dict[Tuple[FrozenSet[int], bool], int] = {}
+        target_ids: Dict[FrozenSet[int], int] = {}
+        subsets: List[FrozenSet[int]] = []
+        word_finals: List[bool] = []
+
+        def get_subset_id(targets: FrozenSet[int]) -> int:
+            subset_id = target_ids.get(targets)
+            if subset_id is None:
+                closure = nfa.get_closure(targets)
+                key = (frozenset(state for state in closure if has_words[state]), end in closure)
+                subset_id = subset_ids.get(key)
+                if subset_id is None:
+                    subset_id = subset_ids[key] = len(subsets)
+                    subsets.append(key[0])
+                    word_finals.append(key[1])
+                target_ids[targets] = subset_id
+            return subset_id
+
+        get_subset_id(frozenset([start]))
+        word_edges: List[Dict[str, int]] = []
+        for subset in subsets:
+            targets: Dict[str, List[int]] = {}
+            for state in subset:
+                for word, target in nfa.edges[state]:
+                    if word is not None:
+                        targets.setdefault(word, []).append(target)
+            word_edges.append(
+                {
+                    word: get_subset_id(
+                        frozenset(nfa.skip_epsilon_chain(target, end) for target in word_targets)
+                    )
+                    for word, word_targets in targets.items()
+                }
+            )
+
+        # character state n < len(word_edges) is the start of a word after word state n, the
+        # words leaving it are spelled out in a character trie, which is shared by word states
+        # with the same outgoing words
+        transitions: List[Dict[str, int]] = [{" ": n} for n in range(len(word_edges))]
+        finals = list(word_finals)
+        trie_roots: Dict[FrozenSet[Tuple[str, int]], int] = {}
+        for word_state, edges in enumerate(word_edges):
+            edges_key = frozenset(edges.items())
+            trie_root = trie_roots.setdefault(edges_key, word_state)
+            if trie_root != word_state:
+                transitions[word_state].update(
+                    (char, state) for char, state in transitions[trie_root].items() if char != " "
+                )
+                continue
+            for word, target in edges.items():
+                state = word_state
+                for char in word:
+                    next_state = transitions[state].get(char)
+                    if next_state is None:
+                        next_state = len(transitions)
+                        transitions[state][char] = next_state
+                        transitions.append({})
+                        finals.append(False)
+                    state = next_state
+                # the word ends here, a word boundary moves on to the next word state
+                transitions[state][" "] = target
+                finals[state] = word_finals[target]
+        return cls(transitions, finals)
+
+    def advance(self, state: int, text: str) -> int:
+        """Get the state after a text from a state, -1 if the grammar does not allow it."""
+        transitions = self._transitions
+        for char in text:
+            if state < 0:
+                break
+            state = transitions[state].get(char, -1)
+        return state
+
+    def is_final(self, state: int) -> bool:
+        """Whether the text that led to a state is accepted."""
+        return state >= 0 and self._finals[state]
+
+    def accepts(self, text: str) -> bool:
+        """Whether a text is accepted, words may be separated by any whitespace."""
+        return self.is_final(self.advance(self.start, " ".join(text.split())))
+
+    def get_token_automaton(self, alphabet: Alphabet) -> "TokenAutomaton":
+        """Get the automaton of the grammar over the tokens of an alphabet, built once per alphabet.
+
+        Args:
+            alphabet: alphabet of the decoder
+
+        Returns:
+            token automaton sharing the states of the grammar
+        """
+        labels = tuple(alphabet.labels)
+        token_automaton = self._token_automata.get(labels)
+        if token_automaton is None:
+            if not alphabet.is_bpe:
+                missing_chars = self.chars - set(labels)
+                if missing_chars:
+                    logger.warning(
+                        "Grammar characters %s are not in the alphabet, texts with them cannot "
+                        "be decoded.",
+                        "".join(sorted(missing_chars)),
+                    )
+            token_automaton = TokenAutomaton(self, list(labels), alphabet.token_classes)
+            self._token_automata[labels] = token_automaton
+        return token_automaton
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Get the state to pickle, token automata are rebuilt lazily by the receiving process."""
+        state = self.__dict__.copy()
+        state["_token_automata"] = {}
+        return state
+
+
+class TokenAutomaton:
+    def __init__(self, grammar: Grammar, labels: List[str], token_classes: List[int]) -> None:
+        """Transitions of a grammar on the tokens of an alphabet, filled in lazily per state.
+
+        The state a token leads to is the state after the text it appends, see
+        `_get_token_text`. Blank tokens keep the state, tokens that are never emitted are not
+        allowed anywhere. A row of the transition table is computed the first time a state is
+        looked up, so large grammars over large BPE vocabularies only hold rows for the states
+        the search reaches.
+
+        Args:
+            grammar: grammar to constrain the decoding with
+            labels: normalized alphabet labels, index aligned with the logit columns
+            token_classes: token class of each label, see `Alphabet.token_classes`
+        """
+        self.grammar = grammar
+        self._texts = [
+            _get_token_text(label, token_class) for label, token_class in zip(labels, token_classes)
+        ]
+        self._is_blank = [token_class == TOKEN_BLANK for token_class in token_classes]
+        self._is_never_emit = [token_class == TOKEN_NEVER_EMIT for token_class in token_classes]
+        self._row_ids = np.full(grammar.n_states, -1, dtype=np.int64)
+        self._table = np.full((16, len(labels)), -1, dtype=np.int64)
+        self._n_rows = 0
+
+    def _add_row(self, state: int) -> None:
+        """Compute the transitions of a state on all tokens."""
+        if self._n_rows == len(self._table):
+            self._table = np.concatenate([self._table, np.full_like(self._table, -1)])
+        self._table[self._n_rows] = [
+            state if is_blank else -1 if is_never_emit else self.grammar.advance(state, text)
+            for text, is_blank, is_never_emit in zip(
+                self._texts, self._is_blank, self._is_never_emit
+            )
+        ]
+        self._row_ids[state] = self._n_rows
+        self._n_rows += 1
+
+    def next_states(
+        self, states: NDArray[np.int64], tokens: NDArray[np.int64]
+    ) -> NDArray[np.int64]:
+        """Get the state each token leads to from each state, -1 where it is not allowed.
+
+        Args:
+            states: grammar states, all of them valid
+            tokens: token indices, broadcast against states
+
+        Returns:
+            array of the broadcast shape of states and tokens
+        """
+        row_ids = self._row_ids[states]
+        missing = row_ids < 0
+        if missing.any():
+            for state in np.unique(np.broadcast_to(states, missing.shape)[missing]):
+                self._add_row(int(state))
+            row_ids = self._row_ids[states]
+        return self._table[row_ids, tokens]
@@ -0,0 +1,1367 @@
+from __future__ import annotations, division
+
+import abc
+from collections import OrderedDict
+import copy
+import dataclasses
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from numpy.typing import NDArray
+
+from pyctcdecode.constants import (
+    AVG_TOKEN_LEN,
+    DEFAULT_ALPHA,
+    DEFAULT_BETA,
+    DEFAULT_SCORE_LM_BOUNDARY,
+    DEFAULT_UNK_LOGP_OFFSET,
+    LOG_BASE_CHANGE_FACTOR,
+)
+from pyctcdecode.language_model import (
+    AbstractLanguageModel,
+    AbstractLMState,
+    LanguageModel,
+    _prepare_unigram_set,
+)
+
+if TYPE_CHECKING:
+    import kenlm  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
+BOS_TOKEN = "<s>"
+EOS_TOKEN = "</s>"
+UNK_TOKEN = "<unk>"
+
+# number of bits of the quantized log probabilities and backoffs, 0 stores them as float32
+DEFAULT_QUANTIZE_BITS = 16
+
+# smaller batches are scored query by query, vectorized lookups only pay off above this size
+MIN_VECTORIZED_BATCH_SIZE = 16
+
+# compiled model files
+_META_FILENAME = "ngram_meta.json"
+_VOCABULARY_NAME = "vocab"
+_UNIGRAMS_NAME = "unigrams"
+_FORMAT_VERSION = 1
+# directory suffix of arpa files compiled on first use
+COMPILED_LM_SUFFIX = ".ngram"
+
+
+class BatchLanguageModel(AbstractLanguageModel):
+    """Language model that can score the words of many beams in a single call.
+
+    The decoder collects all beams that complete a word in a frame and passes the distinct
+    (state, word) pairs to `score_batch` at once instead of calling `score` per beam, which avoids
+    a round trip into the language model per beam. Language models without this interface are
+    scored per (state, word) pair with `score`.
+    """
+
+    @abc.abstractmethod
+    def score_batch(
+        self, queries: Sequence[Tuple[AbstractLMState, str]], is_last_word: bool = False
+    ) -> List[Tuple[float, AbstractLMState]]:
+        """Score words conditional on their start states, same as calling `score` on each.
+
+        Args:
+            queries: pairs of the language model state to score from and the word to score
+            is_last_word: whether the words end the sentence
+
+        Returns:
+            score and end state for each query
+        """
+        raise NotImplementedError()
+
+
+class SortedVocabulary:
+    def __init__(self, data: NDArray[np.uint8], offsets: NDArray[np.int64]) -> None:
+        """Sorted list of words stored as one utf-8 byte array, suitable for memory-mapping.
+
+        Word ids are positions in the sorted order. Lookups are binary searches over the byte
+        array and get memoized, so no dictionary of the full vocabulary is built at load time.
+        Since the words are sorted, whether any word starts with a prefix is a binary search too.
+
+        Args:
+            data: concatenated utf-8 encoded words in sorted order
+            offsets: start of each word in data, followed by the total length
+        """
+        # plain views of memory-mapped arrays, item access on np.memmap is slow
+        self._data = np.asarray(data)
+        self._offsets = np.asarray(offsets)
+        self._buffer = memoryview(self._data)
+        self._word_ids: Dict[str, int] = {}
+        self._prefixes: Dict[str, bool] = {}
+
+    @classmethod
+    def from_words(cls, words: Iterable[str]) -> "SortedVocabulary":
+        """Build a vocabulary from words, duplicates are removed."""
+        # sorting by code point is the same as sorting by utf-8 bytes
+        encoded_words = [word.encode("utf-8") for word in sorted(set(words))]
+        offsets = np.zeros(len(encoded_words) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded_words], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded_words), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Get the state for pickling, memoryviews cannot be pickled."""
+        return {"data": self._data, "offsets": self._offsets}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restore from a pickled state."""
+        self.__init__(state["data"], state["offsets"])  # type: ignore [misc]
+
+    def __len__(self) -> int:
+        """Get the number of words."""
+        return len(self._offsets) - 1
+
+    def _get_bytes(self, word_id: int) -> bytes:
+        """Get the utf-8 encoding of a word."""
+        return bytes(self._buffer[self._offsets[word_id] : self._offsets[word_id + 1]])
+
+    def __getitem__(self, word_id: int) -> str:
+        """Get the word with the given id."""
+        return self._get_bytes(word_id).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the words in sorted order."""
+        return (self[word_id] for word_id in range(len(self)))
+
+    def __contains__(self, word: str) -> bool:
+        """Check if a word is in the vocabulary."""
+        return self.index(word) >= 0
+
+    def _lower_bound(self, key: bytes) -> int:
+        """Get the position of the first word that is not smaller than key."""
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self._get_bytes(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def index(self, word: str) -> int:
+        """Get the id of a word, -1 if it is not in the vocabulary."""
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            key = word.encode("utf-8")
+            word_id = self._lower_bound(key)
+            if word_id == len(self) or self._get_bytes(word_id) != key:
+                word_id = -1
+            self._word_ids[word] = word_id
+        return word_id
+
+    def has_prefix(self, prefix: str) -> bool:
+        """Check if any word starts with prefix."""
+        has_prefix = self._prefixes.get(prefix)
+        if has_prefix is None:
+            key = prefix.encode("utf-8")
+            word_id = self._lower_bound(key)
+            has_prefix = word_id < len(self) and self._get_bytes(word_id).startswith(key)
+            self._prefixes[prefix] = has_prefix
+        return has_prefix
+
+    def save(self, filepath: str, name: str) -> None:
+        """Save the vocabulary arrays to a directory."""
+        np.save(os.path.join(filepath, f"{name}_data.npy"), self._data)
+        np.save(os.path.join(filepath, f"{name}_offsets.npy"), self._offsets)
+
+    @classmethod
+    def load(cls, filepath: str, name: str, mmap: bool = True) -> "SortedVocabulary":
+        """Load vocabulary arrays saved with `save`, memory-mapped by default."""
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(filepath, f"{name}_data.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(filepath, f"{name}_offsets.npy"), mmap_mode=mmap_mode),
+        )
+
+
+class UnigramDawg:
+    _ARRAY_NAMES = ("offsets", "labels", "targets", "finals")
+
+    def __init__(
+        self,
+        offsets: NDArray[np.int64],
+        labels: NDArray[np.uint8],
+        targets: NDArray[np.int32],
+        finals: NDArray[np.uint8],
+    ) -> None:
+        """Immutable set of words stored as a minimal acyclic automaton (DAWG) in flat arrays.
+
+        Words are paths of utf-8 bytes from the root, the last node, to a final node. Words
+        sharing a suffix share its nodes, which makes the arrays much smaller than a set of
+        strings plus a character trie. The edges of node n are labels[offsets[n] : offsets[n + 1]]
+        in ascending order with their target nodes in targets. Lookups walk the arrays without
+        building any Python objects per word, so memory-mapped arrays are shared by all processes
+        that load them, only the labels are copied into a bytes object for fast edge search.
+
+        Args:
+            offsets: start of the edges of each node, followed by the total number of edges
+            labels: byte label of each edge
+            targets: node each edge leads to
+            finals: whether a word ends at each node
+        """
+        # plain views of memory-mapped arrays, item access on np.memmap is slow
+        self._offsets = np.asarray(offsets)
+        self._labels = np.asarray(labels)
+        self._targets = np.asarray(targets)
+        self._finals = np.asarray(finals)
+        self._offsets_view = memoryview(self._offsets)
+        # edge lookups are byte searches, which bytes.find does in C, the labels are the
+        # smallest array with one byte per edge
+        self._label_bytes = self._labels.tobytes()
+        self._targets_view = memoryview(self._targets)
+        self._finals_view = memoryview(self._finals)
+        self._root = len(self._finals) - 1
+        self._n_words: Optional[int] = None
+
+    @classmethod
+    def from_words(cls, words: Iterable[str]) -> "UnigramDawg":
+        """Build the minimal automaton of words, duplicates are removed."""
+        # nodes are frozen once all words through them are added, children before parents,
+        # and a frozen node equal to an earlier one is replaced by it
+        register: Dict[Tuple[bool, Tuple[Tuple[int, int], ...]], int] = {}
+        offsets = [0]
+        labels: List[int] = []
+        targets: List[int] = []
+        finals: List[bool] = []
+
+        def add_node(is_final: bool, edges: List[Tuple[int, int]]) -> int:
+            finals.append(is_final)
+            for label, target in edges:
+                labels.append(label)
+                targets.append(target)
+            offsets.append(len(labels))
+            return len(finals) - 1
+
+        def freeze(is_final: bool, edges: List[Tuple[int, int]]) -> int:
+            key = (is_final, tuple(edges))
+            node = register.get(key)
+            if node is None:
+                node = add_node(is_final, edges)
+                register[key] = node
+            return node
+
+        # unfrozen nodes along the previous word: whether a word ends there and their edges
+        path_finals = [False]
+        path_edges: List[List[Tuple[int, int]]] = [[]]
+        previous = b""
+
+        def freeze_path(depth: int) -> None:
+            while len(path_finals) > depth + 1:
+                node = freeze(path_finals.pop(), path_edges.pop())
+                path_edges[-1].append((previous[len(path_finals) - 1], node))
+
+        for word in sorted({word.encode("utf-8") for word in words}):
+            n_common = 0
+            max_common = min(len(word), len(previous))
+            while n_common < max_common and word[n_common] == previous[n_common]:
+                n_common += 1
+            freeze_path(n_common)
+            for _ in word[n_common:]:
+                path_finals.append(False)
+                path_edges.append([])
+            path_finals[-1] = True
+            previous = word
+        freeze_path(0)
+        # the root is always the last node
+        add_node(path_finals[0], path_edges[0])
+        return cls(
+            np.array(offsets, dtype=np.int64),
+            np.array(labels, dtype=np.uint8),
+            np.array(targets, dtype=np.int32),
+            np.array(finals, dtype=np.uint8),
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Get the state for pickling, memoryviews cannot be pickled."""
+        return {name: getattr(self, f"_{name}") for name in self._ARRAY_NAMES}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restore from a pickled state."""
+        self.__init__(**state)  # type: ignore [misc]
+
+    @property
+    def n_nodes(self) -> int:
+        """Number of nodes of the automaton."""
+        return len(self._finals)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the arrays in bytes."""
+        return sum(getattr(self, f"_{name}").nbytes for name in self._ARRAY_NAMES)
+
+    def __len__(self) -> int:
+        """Get the number of words, counted once over the automaton."""
+        if self._n_words is None:
+            # children come before their parents, so their counts are known
+            counts = self._finals.astype(np.int64)
+            offsets = self._offsets.tolist()
+            targets = self._targets.tolist()
+            for node in range(self.n_nodes):
+                for target in targets[offsets[node] : offsets[node + 1]]:
+                    counts[node] += counts[target]
+            self._n_words = int(counts[self._root])
+        return self._n_words
+
+    def _walk(self, key: bytes) -> int:
+        """Get the node reached by the bytes of key from the root, -1 if there is none."""
+        offsets = self._offsets_view
+        label_bytes = self._label_bytes
+        node = self._root
+        for byte in key:
+            idx = label_bytes.find(byte, offsets[node], offsets[node + 1])
+            if idx < 0:
+                return -1
+            node = self._targets_view[idx]
+        return node
+
+    def __contains__(self, word: object) -> bool:
+        """Check if a word is in the set."""
+        if not isinstance(word, str):
+            return False
+        node = self._walk(word.encode("utf-8"))
+        return node >= 0 and bool(self._finals_view[node])
+
+    def has_prefix(self, prefix: str) -> bool:
+        """Check if any word starts with prefix."""
+        return self._walk(prefix.encode("utf-8")) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the words in sorted order."""
+        offsets = self._offsets.tolist()
+        labels = self._labels.tolist()
+        targets = self._targets.tolist()
+        stack = [(self._root, b"")]
+        while stack:
+            node, prefix = stack.pop()
+            if self._finals_view[node]:
+                yield prefix.decode("utf-8")
+            for idx in range(offsets[node + 1] - 1, offsets[node] - 1, -1):
+                stack.append((targets[idx], prefix + bytes((labels[idx],))))
+
+    def get_hash(self) -> str:
+        """Get the sha256 hash of the arrays, equal for equal word sets."""
+        content_hash = hashlib.sha256()
+        for name in self._ARRAY_NAMES:
+            content_hash.update(getattr(self, f"_{name}").tobytes())
+        return content_hash.hexdigest()
+
+    @staticmethod
+    def is_saved(filepath: str, name: str) -> bool:
+        """Check if a directory holds a saved automaton."""
+        return os.path.isfile(os.path.join(filepath, f"{name}_dawg_offsets.npy"))
+
+    def save(self, filepath: str, name: str) -> None:
+        """Save the arrays to a directory."""
+        for array_name in self._ARRAY_NAMES:
+            np.save(
+                os.path.join(filepath, f"{name}_dawg_{array_name}.npy"),
+                getattr(self, f"_{array_name}"),
+            )
+
+    @classmethod
+    def load(cls, filepath: str, name: str, mmap: bool = True) -> "UnigramDawg":
+        """Load arrays saved with `save`, memory-mapped by default."""
+        mmap_mode = "r" if mmap else None
+        return cls(
+            **{
+                array_name: np.load(
+                    os.path.join(filepath, f"{name}_dawg_{array_name}.npy"), mmap_mode=mmap_mode
+                )
+                for array_name in cls._ARRAY_NAMES
+            }
+        )
+
+
+def _quantize(values: NDArray[np.float32], bits: int) -> Tuple[NDArray[Any], NDArray[np.float32]]:
+    """Quantize values to codes into a codebook of at most 2 ** bits values.
+
+    Values are kept exactly if there are few enough distinct ones, otherwise the codebook holds
+    the centers of equal-count bins so that the quantization error is small where values are dense.
+    """
+    dtype = np.uint8 if bits <= 8 else np.uint16
+    n_bins = 2**bits
+    codebook = np.unique(values).astype(np.float32)
+    if len(codebook) > n_bins:
+        # np.quantile partitions once per quantile, indexing the sorted values is much faster
+        sorted_values = np.sort(values)
+        positions = ((np.arange(n_bins) + 0.5) * len(values) / n_bins).astype(np.int64)
+        codebook = np.unique(sorted_values[positions])
+    # nearest codebook entry
+    boundaries = (codebook[1:] + codebook[:-1]) / 2
+    codes = np.searchsorted(boundaries, values).astype(dtype)
+    return codes, codebook
+
+
+def _read_arpa(arpa_path: str) -> Tuple[List[int], List[List[Tuple[List[str], float, float]]]]:
+    """Read the n-gram counts and entries (words, log10 prob, log10 backoff) of an arpa file."""
+    counts: List[int] = []
+    ngrams: List[List[Tuple[List[str], float, float]]] = []
+    order = 0
+    with open(arpa_path, encoding="utf-8") as fi:
+        for line in fi:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if line.startswith("ngram ") and order == 0:
+                counts.append(int(line.split("=")[1]))
+            elif line.startswith("\\") and line.endswith("-grams:"):
+                order = int(line[1:].split("-")[0])
+                ngrams.append([])
+            elif line == "\\end\\":
+                break
+            elif order > 0:
+                fields = line.split()
+                words = fields[1 : order + 1]
+                backoff = float(fields[order + 1]) if len(fields) > order + 1 else 0.0
+                ngrams[order - 1].append((words, float(fields[0]), backoff))
+    if len(ngrams) == 0 or len(ngrams[0]) == 0:
+        raise ValueError("No unigrams found in arpa file. Something is wrong with the file.")
+    for n, (count, entries) in enumerate(zip(counts, ngrams), start=1):
+        if count != len(entries):
+            logger.warning("Arpa header lists %s %s-grams, found %s.", count, n, len(entries))
+    return counts, ngrams
+
+
+def compile_arpa(
+    arpa_path: str,
+    output_dir: str,
+    unigrams: Optional[Collection[str]] = None,
+    quantize_bits: int = DEFAULT_QUANTIZE_BITS,
+) -> "NgramModel":
+    """Compile an arpa n-gram model into sorted, quantized numpy arrays that can be memory-mapped.
+
+    The vocabulary is sorted and word ids are positions in it. Unigram entries are indexed by word
+    id. N-grams of higher order are stored in sorted arrays of packed uint64 keys
+    `prefix_index * vocab_size + word_id`, where prefix_index is the position of the (n-1)-gram
+    prefix in the array of the order below, so an n-gram lookup is one binary search per order.
+    Log probabilities and backoffs are quantized per order.
+
+    Args:
+        arpa_path: path to the arpa file
+        output_dir: directory to write the compiled model to, created if needed
+        unigrams: known words used for oov scoring and partial word scoring, defaults to the
+            vocabulary of the arpa file without sentence boundary and unknown tokens
+        quantize_bits: bits of the quantized log probabilities and backoffs, 0 to keep float32
+
+    Returns:
+        memory-mapped compiled model
+    """
+    _, ngrams = _read_arpa(arpa_path)
+    if not any(words[0] == UNK_TOKEN for words, _, _ in ngrams[0]):
+        # same default as KenLM for models estimated without an unknown word
+        ngrams[0].append(([UNK_TOKEN], -100.0, 0.0))
+    vocabulary = SortedVocabulary.from_words(words[0] for words, _, _ in ngrams[0])
+    vocab_size = len(vocabulary)
+    word_ids = {word: word_id for word_id, word in enumerate(vocabulary)}
+    if unigrams is None:
+        unigrams = [word for word in word_ids if word not in (BOS_TOKEN, EOS_TOKEN, UNK_TOKEN)]
+    else:
+        n_unigrams = len(unigrams)
+        unigrams = [word for word in unigrams if word in word_ids]
+        if len(unigrams) < n_unigrams:
+            logger.warning(
+                "Only %s of the %s unigrams are in the language model vocabulary.",
+                len(unigrams),
+                n_unigrams,
+            )
+    os.makedirs(output_dir, exist_ok=True)
+    vocabulary.save(output_dir, _VOCABULARY_NAME)
+    SortedVocabulary.from_words(unigrams).save(output_dir, _UNIGRAMS_NAME)
+
+    # sorted keys of the tables of order 2 and up
+    table_keys: Dict[int, NDArray[np.uint64]] = {}
+    for n, entries in enumerate(ngrams, start=1):
+        ids = np.array([[word_ids[word] for word in words] for words, _, _ in entries], np.uint64)
+        logprobs = np.array([logprob for _, logprob, _ in entries], dtype=np.float32)
+        backoffs = np.array([backoff for _, _, backoff in entries], dtype=np.float32)
+        if n == 1:
+            # unigrams are indexed by word id
+            sort_order = np.argsort(ids[:, 0])
+        else:
+            n_prefixes = vocab_size if n == 2 else len(table_keys[n - 1])
+            if n_prefixes * vocab_size >= 2**64:
+                raise ValueError(f"Too many {n - 1}-grams to pack {n}-gram keys into 64 bits.")
+            # position of the prefix of each n-gram in the table of the order below
+            prefix_idxs = ids[:, 0]
+            for m in range(2, n):
+                prefix_keys = prefix_idxs * np.uint64(vocab_size) + ids[:, m - 1]
+                keys = table_keys[m]
+                prefix_idxs = np.searchsorted(keys, prefix_keys).astype(np.uint64)
+                if np.any(keys[np.minimum(prefix_idxs, len(keys) - 1)] != prefix_keys):
+                    raise ValueError(f"Found {n}-grams whose prefix is missing in the arpa file.")
+            keys = prefix_idxs * np.uint64(vocab_size) + ids[:, n - 1]
+            sort_order = np.argsort(keys)
+            table_keys[n] = keys[sort_order]
+            np.save(os.path.join(output_dir, f"{n}gram_keys.npy"), table_keys[n])
+        for name, values in (("logprobs", logprobs), ("backoffs", backoffs)):
+            values = values[sort_order]
+            if name == "backoffs" and n == len(ngrams):
+                continue
+            if quantize_bits > 0:
+                codes, codebook = _quantize(values, quantize_bits)
+                np.save(os.path.join(output_dir, f"{n}gram_{name}.npy"), codes)
+                np.save(os.path.join(output_dir, f"{n}gram_{name}_codebook.npy"), codebook)
+            else:
+                np.save(os.path.join(output_dir, f"{n}gram_{name}.npy"), values)
+
+    meta = {
+        "format_version": _FORMAT_VERSION,
+        "order": len(ngrams),
+        "counts": [len(entries) for entries in ngrams],
+        "vocab_size": vocab_size,
+        "quantize_bits": quantize_bits,
+    }
+    with open(os.path.join(output_dir, _META_FILENAME), "w") as fi:
+        json.dump(meta, fi)
+    logger.info("Compiled %s into %s.", arpa_path, output_dir)
+    return NgramModel(output_dir)
+
+
+class _NgramTable:
+    def __init__(self, filepath: str, n: int, has_backoffs: bool, mmap: bool) -> None:
+        """Arrays of the n-grams of one order."""
+        mmap_mode = "r" if mmap else None
+
+        def load(name: str) -> NDArray[Any]:
+            # plain view of the memory-mapped array, item access on np.memmap is slow
+            path = os.path.join(filepath, f"{n}gram_{name}.npy")
+            return np.asarray(np.load(path, mmap_mode=mmap_mode))
+
+        self.keys: Optional[NDArray[np.uint64]] = None if n == 1 else load("keys")
+        self.logprobs = self._dequantize(filepath, n, "logprobs", load)
+        self.backoffs = self._dequantize(filepath, n, "backoffs", load) if has_backoffs else None
+
+    @staticmethod
+    def _dequantize(filepath: str, n: int, name: str, load: Any) -> NDArray[np.float32]:
+        """Load values, looking up quantized codes in their codebook."""
+        values = load(name)
+        if os.path.exists(os.path.join(filepath, f"{n}gram_{name}_codebook.npy")):
+            # the codes stay memory-mapped, only the small codebook is read into memory
+            return _QuantizedArray(values, np.asarray(load(f"{name}_codebook")))  # type: ignore
+        return values  # type: ignore [no-any-return]
+
+
+class _QuantizedArray:
+    def __init__(self, codes: NDArray[Any], codebook: NDArray[np.float32]) -> None:
+        """Array of quantized values, dequantized on item access."""
+        self._codes = codes
+        self._codebook = codebook
+
+    def __len__(self) -> int:
+        """Get the number of values."""
+        return len(self._codes)
+
+    def __getitem__(self, idx: Any) -> Any:
+        """Get dequantized values, idx can be an integer or an index array."""
+        return self._codebook[self._codes[idx]]
+
+
+class NgramModel:
+    def __init__(self, filepath: str, mmap: bool = True) -> None:
+        """N-gram model compiled with `compile_arpa`, scored with backoff like KenLM.
+
+        All arrays are memory-mapped by default, so loading takes milliseconds and processes that
+        load the same model share its pages through the page cache.
+
+        Args:
+            filepath: directory of the compiled model
+            mmap: memory-map the arrays instead of reading them into memory
+        """
+        with open(os.path.join(filepath, _META_FILENAME), "r") as fi:
+            meta = json.load(fi)
+        if meta["format_version"] != _FORMAT_VERSION:
+            raise ValueError(
+                f"Compiled n-gram model format {meta['format_version']} is not supported, "
+                f"expected {_FORMAT_VERSION}. Recompile it with compile_arpa."
+            )
+        self.path = filepath
+        self._order: int = meta["order"]
+        self.vocabulary = SortedVocabulary.load(filepath, _VOCABULARY_NAME, mmap=mmap)
+        self.unigrams = SortedVocabulary.load(filepath, _UNIGRAMS_NAME, mmap=mmap)
+        self._vocab_size = np.uint64(meta["vocab_size"])
+        self._tables = [
+            _NgramTable(filepath, n, has_backoffs=n < self._order, mmap=mmap)
+            for n in range(1, self._order + 1)
+        ]
+        self.unk_id = self.vocabulary.index(UNK_TOKEN)
+        self.bos_id = self.vocabulary.index(BOS_TOKEN)
+        self.eos_id = self.vocabulary.index(EOS_TOKEN)
+
+    @staticmethod
+    def is_compiled_dir(filepath: str) -> bool:
+        """Check if a directory holds a compiled n-gram model."""
+        return os.path.isfile(os.path.join(filepath, _META_FILENAME))
+
+    @property
+    def order(self) -> int:
+        """Get the order of the n-gram model."""
+        return self._order
+
+    def __contains__(self, word: str) -> bool:
+        """Check if a word is in the vocabulary of the model."""
+        return word in self.vocabulary
+
+    def _find(self, n: int, prefix_idx: int, word_id: int) -> int:
+        """Get the position of an n-gram given the position of its prefix, -1 if missing."""
+        keys = self._tables[n - 1].keys
+        key = np.uint64(prefix_idx) * self._vocab_size + np.uint64(word_id)
+        idx = int(np.searchsorted(keys, key))  # type: ignore [arg-type]
+        if idx < len(keys) and keys[idx] == key:  # type: ignore [arg-type]
+            return idx
+        return -1
+
+    def base_score(self, context: Tuple[int, ...], word_id: int) -> Tuple[float, Tuple[int, ...]]:
+        """Get the log10 probability of a word after a context and the context after it.
+
+        Args:
+            context: positions of the context suffixes in the n-gram tables, shortest first, i.e.
+                the id of the last word, then the position of the last two words in the bigram
+                table and so on
+            word_id: id of the word to score, use `unk_id` for unknown words
+
+        Returns:
+            log10 probability of the word and the context ending with it
+        """
+        # positions of the n-grams ending in the word, unigrams are indexed by word id
+        ngram_idxs = [word_id]
+        for n, context_idx in enumerate(context, start=2):
+            ngram_idx = self._find(n, context_idx, word_id)
+            if ngram_idx < 0:
+                break
+            ngram_idxs.append(ngram_idx)
+        n_found = len(ngram_idxs)
+        score = float(self._tables[n_found - 1].logprobs[ngram_idxs[-1]])
+        # back off from the contexts for which no longer n-gram was found
+        for n, context_idx in enumerate(context[n_found - 1 :], start=n_found):
+            score += float(self._tables[n - 1].backoffs[context_idx])  # type: ignore [index]
+        return score, tuple(ngram_idxs[: self._order - 1])
+
+    def base_score_batch(
+        self, contexts: Sequence[Tuple[int, ...]], word_ids: Sequence[int]
+    ) -> Tuple[NDArray[np.float64], List[Tuple[int, ...]]]:
+        """Vectorized `base_score` over many contexts and words, one binary search per order.
+
+        Args:
+            contexts: context of each query, see `base_score`
+            word_ids: id of the word to score for each query
+
+        Returns:
+            log10 probability of each word and the context ending with it
+        """
+        n_queries = len(word_ids)
+        n_context = min(self._order - 1, max(map(len, contexts), default=0))
+        context_lens = np.array([len(context) for context in contexts], dtype=np.int64)
+        context_idxs = np.zeros((n_queries, n_context), dtype=np.int64)
+        for query_idx, context in enumerate(contexts):
+            context_idxs[query_idx, : len(context)] = context[:n_context]
+        # positions of the n-grams ending in each word, unigrams are indexed by word id
+        ngram_idxs = np.zeros((n_queries, n_context + 1), dtype=np.int64)
+        ngram_idxs[:, 0] = word_ids
+        word_keys = ngram_idxs[:, 0].astype(np.uint64)
+        n_found = np.ones(n_queries, dtype=np.int64)
+        # queries for which all shorter n-grams were found
+        active = np.arange(n_queries)
+        for n in range(2, n_context + 2):
+            active = active[context_lens[active] >= n - 1]
+            if len(active) == 0:
+                break
+            table_keys = self._tables[n - 1].keys
+            prefix_keys = context_idxs[active, n - 2].astype(np.uint64)
+            keys = prefix_keys * self._vocab_size + word_keys[active]
+            positions = np.searchsorted(table_keys, keys)  # type: ignore [arg-type]
+            is_found = positions < len(table_keys)  # type: ignore [arg-type]
+            is_found[is_found] = table_keys[positions[is_found]] == keys[is_found]  # type: ignore
+            active = active[is_found]
+            ngram_idxs[active, n - 1] = positions[is_found]
+            n_found[active] = n
+        scores = np.zeros(n_queries, dtype=np.float64)
+        for n in range(1, n_context + 2):
+            is_order = n_found == n
+            scores[is_order] = self._tables[n - 1].logprobs[ngram_idxs[is_order, n - 1]]
+        # back off from the contexts for which no longer n-gram was found
+        for n in range(1, n_context + 1):
+            is_backoff = (n_found <= n) & (context_lens >= n)
+            scores[is_backoff] += self._tables[n - 1].backoffs[  # type: ignore [index]
+                context_idxs[is_backoff, n - 1]
+            ]
+        n_end_context = np.minimum(n_found, self._order - 1)
+        end_contexts = [
+            tuple(ngram_idxs_row[:n_end])
+            for ngram_idxs_row, n_end in zip(ngram_idxs.tolist(), n_end_context.tolist())
+        ]
+        return scores, end_contexts
+
+
+class NgramLMState(AbstractLMState):
+    def __init__(self, context: Tuple[int, ...]) -> None:
+        """State of an NgramLanguageModel, the n-gram table positions of the context."""
+        self.context = context
+
+    def get_mp_safe_state(self) -> "NgramLMState":
+        """Get a multiprocessing-safe version of the state."""
+        return self
+
+    def __eq__(self, other: object) -> bool:
+        """Equality on the context."""
+        return isinstance(other, NgramLMState) and self.context == other.context
+
+    def __hash__(self) -> int:
+        """Hash of the context."""
+        return hash(self.context)
+
+
+class NgramLanguageModel(BatchLanguageModel):
+    # serialization constants
+    JSON_ATTRS = ("alpha", "beta", "unk_score_offset", "score_boundary")
+    _ATTRS_SERIALIZED_FILENAME = "attrs.json"
+
+    def __init__(
+        self,
+        ngram_model: NgramModel,
+        unigrams: Optional[Collection[str]] = None,
+        alpha: float = DEFAULT_ALPHA,
+        beta: float = DEFAULT_BETA,
+        unk_score_offset: float = DEFAULT_UNK_LOGP_OFFSET,
+        score_boundary: bool = DEFAULT_SCORE_LM_BOUNDARY,
+    ) -> None:
+        """Language model on a compiled, memory-mapped n-gram model, drop-in for LanguageModel.
+
+        Args:
+            ngram_model: compiled n-gram model, see `compile_arpa`
+            unigrams: list of known word unigrams, defaults to the unigrams compiled with the model
+            alpha: weight for language model during shallow fusion
+            beta: weight for length score adjustment of during scoring
+            unk_score_offset: amount of log score offset for unknown tokens
+            score_boundary: whether to have the model respect boundaries when scoring
+        """
+        self._ngram_model = ngram_model
+        if unigrams is None:
+            self._unigrams = ngram_model.unigrams
+        else:
+            self._unigrams = SortedVocabulary.from_words(
+                word for word in unigrams if word in ngram_model
+            )
+        if len(self._unigrams) == 0:
+            logger.warning("No known unigrams provided, decoding results might be a lot worse.")
+        self.alpha = alpha
+        self.beta = beta
+        self.unk_score_offset = unk_score_offset
+        self.score_boundary = score_boundary
+
+    @classmethod
+    def from_arpa(
+        cls,
+        arpa_path: str,
+        compiled_dir: str,
+        unigrams: Optional[Collection[str]] = None,
+        **kwargs: Any,
+    ) -> "NgramLanguageModel":
+        """Load a compiled model, compiling the arpa file into compiled_dir the first time."""
+        if not NgramModel.is_compiled_dir(compiled_dir):
+            compile_arpa(arpa_path, compiled_dir, unigrams=unigrams)
+            unigrams = None
+        return cls(NgramModel(compiled_dir), unigrams, **kwargs)
+
+    @classmethod
+    def from_language_model(
+        cls, language_model: LanguageModel, compiled_dir: str
+    ) -> "NgramLanguageModel":
+        """Compile the arpa file of a kenlm LanguageModel, keeping its unigrams and parameters."""
+        arpa_path = _get_kenlm_path(language_model)
+        if not arpa_path.endswith(".arpa"):
+            raise ValueError(
+                f"Only kenlm models loaded from an arpa file can be compiled. Got {arpa_path}."
+            )
+        compile_arpa(arpa_path, compiled_dir, unigrams=language_model._unigram_set)
+        json_attrs = {attr: getattr(language_model, attr) for attr in cls.JSON_ATTRS}
+        return cls(NgramModel(compiled_dir), **json_attrs)
+
+    def reset_params(self, **params: Dict[str, Any]) -> None:
+        """Reset some of the simple parameters.
+
+        The allowed parameters are [alpha, beta, unk_score_offset, score_boundary]
+
+        Args:
+            params: dict of str to anything
+        """
+        for attr, attr_type in zip(self.JSON_ATTRS, (float, float, float, bool)):
+            value = params.get(attr)
+            if value is not None:
+                if not isinstance(value, attr_type):
+                    raise ValueError(f"{attr} must be a {attr_type.__name__}. Got {type(value)}.")
+                setattr(self, attr, value)
+
+    @property
+    def order(self) -> int:
+        """Get the order of the n-gram language model."""
+        return self._ngram_model.order
+
+    def get_start_state(self) -> NgramLMState:
+        """Get initial lm state."""
+        if self.score_boundary:
+            return NgramLMState((self._ngram_model.bos_id,))
+        return NgramLMState(())
+
+    def score_partial_token(self, partial_token: str) -> float:
+        """Get partial token score."""
+        is_oov = int(not self._unigrams.has_prefix(partial_token))
+        unk_score = self.unk_score_offset * is_oov
+        # if unk token length exceeds expected length then additionally decrease score
+        if len(partial_token) > AVG_TOKEN_LEN:
+            unk_score = unk_score * len(partial_token) / AVG_TOKEN_LEN
+        return unk_score
+
+    def _get_word_id(self, word: str) -> Tuple[int, float]:
+        """Get the model word id of a word and its unknown word score offset."""
+        word_id = self._ngram_model.vocabulary.index(word)
+        is_unk = word_id < 0
+        # override UNK prob. use unigram set if we have because it's faster
+        if (len(self._unigrams) > 0 and word not in self._unigrams) or is_unk:
+            unk_score = self.unk_score_offset
+        else:
+            unk_score = 0.0
+        return self._ngram_model.unk_id if is_unk else word_id, unk_score
+
+    @staticmethod
+    def _check_state(state: AbstractLMState) -> NgramLMState:
+        """Check the type of an input state."""
+        if not isinstance(state, NgramLMState):
+            raise AssertionError(
+                f"Wrong input state type found. Expected NgramLMState, got {type(state)}"
+            )
+        return state
+
+    def score(
+        self, prev_state: AbstractLMState, word: str, is_last_word: bool = False
+    ) -> Tuple[float, NgramLMState]:
+        """Score word conditional on start state."""
+        ngram_model = self._ngram_model
+        word_id, unk_score = self._get_word_id(word)
+        lm_score, end_context = ngram_model.base_score(
+            self._check_state(prev_state).context, word_id
+        )
+        lm_score += unk_score
+        # add end of sentence context if needed
+        if is_last_word and self.score_boundary:
+            # note that we want to return the unmodified end state to keep extension capabilities
+            lm_score += ngram_model.base_score(end_context, ngram_model.eos_id)[0]
+        lm_score = self.alpha * lm_score * LOG_BASE_CHANGE_FACTOR + self.beta
+        return lm_score, NgramLMState(end_context)
+
+    def score_batch(
+        self, queries: Sequence[Tuple[AbstractLMState, str]], is_last_word: bool = False
+    ) -> List[Tuple[float, AbstractLMState]]:
+        """Score words conditional on their start states with vectorized n-gram lookups."""
+        if len(queries) < MIN_VECTORIZED_BATCH_SIZE:
+            return [self.score(state, word, is_last_word=is_last_word) for state, word in queries]
+        ngram_model = self._ngram_model
+        word_ids, unk_scores = zip(*(self._get_word_id(word) for _, word in queries))
+        lm_scores, end_contexts = ngram_model.base_score_batch(
+            [self._check_state(state).context for state, _ in queries], word_ids
+        )
+        lm_scores += unk_scores
+        if is_last_word and self.score_boundary:
+            lm_scores += ngram_model.base_score_batch(
+                end_contexts, [ngram_model.eos_id] * len(queries)
+            )[0]
+        lm_scores = self.alpha * lm_scores * LOG_BASE_CHANGE_FACTOR + self.beta
+        return [
+            (lm_score, NgramLMState(end_context))
+            for lm_score, end_context in zip(lm_scores.tolist(), end_contexts)
+        ]
+
+    @property
+    def serializable_attrs(self) -> Dict[str, Any]:
+        """Get a dictionary of the attributes to serialize to json."""
+        return {attr: getattr(self, attr) for attr in self.JSON_ATTRS}
+
+    def save_to_dir(self, filepath: str) -> None:
+        """Save to a directory, copying the compiled model files."""
+        with open(os.path.join(filepath, self._ATTRS_SERIALIZED_FILENAME), "w") as fi:
+            json.dump(self.serializable_attrs, fi)
+        if os.path.samefile(self._ngram_model.path, filepath):
+            # the model was compiled into the directory
+            return
+        for filename in os.listdir(self._ngram_model.path):
+            if filename.endswith(".npy") or filename == _META_FILENAME:
+                shutil.copy2(os.path.join(self._ngram_model.path, filename), filepath)
+        if self._unigrams is not self._ngram_model.unigrams:
+            self._unigrams.save(filepath, _UNIGRAMS_NAME)
+
+    @staticmethod
+    def is_serialized_dir(filepath: str) -> bool:
+        """Check if a directory holds a serialized NgramLanguageModel."""
+        return NgramModel.is_compiled_dir(filepath)
+
+    @classmethod
+    def load_from_dir(cls, filepath: str) -> "NgramLanguageModel":  # type: ignore [override]
+        """Load from a directory, the compiled model is memory-mapped."""
+        attrs_path = os.path.join(filepath, cls._ATTRS_SERIALIZED_FILENAME)
+        json_attrs: Dict[str, Any] = {}
+        if os.path.exists(attrs_path):
+            with open(attrs_path, "r") as fi:
+                json_attrs = json.load(fi)
+            if set(json_attrs.keys()) != set(cls.JSON_ATTRS):
+                raise ValueError(
+                    f"Expected json serialized attributes to be {cls.JSON_ATTRS} "
+                    f"but found {json_attrs.keys()}"
+                )
+        return cls(NgramModel(filepath), **json_attrs)
+
+
+def _get_kenlm_path(language_model: LanguageModel) -> str:
+    """Get the file a kenlm language model was loaded from, kenlm stores it as bytes."""
+    path = getattr(language_model._kenlm_model, "path", b"")  # pylint: disable=protected-access
+    return path.decode("utf-8") if isinstance(path, bytes) else str(path)
+
+
+class DawgLanguageModel(LanguageModel):
+    _UNIGRAMS_NAME = "unigrams"
+    _KENLM_EXTENSIONS = (".arpa", ".bin", ".binary")
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self,
+        kenlm_model: "kenlm.Model",
+        unigrams: Optional[Union[Collection[str], UnigramDawg]] = None,
+        alpha: float = DEFAULT_ALPHA,
+        beta: float = DEFAULT_BETA,
+        unk_score_offset: float = DEFAULT_UNK_LOGP_OFFSET,
+        score_boundary: bool = DEFAULT_SCORE_LM_BOUNDARY,
+    ) -> None:
+        """Kenlm language model with its unigrams in a `UnigramDawg`, drop-in for LanguageModel.
+
+        LanguageModel keeps the unigrams as a set and a character trie of Python objects, which
+        for a 200k word vocabulary takes hundreds of MB in every decoder process. The automaton
+        answers the same word and prefix queries from a few MB of arrays, which are
+        memory-mapped and shared by all processes once saved with `save_to_dir`.
+
+        Args:
+            kenlm_model: instance of kenlm n-gram language model `kenlm.Model`
+            unigrams: list of known word unigrams, or an automaton of them kept as it is
+            alpha: weight for language model during shallow fusion
+            beta: weight for length score adjustment of during scoring
+            unk_score_offset: amount of log score offset for unknown tokens
+            score_boundary: whether to have kenlm respect boundaries when scoring
+        """
+        self._kenlm_model = kenlm_model
+        if unigrams is None:
+            logger.warning("No known unigrams provided, decoding results might be a lot worse.")
+            unigrams = UnigramDawg.from_words([])
+        elif not isinstance(unigrams, UnigramDawg):
+            unigrams = UnigramDawg.from_words(_prepare_unigram_set(unigrams, kenlm_model))
+        # the automaton answers the membership queries of LanguageModel.score
+        self._unigram_set = unigrams  # type: ignore [assignment]
+        self._char_trie = None
+        self.alpha = alpha
+        self.beta = beta
+        self.unk_score_offset = unk_score_offset
+        self.score_boundary = score_boundary
+
+    @property
+    def unigrams(self) -> UnigramDawg:
+        """Automaton of the known unigrams."""
+        return self._unigram_set  # type: ignore [return-value]
+
+    def score_partial_token(self, partial_token: str) -> float:
+        """Get partial token score."""
+        is_oov = len(self.unigrams) == 0 or not self.unigrams.has_prefix(partial_token)
+        unk_score = self.unk_score_offset * int(is_oov)
+        # if unk token length exceeds expected length then additionally decrease score
+        if len(partial_token) > AVG_TOKEN_LEN:
+            unk_score = unk_score * len(partial_token) / AVG_TOKEN_LEN
+        return unk_score
+
+    def save_to_dir(self, filepath: str, unigram_encoding: Optional[str] = None) -> None:
+        """Save to a directory, the unigrams as automaton arrays instead of a text file."""
+        with open(os.path.join(filepath, self._ATTRS_SERIALIZED_FILENAME), "w") as fi:
+            json.dump(self.serializable_attrs, fi)
+        self.unigrams.save(filepath, self._UNIGRAMS_NAME)
+        kenlm_path = _get_kenlm_path(self)
+        logger.info("copying kenlm model from %s to %s.", kenlm_path, filepath)
+        shutil.copy2(kenlm_path, os.path.join(filepath, os.path.basename(kenlm_path)))
+
+    @staticmethod
+    def is_serialized_dir(filepath: str) -> bool:
+        """Check if a directory holds a serialized DawgLanguageModel."""
+        return UnigramDawg.is_saved(filepath, DawgLanguageModel._UNIGRAMS_NAME)
+
+    @classmethod
+    def load_from_dir(  # type: ignore [override]
+        cls, filepath: str, mmap: bool = True
+    ) -> "DawgLanguageModel":
+        """Load from a directory, the unigram automaton is memory-mapped by default."""
+        import kenlm  # pylint: disable=import-outside-toplevel
+
+        with open(os.path.join(filepath, cls._ATTRS_SERIALIZED_FILENAME), "r") as fi:
+            json_attrs = json.load(fi)
+        if set(json_attrs.keys()) != set(cls.JSON_ATTRS):
+            raise ValueError(
+                f"Expected json serialized attributes to be {cls.JSON_ATTRS} "
+                f"but found {json_attrs.keys()}"
+            )
+        kenlm_files = [
+            filename
+            for filename in os.listdir(filepath)
+            if os.path.splitext(filename)[1] in cls._KENLM_EXTENSIONS
+        ]
+        if len(kenlm_files) != 1:
+            raise ValueError(f"Expected one kenlm file in {filepath}. Found {kenlm_files}.")
+        unigrams = UnigramDawg.load(filepath, cls._UNIGRAMS_NAME, mmap=mmap)
+        kenlm_model = kenlm.Model(os.path.join(filepath, kenlm_files[0]))
+        return cls(kenlm_model, unigrams, **json_attrs)
+
+
+def get_content_hash(filepath: str, relpaths: Sequence[str]) -> str:
+    """Get the sha256 hash of the names and contents of files in a directory."""
+    content_hash = hashlib.sha256()
+    for relpath in relpaths:
+        content_hash.update(relpath.encode("utf-8") + b"\0")
+        with open(os.path.join(filepath, relpath), "rb") as fi:
+            for block in iter(functools.partial(fi.read, 2**20), b""):
+                content_hash.update(block)
+    return f"sha256:{content_hash.hexdigest()}"
+
+
+# model files: real path of the directory, and name, size and modification time of each file
+_FilesKey = Tuple[str, Tuple[Tuple[str, int, int], ...]]
+
+# content hashes of model files, hashed once per process
+_CONTENT_HASHES: Dict[_FilesKey, str] = {}
+
+
+def _get_files_key(filepath: str, relpaths: Sequence[str]) -> Tuple[_FilesKey, int]:
+    """Identify model files without reading them, and get their total size."""
+    stats = [os.stat(os.path.join(filepath, relpath)) for relpath in relpaths]
+    file_stats = tuple(
+        (relpath, stat.st_size, stat.st_mtime_ns) for relpath, stat in zip(relpaths, stats)
+    )
+    return (os.path.realpath(filepath), file_stats), sum(stat.st_size for stat in stats)
+
+
+def _get_files_hash(files_key: _FilesKey) -> Optional[str]:
+    """Get the content hash of model files, None if they changed since they were identified."""
+    content_hash = _CONTENT_HASHES.get(files_key)
+    if content_hash is None:
+        filepath, file_stats = files_key
+        relpaths = [relpath for relpath, _, _ in file_stats]
+        try:
+            if _get_files_key(filepath, relpaths)[0] != files_key:
+                return None
+        except OSError:
+            return None
+        content_hash = get_content_hash(filepath, relpaths)
+        _CONTENT_HASHES[files_key] = content_hash
+    return content_hash
+
+
+def _get_words_hash(words: Iterable[str]) -> str:
+    """Get the sha256 hash of a set of words."""
+    return hashlib.sha256("\n".join(sorted(words)).encode("utf-8")).hexdigest()
+
+
+@dataclasses.dataclass
+class _RegistryEntry:
+    """Language model shared by the decoders that registered an identical one."""
+
+    signature: Tuple[Any, ...]
+    language_model: Optional[AbstractLanguageModel]  # None while evicted
+    loader: Optional[Callable[[], AbstractLanguageModel]]  # None for models that stay loaded
+    files_key: Optional[_FilesKey]  # model files, shared by models differing in params
+    size_bytes: int
+    n_refs: int = 0
+    score_cache: Any = None
+
+
+def _reload_ngram_language_model(
+    filepath: str, unigrams: Optional[SortedVocabulary], json_attrs: Dict[str, Any]
+) -> NgramLanguageModel:
+    """Load a compiled n-gram language model again after it was evicted."""
+    language_model = NgramLanguageModel(NgramModel(filepath), **json_attrs)
+    if unigrams is not None:
+        language_model._unigrams = unigrams  # pylint: disable=protected-access
+    return language_model
+
+
+def _reload_kenlm_language_model(
+    cls: type, filepath: str, unigrams: Collection[str], json_attrs: Dict[str, Any]
+) -> LanguageModel:
+    """Load a kenlm language model again after it was evicted."""
+    import kenlm  # pylint: disable=import-outside-toplevel
+
+    language_model: LanguageModel = cls(kenlm.Model(filepath), unigrams or None, **json_attrs)
+    return language_model
+
+
+class LanguageModelRegistry:
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        """Process-level store of the language models of all decoders.
+
+        Decoders hold a handle instead of the model, so forked worker processes find the model in
+        their copy of the registry and it is never pickled. Models loaded from the same files
+        with the same unigrams and parameters are stored once. Model files are identified by path,
+        size and modification time, and only read to compare their contents when files of another
+        path have the same names and sizes. The size of a model is the size of its files, which is
+        roughly what it occupies once loaded, and each set of files is counted once however many
+        models use it. When the resident size exceeds max_bytes, the least recently used models
+        are evicted and loaded again from their files the next time a decoder asks for them, so
+        decoders stay valid. Models without files, e.g. custom `AbstractLanguageModel`
+        implementations, are never deduplicated or evicted.
+
+        Args:
+            max_bytes: memory budget of the loaded models in bytes, None for no limit
+        """
+        self._max_bytes = max_bytes
+        self._handles: Dict[bytes, Optional[_RegistryEntry]] = {}
+        # least recently used first
+        self._entries: "OrderedDict[Tuple[Any, ...], _RegistryEntry]" = OrderedDict()
+        # registered model files, mapped to the first registered ones with the same contents
+        self._files_keys: Dict[_FilesKey, _FilesKey] = {}
+        self.loads = 0
+        self.evictions = 0
+        self.dedup_hits = 0
+
+    def __len__(self) -> int:
+        """Get the number of distinct models."""
+        return len(self._entries)
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        """Memory budget of the loaded models in bytes, None for no limit."""
+        return self._max_bytes
+
+    def set_max_bytes(self, max_bytes: Optional[int]) -> None:
+        """Set the memory budget, evicting models right away if it is exceeded."""
+        self._max_bytes = max_bytes
+        self._evict()
+
+    @property
+    def resident_bytes(self) -> int:
+        """Size of the files of the loaded models, files shared by several models count once."""
+        sizes = {
+            entry.files_key or id(entry): entry.size_bytes
+            for entry in self._entries.values()
+            if entry.language_model is not None
+        }
+        return sum(sizes.values())
+
+    def _resolve_files_key(self, files_key: _FilesKey) -> _FilesKey:
+        """Get the key of the first registered model files with the same contents.
+
+        Only files of another path or modification time with the same names and sizes can have
+        the same contents, so only then are both read and hashed.
+        """
+        resolved_key = self._files_keys.get(files_key)
+        if resolved_key is None:
+            resolved_key = files_key
+            sizes = [(relpath, size) for relpath, size, _ in files_key[1]]
+            for other_key, other_resolved_key in self._files_keys.items():
+                if [(relpath, size) for relpath, size, _ in other_key[1]] != sizes:
+                    continue
+                other_hash = _get_files_hash(other_key)
+                if other_hash is not None and other_hash == _get_files_hash(files_key):
+                    resolved_key = other_resolved_key
+                    break
+            self._files_keys[files_key] = resolved_key
+        return resolved_key
+
+    def _new_entry(self, language_model: AbstractLanguageModel, handle: bytes) -> _RegistryEntry:
+        """Describe a model by its files, unigrams and parameters, so identical ones match."""
+        # pylint: disable=protected-access,unidiomatic-typecheck
+        loader: Callable[[], AbstractLanguageModel]
+        if isinstance(language_model, NgramLanguageModel):
+            filepath = language_model._ngram_model.path
+            relpaths = sorted(
+                filename
+                for filename in os.listdir(filepath)
+                if filename.endswith(".npy") or filename == _META_FILENAME
+            )
+            files_key, size_bytes = _get_files_key(filepath, relpaths)
+            unigrams: Optional[SortedVocabulary] = language_model._unigrams
+            if unigrams is language_model._ngram_model.unigrams:
+                unigrams_hash = None
+                unigrams = None
+            else:
+                unigrams_hash = _get_words_hash(unigrams)  # type: ignore [arg-type]
+            json_attrs = language_model.serializable_attrs
+            loader = functools.partial(_reload_ngram_language_model, filepath, unigrams, json_attrs)
+        elif type(language_model) in (LanguageModel, DawgLanguageModel) and os.path.isfile(
+            _get_kenlm_path(language_model)  # type: ignore [arg-type]
+        ):
+            # only these exact classes, subclasses may hold state the loader would not restore
+            filepath = _get_kenlm_path(language_model)  # type: ignore [arg-type]
+            dirname, basename = os.path.split(filepath)
+            files_key, size_bytes = _get_files_key(dirname, [basename])
+            unigram_set = language_model._unigram_set
+            if isinstance(unigram_set, UnigramDawg):
+                unigrams_hash = unigram_set.get_hash()
+            else:
+                unigrams_hash = _get_words_hash(unigram_set)
+            json_attrs = {attr: getattr(language_model, attr) for attr in LanguageModel.JSON_ATTRS}
+            loader = functools.partial(
+                _reload_kenlm_language_model,
+                type(language_model),
+                filepath,
+                unigram_set,
+                json_attrs,
+            )
+        else:
+            # unique signature, the model is neither shared nor evicted
+            return _RegistryEntry(("pinned", handle), language_model, None, None, 0)
+        files_key = self._resolve_files_key(files_key)
+        signature = (
+            type(language_model).__name__,
+            files_key,
+            unigrams_hash,
+            tuple(sorted(json_attrs.items())),
+        )
+        return _RegistryEntry(signature, language_model, loader, files_key, size_bytes)
+
+    def register(self, language_model: Optional[AbstractLanguageModel]) -> bytes:
+        """Store a model, sharing an identical one if it is already stored.
+
+        Args:
+            language_model: model to store, None for decoders without a language model
+
+        Returns:
+            handle to get the model with, to be released with `release`
+        """
+        handle = os.urandom(16)
+        self._add(handle, language_model)
+        return handle
+
+    def _add(self, handle: bytes, language_model: Optional[AbstractLanguageModel]) -> None:
+        """Store a model under a handle."""
+        if language_model is None:
+            self._handles[handle] = None
+            return
+        new_entry = self._new_entry(language_model, handle)
+        entry = self._entries.get(new_entry.signature)
+        if entry is None:
+            entry = new_entry
+            self._entries[entry.signature] = entry
+        else:
+            self.dedup_hits += 1
+            if entry.language_model is None:
+                # the registered model saves loading the evicted one again
+                entry.language_model = language_model
+            self._entries.move_to_end(entry.signature)
+        entry.n_refs += 1
+        self._handles[handle] = entry
+        self._evict(keep=entry)
+
+    def get(self, handle: bytes) -> Optional[AbstractLanguageModel]:
+        """Get the model of a handle, loading it again if it was evicted."""
+        entry = self._handles[handle]
+        if entry is None:
+            return None
+        self._entries.move_to_end(entry.signature)
+        language_model = entry.language_model
+        if language_model is None:
+            language_model = entry.loader()  # type: ignore [misc]
+            entry.language_model = language_model
+            self.loads += 1
+            self._evict(keep=entry)
+        return language_model
+
+    def get_score_cache(self, handle: bytes, factory: Callable[[], Any]) -> Any:
+        """Get the score cache shared by the decoders of a model, created with factory."""
+        entry = self._handles[handle]
+        if entry is None:
+            return None
+        if entry.score_cache is None:
+            entry.score_cache = factory()
+        return entry.score_cache
+
+    def reset_params(self, handle: bytes, **params: Any) -> None:
+        """Reset parameters of the model of a handle.
+
+        A model shared with other handles is copied first, the copy shares the loaded model
+        files and only differs in the parameters. The handle moves to a stored model with the
+        same parameters if there is one, otherwise to a new one.
+        """
+        language_model = self.get(handle)
+        if language_model is None:
+            return
+        entry = self._handles[handle]
+        if entry is not None and entry.n_refs > 1:
+            language_model = copy.copy(language_model)
+        language_model.reset_params(**params)
+        self.release(handle)
+        self._add(handle, language_model)
+
+    def release(self, handle: bytes) -> None:
+        """Release a handle, its model is dropped once no handle uses it."""
+        entry = self._handles.pop(handle, None)
+        if entry is None:
+            return
+        entry.n_refs -= 1
+        if entry.n_refs == 0:
+            del self._entries[entry.signature]
+
+    def _evict(self, keep: Optional[_RegistryEntry] = None) -> None:
+        """Evict the least recently used models until the loaded ones fit into the budget.
+
+        Models sharing files are evicted together, since the files stay loaded while any of
+        them is. The files of keep, the model that was just asked for, are never evicted.
+        """
+        if self._max_bytes is None:
+            return
+        keep_key = None if keep is None else keep.files_key
+        while self.resident_bytes > self._max_bytes:
+            files_key = next(
+                (
+                    entry.files_key
+                    for entry in self._entries.values()
+                    if entry.language_model is not None
+                    and entry.loader is not None
+                    and entry.files_key != keep_key
+                ),
+                None,
+            )
+            if files_key is None:
+                break
+            for entry in self._entries.values():
+                if entry.files_key == files_key and entry.language_model is not None:
+                    entry.language_model = None
+                    entry.score_cache = None
+                    self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all models, handles released afterwards are ignored."""
+        self._handles.clear()
+        self._entries.clear()
+        self._files_keys.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the number of stored and loaded models, their size and the registry counters."""
+        return {
+            "models": len(self._entries),
+            "loaded": sum(entry.language_model is not None for entry in self._entries.values()),
+            "resident_bytes": self.resident_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "dedup_hits": self.dedup_hits,
+        }
@@ -0,0 +1,198 @@
+"""Long-form transcription of recordings far longer than the utterances the model was trained on.
+
+The waveform is cut into overlapping windows that are encoded one at a time. The CTC posteriors
+of consecutive windows are stitched at frame level: each window contributes its frames up to the
+middle of the overlap with the next window, so every frame comes from the window in which it has
+the most context on both sides. The stitched frames are fed to a `DecodeSession`, which commits
+the words all beams agree on as it goes. Only one window of audio and posteriors and the live
+beams are held at a time, so peak memory does not grow with the length of the recording.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import logging
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from myDecoder import BeamSearchDecoderCTC, DecodeSession
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 16000
+# frame shift of the wav2vec2 / HuBERT encoders in seconds
+DEFAULT_FRAME_SHIFT_S = 0.02
+# window length, matches the avoid_if_longer_than training cap
+DEFAULT_WINDOW_S = 10.0
+# overlap of consecutive windows, each side of a cut gets half of it as context
+DEFAULT_OVERLAP_S = 2.0
+
+# encoder: waveform window of shape (n_samples,) to log-posteriors of shape (n_frames, n_labels)
+EncodeFn = Callable[[NDArray[np.float32]], NDArray[np.float32]]
+
+
+@dataclasses.dataclass(frozen=True)
+class LongFormResult:
+    """Transcript of a long recording with its timing."""
+
+    text: str
+    words: List[Tuple[str, float, float]]  # word, start and end time in seconds
+    audio_seconds: float
+    seconds: float  # wall time of the whole transcription
+    encoder_seconds: float
+    decoder_seconds: float
+    n_windows: int
+
+    @property
+    def rtf(self) -> float:
+        """Real-time factor, wall time per second of audio."""
+        return self.seconds / max(self.audio_seconds, 1e-9)
+
+
+def iter_windows(
+    blocks: Iterable[NDArray[np.float32]], window_samples: int, hop_samples: int
+) -> Iterator[Tuple[int, NDArray[np.float32], bool]]:
+    """Cut a stream of waveform blocks into overlapping windows.
+
+    Args:
+        blocks: consecutive blocks of samples of any length, e.g. read from a file one by one
+        window_samples: number of samples of a window
+        hop_samples: number of samples between the starts of consecutive windows
+
+    Returns:
+        iterator of the start sample of each window, its samples and whether it is the last one
+    """
+    if not 0 < hop_samples <= window_samples:
+        raise ValueError(
+            f"hop_samples must be in (0, window_samples]. Got {hop_samples} and {window_samples}."
+        )
+    buffer = np.zeros(0, dtype=np.float32)
+    start = 0
+    for block in blocks:
+        buffer = np.concatenate([buffer, np.asarray(block, dtype=np.float32)])
+        # a window is only known not to be the last one once samples after it have arrived
+        while len(buffer) > window_samples:
+            yield start, buffer[:window_samples], False
+            buffer = buffer[hop_samples:]
+            start += hop_samples
+    if len(buffer) > 0:
+        yield start, buffer, True
+
+
+class FrameStitcher:
+    def __init__(self, hop_frames: int, overlap_frames: int) -> None:
+        """Stitch the posteriors of overlapping windows into one stream of frames.
+
+        Each window contributes the frames up to the middle of its overlap with the next window,
+        starting where the previous window stopped. Frames are placed by the start sample of
+        their window, so encoders that drop a frame at the window edges do not shift the stream.
+
+        Args:
+            hop_frames: number of frames between the starts of consecutive windows
+            overlap_frames: number of frames consecutive windows share
+        """
+        self._hop_frames = hop_frames
+        self._cut_frames = hop_frames + overlap_frames // 2
+        self._n_windows = 0
+        self.n_frames = 0  # number of frames emitted so far
+
+    def push(self, logits: NDArray[np.float32], is_last: bool) -> NDArray[np.float32]:
+        """Get the new frames of the next window.
+
+        Args:
+            logits: posteriors of the window, shape (n_frames, n_labels)
+            is_last: whether it is the last window, which contributes all its remaining frames
+
+        Returns:
+            frames of the window that follow the frames emitted so far
+        """
+        start_frame = self._n_windows * self._hop_frames
+        self._n_windows += 1
+        end_frame = start_frame + len(logits)
+        if not is_last:
+            end_frame = min(end_frame, start_frame + self._cut_frames)
+        new_frames = logits[max(self.n_frames - start_frame, 0) : end_frame - start_frame]
+        self.n_frames += len(new_frames)
+        return new_frames
+
+
+def transcribe_long_form(
+    decoder: BeamSearchDecoderCTC,
+    encode_fn: EncodeFn,
+    blocks: Iterable[NDArray[np.float32]],
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    window_s: float = DEFAULT_WINDOW_S,
+    overlap_s: float = DEFAULT_OVERLAP_S,
+    frame_shift_s: float = DEFAULT_FRAME_SHIFT_S,
+    on_update: Optional[Callable[[str], None]] = None,
+    **session_kwargs: Any,
+) -> LongFormResult:
+    """Transcribe a recording of any length with windowed encoding and incremental decoding.
+
+    Args:
+        decoder: decoder to use
+        encode_fn: encoder of one waveform window to log-posteriors, see `EncodeFn`
+        blocks: consecutive blocks of samples of the recording, a whole waveform array can be
+            passed as `[waveform]`, reading the file block by block keeps memory bounded
+        sample_rate: sample rate of the waveform
+        window_s: window length in seconds
+        overlap_s: overlap of consecutive windows in seconds
+        frame_shift_s: frame shift of the encoder in seconds
+        on_update: called with the committed text so far after every window
+        session_kwargs: keyword arguments of `DecodeSession`, e.g. beam_width or is_log_probs
+
+    Returns:
+        transcript, word times and the real-time factor
+    """
+    start_time = time.perf_counter()
+    # windows start on frame boundaries so that their frames line up
+    frame_samples = int(round(frame_shift_s * sample_rate))
+    hop_frames = int(round((window_s - overlap_s) / frame_shift_s))
+    overlap_frames = int(round(overlap_s / frame_shift_s))
+    if hop_frames <= 0 or overlap_frames < 0:
+        raise ValueError(
+            f"overlap_s must be in [0, window_s). Got {overlap_s} and window_s={window_s}."
+        )
+    session = DecodeSession(decoder, **session_kwargs)
+    stitcher = FrameStitcher(hop_frames, overlap_frames)
+    encoder_seconds = 0.0
+    decoder_seconds = 0.0
+    n_samples = 0
+    n_windows = 0
+    for start, window, is_last in iter_windows(
+        blocks, (hop_frames + overlap_frames) * frame_samples, hop_frames * frame_samples
+    ):
+        n_samples = start + len(window)
+        n_windows += 1
+        encode_start = time.perf_counter()
+        logits = encode_fn(window)
+        encoder_seconds += time.perf_counter() - encode_start
+        new_frames = stitcher.push(logits, is_last)
+        if len(new_frames) > 0:
+            decoder_seconds += session.push(new_frames).latency_ms / 1000.0
+        if on_update is not None:
+            on_update(session.committed_text)
+    finish_start = time.perf_counter()
+    beams = session.finish() if stitcher.n_frames > 0 else []
+    decoder_seconds += time.perf_counter() - finish_start
+    if len(beams) == 0:
+        text, words = "", []
+    else:
+        text = beams[0].text
+        words = [
+            (word, start_frame * frame_shift_s, end_frame * frame_shift_s)
+            for word, (start_frame, end_frame) in beams[0].text_frames
+        ]
+    return LongFormResult(
+        text=text,
+        words=words,
+        audio_seconds=n_samples / sample_rate,
+        seconds=time.perf_counter() - start_time,
+        encoder_seconds=encoder_seconds,
+        decoder_seconds=decoder_seconds,
+        n_windows=n_windows,
+    )
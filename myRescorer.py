@@ -0,0 +1,261 @@
+"""N-best rescoring for fast sweeps of the language model weights alpha and beta.
+
+The decoder ranks hypotheses by acoustic score + alpha * lm score + beta * number of words.
+Decoding once with a wide beam and keeping the three terms of every N-best hypothesis apart
+turns a grid search over alpha and beta into array arithmetic: all grid points are rescored
+at once and their word error rates follow from the precomputed word errors per hypothesis.
+Only the utterances whose top hypothesis changes need to be decoded again with the chosen
+weights, since the beam search itself is steered by them.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+from multiprocessing.pool import Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from myDecoder import BeamSearchDecoderCTC
+from pyctcdecode.constants import DEFAULT_BEAM_WIDTH
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_BEST = 32
+
+
+def word_edit_distance(reference: str, hypothesis: str) -> int:
+    """Word-level edit distance between a reference and a hypothesis transcript."""
+    ref_words = reference.split()
+    hyp_words = hypothesis.split()
+    distances = list(range(len(hyp_words) + 1))
+    for n, ref_word in enumerate(ref_words, start=1):
+        previous, distances[0] = distances[0], n
+        for m, hyp_word in enumerate(hyp_words, start=1):
+            previous, distances[m] = distances[m], min(
+                distances[m] + 1, distances[m - 1] + 1, previous + (ref_word != hyp_word)
+            )
+    return distances[-1]
+
+
+@dataclasses.dataclass
+class GridSearchResult:
+    """Word error rates of an alpha/beta grid and its best point."""
+
+    alphas: NDArray[np.float64]
+    betas: NDArray[np.float64]
+    wers: NDArray[np.float64]  # shape (n_alphas, n_betas)
+    alpha: float  # alpha of the lowest word error rate
+    beta: float  # beta of the lowest word error rate
+    wer: float  # lowest word error rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a json serializable dictionary."""
+        return {
+            "alphas": self.alphas.tolist(),
+            "betas": self.betas.tolist(),
+            "wers": self.wers.tolist(),
+            "alpha": self.alpha,
+            "beta": self.beta,
+            "wer": self.wer,
+        }
+
+
+class NBestList:
+    def __init__(
+        self,
+        texts: Sequence[Sequence[str]],
+        acoustic_scores: NDArray[np.float64],
+        lm_scores: NDArray[np.float64],
+        word_counts: NDArray[np.float64],
+    ) -> None:
+        """N-best hypotheses of a set of utterances with their separate score terms.
+
+        The score arrays have shape (n_utterances, n_best), utterances with fewer hypotheses
+        are padded with an acoustic score of -inf, so padding never ranks first.
+
+        Args:
+            texts: hypothesis texts of each utterance, best first at decoding time
+            acoustic_scores: logit scores of the hypotheses
+            lm_scores: unweighted language model scores of the hypotheses
+            word_counts: numbers of words of the hypotheses
+        """
+        if not acoustic_scores.shape == lm_scores.shape == word_counts.shape:
+            raise ValueError(
+                f"Score arrays must have the same shape. Got {acoustic_scores.shape}, "
+                f"{lm_scores.shape} and {word_counts.shape}."
+            )
+        if len(texts) != len(acoustic_scores):
+            raise ValueError(
+                f"Got {len(texts)} utterances of texts but {len(acoustic_scores)} of scores."
+            )
+        self.texts = [list(utterance_texts) for utterance_texts in texts]
+        self.acoustic_scores = acoustic_scores
+        self.lm_scores = lm_scores
+        self.word_counts = word_counts
+
+    def __len__(self) -> int:
+        """Number of utterances."""
+        return len(self.texts)
+
+    @classmethod
+    def from_decoder(
+        cls,
+        decoder: BeamSearchDecoderCTC,
+        logits_list: Sequence[NDArray[Any]],
+        n_best: int = DEFAULT_N_BEST,
+        beam_width: int = DEFAULT_BEAM_WIDTH,
+        pool: Optional[Pool] = None,
+        **decode_kwargs: Any,
+    ) -> "NBestList":
+        """Decode once and keep the score terms of the n_best top hypotheses of each utterance.
+
+        Args:
+            decoder: decoder with the language model, its alpha and beta steer the beam search
+            logits_list: logit matrices of the utterances
+            n_best: maximum number of hypotheses kept per utterance
+            beam_width: beam width of the decoding, a wide beam gives more diverse N-best lists
+            pool: multiprocessing pool for parallel decoding, see `decode_beams_batch`
+            decode_kwargs: further keyword arguments passed on to `decode_beams_batch`
+
+        Returns:
+            N-best list of the utterances
+        """
+        if beam_width < n_best:
+            logger.warning("beam_width %s limits the N-best lists to fewer hypotheses.", beam_width)
+        beams_list = decoder.decode_beams_batch(
+            pool, logits_list, beam_width=beam_width, **decode_kwargs
+        )
+        texts = [[beam.text for beam in beams[:n_best]] for beams in beams_list]
+        shape = (len(texts), max(map(len, texts), default=0))
+        acoustic_scores = np.full(shape, -np.inf)
+        lm_scores = np.zeros(shape)
+        word_counts = np.zeros(shape)
+        for n, beams in enumerate(beams_list):
+            for m, beam in enumerate(beams[:n_best]):
+                acoustic_scores[n, m] = beam.logit_score
+                lm_scores[n, m], word_counts[n, m] = decoder.score_text(beam.text)
+        return cls(texts, acoustic_scores, lm_scores, word_counts)
+
+    def get_scores(self, alpha: float, beta: float) -> NDArray[np.float64]:
+        """Get the combined scores of all hypotheses for alpha and beta."""
+        return self.acoustic_scores + alpha * self.lm_scores + beta * self.word_counts
+
+    def rescore(self, alphas: Sequence[float], betas: Sequence[float]) -> NDArray[np.int64]:
+        """Get the index of the top hypothesis of each utterance for every alpha and beta.
+
+        Returns:
+            array of shape (n_alphas, n_betas, n_utterances)
+        """
+        betas_array = np.asarray(betas, dtype=np.float64)[:, None, None]
+        best_idxs = np.empty((len(alphas), len(betas), len(self)), dtype=np.int64)
+        for n, alpha in enumerate(alphas):
+            # one alpha at a time keeps the score array at n_betas * n_utterances * n_best
+            scores = self.get_scores(alpha, 0.0)[None] + betas_array * self.word_counts[None]
+            best_idxs[n] = scores.argmax(axis=-1)
+        return best_idxs
+
+    def get_texts(self, alpha: float, beta: float) -> List[str]:
+        """Get the top hypothesis text of each utterance for alpha and beta."""
+        best_idxs = self.rescore([alpha], [beta])[0, 0]
+        return [texts[idx] if texts else "" for texts, idx in zip(self.texts, best_idxs)]
+
+    def get_word_errors(self, references: Sequence[str]) -> NDArray[np.int64]:
+        """Get the word edit distance of every hypothesis to the reference of its utterance."""
+        if len(references) != len(self):
+            raise ValueError(f"Got {len(references)} references for {len(self)} utterances.")
+        word_errors = np.zeros(self.acoustic_scores.shape, dtype=np.int64)
+        for n, (reference, texts) in enumerate(zip(references, self.texts)):
+            word_errors[n, : len(texts)] = [word_edit_distance(reference, text) for text in texts]
+        return word_errors
+
+    def grid_search(
+        self, references: Sequence[str], alphas: Sequence[float], betas: Sequence[float]
+    ) -> GridSearchResult:
+        """Get the corpus word error rate of every alpha and beta and the best of them.
+
+        Args:
+            references: reference transcripts of the utterances
+            alphas: language model weights to evaluate
+            betas: word insertion bonuses to evaluate
+
+        Returns:
+            word error rates of the grid and its best point
+        """
+        word_errors = self.get_word_errors(references)
+        n_ref_words = max(1, sum(len(reference.split()) for reference in references))
+        best_idxs = self.rescore(alphas, betas)
+        utterance_idxs = np.arange(len(self))
+        wers = word_errors[utterance_idxs, best_idxs].sum(axis=-1) / n_ref_words
+        alpha_idx, beta_idx = np.unravel_index(wers.argmin(), wers.shape)
+        return GridSearchResult(
+            alphas=np.asarray(alphas, dtype=np.float64),
+            betas=np.asarray(betas, dtype=np.float64),
+            wers=wers,
+            alpha=float(alphas[alpha_idx]),
+            beta=float(betas[beta_idx]),
+            wer=float(wers[alpha_idx, beta_idx]),
+        )
+
+    def get_changed_utterances(self, alpha: float, beta: float) -> NDArray[np.int64]:
+        """Get the indices of the utterances whose top hypothesis changes for alpha and beta."""
+        best_idxs = self.rescore([alpha], [beta])[0, 0]
+        return np.flatnonzero(best_idxs != 0)
+
+    def save(self, filepath: str) -> None:
+        """Save to a .npz file, the texts are stored as json."""
+        np.savez(
+            filepath,
+            texts=np.array(json.dumps(self.texts)),
+            acoustic_scores=self.acoustic_scores,
+            lm_scores=self.lm_scores,
+            word_counts=self.word_counts,
+        )
+
+    @classmethod
+    def load(cls, filepath: str) -> "NBestList":
+        """Load from a .npz file written by `save`."""
+        with np.load(filepath) as data:
+            return cls(
+                json.loads(str(data["texts"])),
+                data["acoustic_scores"],
+                data["lm_scores"],
+                data["word_counts"],
+            )
+
+
+def redecode_changed(
+    decoder: BeamSearchDecoderCTC,
+    logits_list: Sequence[NDArray[Any]],
+    nbest_list: NBestList,
+    alpha: float,
+    beta: float,
+    **decode_kwargs: Any,
+) -> Tuple[List[str], NDArray[np.int64]]:
+    """Get the texts for alpha and beta, decoding again only where the top hypothesis changes.
+
+    Rescoring only reorders the hypotheses found with the original weights, while the new
+    weights also steer the beam search. Utterances whose top hypothesis is unchanged keep it,
+    the others are decoded again. Alpha and beta stay set on the decoder afterwards.
+
+    Args:
+        decoder: decoder the N-best list was built with
+        logits_list: logit matrices of the utterances
+        nbest_list: N-best list of the utterances
+        alpha: language model weight
+        beta: word insertion bonus
+        decode_kwargs: keyword arguments passed on to `decode`
+
+    Returns:
+        top texts of all utterances and the indices of the decoded ones
+    """
+    changed_idxs = nbest_list.get_changed_utterances(alpha, beta)
+    texts = [utterance_texts[0] if utterance_texts else "" for utterance_texts in nbest_list.texts]
+    decoder.reset_params(alpha=alpha, beta=beta)
+    for idx in changed_idxs:
+        texts[idx] = decoder.decode(logits_list[idx], **decode_kwargs)
+    return texts, changed_idxs
@@ -0,0 +1,438 @@
+from __future__ import annotations, division
+
+import dataclasses
+import math
+from typing import Any, List, Optional
+
+import torch
+
+from myAlphabet import BPE_TOKEN, Alphabet
+from myDecoder import Frames, OutputBeam, WordFrames, _normalize_whitespace
+from pyctcdecode.constants import (
+    DEFAULT_BEAM_WIDTH,
+    DEFAULT_MIN_TOKEN_LOGP,
+    DEFAULT_PRUNE_LOGP,
+    MIN_TOKEN_CLIP_P,
+)
+
+
+# multiplier of the rolling prefix hash, int64 overflow wraps around so the hash is modulo 2**64
+_HASH_PRIME = 0x100000001B3
+
+
+@dataclasses.dataclass(frozen=True)
+class PrefixBeam:
+    """Token sequence of a beam of the batched prefix beam search."""
+
+    tokens: List[int]
+    token_frames: List[Frames]  # (start_frame, end_frame) of each token, repeats extend the end
+    logit_score: float  # log probability of the prefix summed over its alignments
+
+
+def _get_log_probs(logits: torch.Tensor, is_log_probs: bool = False) -> torch.Tensor:
+    """Make sure we have clipped log probs as input, same as `myDecoder._get_log_probs`."""
+    min_logp = math.log(MIN_TOKEN_CLIP_P)
+    if is_log_probs:
+        return logits.clamp(min_logp, 0)
+    if math.isclose(logits.sum(dim=-1).mean().item(), 1):
+        # input looks like probabilities, so take log
+        return logits.clamp(MIN_TOKEN_CLIP_P, 1).log()
+    return torch.log_softmax(logits, dim=-1).clamp(min_logp, 0)
+
+
+def _get_lengths(relative_lens: Optional[Any], n_utterances: int, n_frames: int) -> torch.Tensor:
+    """Get the number of valid frames of each utterance, rounded as in `split_padded_batch`."""
+    if relative_lens is None:
+        return torch.full((n_utterances,), n_frames, dtype=torch.long)
+    relative_lens = torch.as_tensor(relative_lens, dtype=torch.float64).cpu()
+    if relative_lens.shape != (n_utterances,):
+        raise ValueError(
+            "Got %s relative lengths for a batch of %s logit matrices."
+            % (tuple(relative_lens.shape), n_utterances)
+        )
+    return torch.round(relative_lens * n_frames).long().clamp(1, n_frames)
+
+
+def _logsumexp_by_group(values: torch.Tensor, groups: torch.Tensor, n_groups: int) -> torch.Tensor:
+    """Log-sum-exp of the values of each row that share a group index."""
+    shape = (values.shape[0], n_groups)
+    maxes = torch.full(shape, -math.inf, dtype=values.dtype, device=values.device)
+    maxes = maxes.scatter_reduce(1, groups, values, reduce="amax")
+    # groups without any finite value keep -inf, shift them by 0 to avoid inf - inf
+    maxes = torch.where(torch.isinf(maxes), torch.zeros_like(maxes), maxes)
+    sums = torch.zeros(shape, dtype=values.dtype, device=values.device)
+    sums = sums.scatter_add(1, groups, torch.exp(values - maxes.gather(1, groups)))
+    return torch.log(sums) + maxes
+
+
+def ctc_prefix_beam_search(
+    logits: Any,
+    relative_lens: Optional[Any] = None,
+    beam_width: int = DEFAULT_BEAM_WIDTH,
+    blank_id: int = 0,
+    beam_prune_logp: float = DEFAULT_PRUNE_LOGP,
+    token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
+    is_log_probs: bool = False,
+) -> List[List[PrefixBeam]]:
+    """CTC prefix beam search without language model over a whole padded batch at once.
+
+    Every frame expands all beams of all utterances by all tokens in a few tensor operations on
+    the device of the logits. Each beam keeps the log probabilities of its prefix ending in blank
+    and in a token, and an int64 rolling hash of its token sequence; candidates with equal hashes,
+    lengths and last tokens are the same prefix and are merged with a scatter log-sum-exp before
+    the top beam_width prefixes are kept. Prefixes are stored as nodes of a token trie that is only
+    walked at the end.
+
+    The hash is not checked against the full token sequences. Since the live prefixes are distinct
+    and a candidate only ever matches a live prefix one token longer, a wrong merge needs two live
+    prefixes of the same length whose hashes collide modulo 2**64. With at most beam_width
+    prefixes per utterance that is about beam_width**2 / 2**64 per frame, far below any effect on
+    the decoded text, while comparing token sequences would need a trie walk per merge.
+
+    Args:
+        logits: padded logits of shape (batch, time, vocabulary), torch tensor or numpy array
+        relative_lens: length of each utterance relative to the padded length, as in speechbrain
+        beam_width: maximum number of beams at each step in decoding
+        blank_id: index of the CTC blank token
+        beam_prune_logp: beams that are much worse than best beam will be pruned
+        token_min_logp: tokens below this logp are skipped unless they are argmax of frame
+        is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+
+    Returns:
+        beams of each utterance, sorted by decreasing logit score
+    """
+    logits = torch.as_tensor(logits)
+    if logits.ndim != 3:
+        raise ValueError(
+            "Input logits have %s dimensions, but need 3: (batch, time, vocabulary)" % logits.ndim
+        )
+    with torch.no_grad():
+        log_probs = _get_log_probs(logits.detach().float(), is_log_probs)
+        n_utterances, n_frames, _ = log_probs.shape
+        lengths = _get_lengths(relative_lens, n_utterances, n_frames)
+        return _prefix_beam_search(
+            log_probs,
+            lengths.to(log_probs.device),
+            int(lengths.max()),
+            beam_width,
+            blank_id,
+            beam_prune_logp,
+            token_min_logp,
+        )
+
+
+def _prefix_beam_search(
+    log_probs: torch.Tensor,
+    lengths: torch.Tensor,
+    max_length: int,
+    beam_width: int,
+    blank_id: int,
+    beam_prune_logp: float,
+    token_min_logp: float,
+) -> List[List[PrefixBeam]]:
+    """Run the prefix beam search on clipped log probs, see `ctc_prefix_beam_search`."""
+    n_utterances, _, vocab_size = log_probs.shape
+    device = log_probs.device
+    n_beams = beam_width
+    n_candidates = n_beams * (vocab_size + 1)
+
+    def full(value: float, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        return torch.full((n_utterances, n_beams), value, dtype=dtype, device=device)
+
+    # beam state, beams that are not alive have -inf scores and the empty prefix
+    blank_scores = full(-math.inf)
+    blank_scores[:, 0] = 0.0
+    token_scores = full(-math.inf)
+    last_tokens = full(-1, torch.long)  # -1 for the empty prefix
+    hashes = full(0, torch.long)  # 0 for the empty prefix
+    prefix_lengths = full(0, torch.long)
+    beam_nodes = full(0, torch.long)  # node 0 is the empty prefix
+    # token trie of all prefixes, a node is added per extended beam and frame at most
+    max_nodes = 1 + n_utterances * n_beams * max_length
+    node_parents = torch.zeros(max_nodes, dtype=torch.long, device=device)
+    node_tokens = torch.full((max_nodes,), -1, dtype=torch.long, device=device)
+    node_starts = torch.zeros(max_nodes, dtype=torch.long, device=device)
+    node_ends = torch.zeros(max_nodes, dtype=torch.long, device=device)
+    n_nodes = 1
+
+    token_ids = torch.arange(vocab_size, device=device)
+    token_hashes = token_ids + 1
+    # the last token of each candidate extending a beam, see candidate_tails below
+    extend_tokens = token_ids.expand(n_utterances, n_beams, vocab_size).flatten(1)
+    positions = torch.arange(n_candidates, device=device).expand(n_utterances, n_candidates)
+    for frame_idx in range(max_length):
+        is_active = (lengths > frame_idx)[:, None]
+        frame_log_probs = log_probs[:, frame_idx]
+        max_tokens = frame_log_probs.argmax(dim=1)
+        # tokens that can extend a prefix, the argmax is always kept
+        token_log_probs = torch.where(
+            (frame_log_probs >= token_min_logp) | (token_ids == max_tokens[:, None]),
+            frame_log_probs,
+            torch.full_like(frame_log_probs, -math.inf),
+        )
+        token_log_probs[:, blank_id] = -math.inf
+
+        # candidates keeping the prefix: blank, or a repeat of the last token
+        prefix_scores = torch.logaddexp(blank_scores, token_scores)
+        stay_blank_scores = prefix_scores + frame_log_probs[:, blank_id, None]
+        stay_token_scores = torch.where(
+            last_tokens >= 0,
+            token_scores + frame_log_probs.gather(1, last_tokens.clamp(min=0)),
+            torch.full_like(token_scores, -math.inf),
+        )
+        # candidates extending the prefix by a token, a repeated token needs a blank in between
+        extend_scores = torch.where(
+            last_tokens[:, :, None] == token_ids,
+            blank_scores[:, :, None],
+            prefix_scores[:, :, None],
+        ) + token_log_probs[:, None, :]
+        extend_hashes = hashes[:, :, None] * _HASH_PRIME + token_hashes
+
+        candidate_blank_scores = torch.cat(
+            [stay_blank_scores, torch.full_like(extend_scores, -math.inf).flatten(1)], dim=1
+        )
+        candidate_token_scores = torch.cat([stay_token_scores, extend_scores.flatten(1)], dim=1)
+        candidate_hashes = torch.cat([hashes, extend_hashes.flatten(1)], dim=1)
+        # length and last token of each candidate, equal for all candidates of the same prefix
+        candidate_lengths = torch.cat(
+            [prefix_lengths, (prefix_lengths + 1).repeat_interleave(vocab_size, dim=1)], dim=1
+        )
+        candidate_tails = candidate_lengths * (vocab_size + 1) + torch.cat(
+            [last_tokens, extend_tokens], dim=1
+        ) + 1
+
+        # merge candidates of the same prefix, ordered by hash and then tail; the stable sorts put
+        # the candidates keeping their prefix, which already have a trie node, first in each group
+        order = torch.sort(candidate_tails, dim=1, stable=True).indices
+        sorted_hashes, hash_order = torch.sort(
+            candidate_hashes.gather(1, order), dim=1, stable=True
+        )
+        order = order.gather(1, hash_order)
+        sorted_tails = candidate_tails.gather(1, order)
+        is_group_start = torch.ones_like(sorted_hashes, dtype=torch.bool)
+        is_group_start[:, 1:] = (sorted_hashes[:, 1:] != sorted_hashes[:, :-1]) | (
+            sorted_tails[:, 1:] != sorted_tails[:, :-1]
+        )
+        sorted_groups = is_group_start.long().cumsum(dim=1) - 1
+        groups = torch.empty_like(sorted_groups).scatter_(1, order, sorted_groups)
+        group_blank_scores = _logsumexp_by_group(candidate_blank_scores, groups, n_candidates)
+        group_token_scores = _logsumexp_by_group(candidate_token_scores, groups, n_candidates)
+        group_scores = torch.logaddexp(group_blank_scores, group_token_scores)
+        group_starts = torch.full_like(sorted_groups, n_candidates - 1).scatter_reduce(
+            1, sorted_groups, positions, reduce="amin"
+        )
+        representatives = order.gather(1, group_starts)
+
+        # remove beam outliers and keep the best prefixes
+        max_scores = group_scores.max(dim=1, keepdim=True).values
+        group_scores = torch.where(
+            group_scores >= max_scores + beam_prune_logp,
+            group_scores,
+            torch.full_like(group_scores, -math.inf),
+        )
+        top_scores, top_groups = group_scores.topk(n_beams, dim=1)
+        is_alive = torch.isfinite(top_scores)
+        candidates = representatives.gather(1, top_groups)
+        is_extended = candidates >= n_beams
+        parent_beams = torch.where(
+            is_extended, (candidates - n_beams) // vocab_size, candidates
+        )
+        new_tokens = torch.where(
+            is_extended,
+            (candidates - n_beams) % vocab_size,
+            last_tokens.gather(1, parent_beams),
+        )
+        parent_nodes = beam_nodes.gather(1, parent_beams)
+
+        # add trie nodes for the extended prefixes
+        is_new = is_extended & is_alive & is_active
+        new_node_ids = n_nodes + is_new.flatten().long().cumsum(dim=0).view_as(is_new) - 1
+        new_nodes = torch.where(is_new, new_node_ids, parent_nodes)
+        added_nodes = new_nodes[is_new]
+        node_parents[added_nodes] = parent_nodes[is_new]
+        node_tokens[added_nodes] = new_tokens[is_new]
+        node_starts[added_nodes] = frame_idx
+        node_ends[added_nodes] = frame_idx + 1
+        n_nodes += len(added_nodes)
+        # a kept prefix whose last token dominates the frame is held for one more frame
+        is_held = ~is_extended & is_alive & is_active & (new_tokens == max_tokens[:, None])
+        node_ends[new_nodes[is_held]] = frame_idx + 1
+
+        # beams that are not alive fall back to the empty prefix, so hash and node agree
+        empty = torch.zeros_like(new_nodes)
+        dead_scores = torch.full_like(top_scores, -math.inf)
+        new_blank_scores = torch.where(
+            is_alive, group_blank_scores.gather(1, top_groups), dead_scores
+        )
+        new_token_scores = torch.where(
+            is_alive, group_token_scores.gather(1, top_groups), dead_scores
+        )
+        blank_scores = torch.where(is_active, new_blank_scores, blank_scores)
+        token_scores = torch.where(is_active, new_token_scores, token_scores)
+        last_tokens = torch.where(
+            is_active, torch.where(is_alive, new_tokens, empty - 1), last_tokens
+        )
+        hashes = torch.where(
+            is_active,
+            torch.where(is_alive, candidate_hashes.gather(1, candidates), empty),
+            hashes,
+        )
+        prefix_lengths = torch.where(
+            is_active,
+            torch.where(is_alive, candidate_lengths.gather(1, candidates), empty),
+            prefix_lengths,
+        )
+        beam_nodes = torch.where(is_active, torch.where(is_alive, new_nodes, empty), beam_nodes)
+
+    scores = torch.logaddexp(blank_scores, token_scores)
+    scores, beam_order = scores.sort(dim=1, descending=True)
+    beam_nodes = beam_nodes.gather(1, beam_order)
+    return _get_prefix_beams(
+        scores.cpu().tolist(),
+        beam_nodes.cpu().tolist(),
+        node_parents[:n_nodes].cpu().tolist(),
+        node_tokens[:n_nodes].cpu().tolist(),
+        node_starts[:n_nodes].cpu().tolist(),
+        node_ends[:n_nodes].cpu().tolist(),
+    )
+
+
+def _get_prefix_beams(
+    scores: List[List[float]],
+    beam_nodes: List[List[int]],
+    node_parents: List[int],
+    node_tokens: List[int],
+    node_starts: List[int],
+    node_ends: List[int],
+) -> List[List[PrefixBeam]]:
+    """Walk the token trie back from the node of each live beam."""
+    batch_beams = []
+    for utterance_scores, utterance_nodes in zip(scores, beam_nodes):
+        beams = []
+        for score, node in zip(utterance_scores, utterance_nodes):
+            if not math.isfinite(score):
+                break
+            tokens = []
+            token_frames = []
+            while node != 0:
+                tokens.append(node_tokens[node])
+                token_frames.append((node_starts[node], node_ends[node]))
+                node = node_parents[node]
+            beams.append(PrefixBeam(tokens[::-1], token_frames[::-1], score))
+        batch_beams.append(beams)
+    return batch_beams
+
+
+class TorchBeamSearchDecoderCTC:
+    def __init__(self, alphabet: Alphabet) -> None:
+        """Batched CTC prefix beam search decoder without language model, see `myDecoder.py`.
+
+        Decodes a whole padded batch with tensor operations on the device of the logits, e.g. the
+        validation outputs of the acoustic model, and returns the same `OutputBeam` structure as
+        `BeamSearchDecoderCTC`. There is no language model, hotword or history pruning support.
+
+        Args:
+            alphabet: class containing the labels for input logit matrices
+        """
+        if "" not in alphabet.labels:
+            raise ValueError("Alphabet has no CTC blank token.")
+        self._alphabet = alphabet
+        self._blank_id = alphabet.labels.index("")
+
+    def _get_output_beam(self, beam: PrefixBeam) -> OutputBeam:
+        """Convert the tokens of a prefix beam to words and word frames."""
+        text_frames: List[WordFrames] = []
+        word = ""
+        word_frames: Frames = (-1, -1)
+        for token, (start_frame, end_frame) in zip(beam.tokens, beam.token_frames):
+            label = self._alphabet.labels[token]
+            is_word_end = False
+            if self._alphabet.is_bpe:
+                if label[:1] == BPE_TOKEN:
+                    if word:
+                        text_frames.append((word, word_frames))
+                    word = ""
+                    label = label[1:]
+                # some tokens are bounded on both sides like ▁⁇▁
+                if label[-1:] == BPE_TOKEN:
+                    label = label[:-1]
+                    is_word_end = True
+            elif label == " ":
+                label = ""
+                is_word_end = True
+            if label:
+                word_frames = (start_frame if not word else word_frames[0], end_frame)
+                word += label
+            if is_word_end and word:
+                text_frames.append((word, word_frames))
+                word = ""
+        if word:
+            text_frames.append((word, word_frames))
+        return OutputBeam(
+            text=_normalize_whitespace(" ".join(word for word, _ in text_frames)),
+            last_lm_state=None,
+            text_frames=text_frames,
+            logit_score=beam.logit_score,
+            lm_score=beam.logit_score,  # same as logit_score without language model
+        )
+
+    def decode_padded_batch_beams(
+        self,
+        logits: Any,
+        relative_lens: Optional[Any] = None,
+        beam_width: int = DEFAULT_BEAM_WIDTH,
+        beam_prune_logp: float = DEFAULT_PRUNE_LOGP,
+        token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
+        is_log_probs: bool = False,
+    ) -> List[List[OutputBeam]]:
+        """Decode a padded logit batch to beams, decoding only the valid frames of each utterance.
+
+        Args:
+            logits: padded logits of shape (batch, time, vocabulary), torch tensor or numpy array
+            relative_lens: length of each utterance relative to the padded length, e.g. the
+                speechbrain `wav_lens`, all frames are decoded if None
+            beam_width: maximum number of beams at each step in decoding
+            beam_prune_logp: beams that are much worse than best beam will be pruned
+            token_min_logp: tokens below this logp are skipped unless they are argmax of frame
+            is_log_probs: whether the logits are already log-softmax outputs, skips normalization
+
+        Returns:
+            List of beams of type OutputBeam for each utterance
+        """
+        batch_beams = ctc_prefix_beam_search(
+            logits,
+            relative_lens,
+            beam_width=beam_width,
+            blank_id=self._blank_id,
+            beam_prune_logp=beam_prune_logp,
+            token_min_logp=token_min_logp,
+            is_log_probs=is_log_probs,
+        )
+        return [[self._get_output_beam(beam) for beam in beams] for beams in batch_beams]
+
+    def decode_padded_batch(
+        self,
+        logits: Any,
+        relative_lens: Optional[Any] = None,
+        beam_width: int = DEFAULT_BEAM_WIDTH,
+        beam_prune_logp: float = DEFAULT_PRUNE_LOGP,
+        token_min_logp: float = DEFAULT_MIN_TOKEN_LOGP,
+        is_log_probs: bool = False,
+    ) -> List[str]:
+        """Decode a padded logit batch to texts, see `decode_padded_batch_beams`."""
+        return [
+            beams[0].text
+            for beams in self.decode_padded_batch_beams(
+                logits,
+                relative_lens,
+                beam_width=beam_width,
+                beam_prune_logp=beam_prune_logp,
+                token_min_logp=token_min_logp,
+                is_log_probs=is_log_probs,
+            )
+        ]
+
+
+def build_torch_ctcdecoder(labels: List[str]) -> TorchBeamSearchDecoderCTC:
+    """Build a batched torch CTC decoder without language model from a list of labels."""
+    return TorchBeamSearchDecoderCTC(Alphabet.build_alphabet(labels))
@@ -29,7 +29,11 @@ else:
 
 """
 
+import os
+import shutil
 import sys
+import functools
+import numpy as np
 import torch
 import logging
 import speechbrain as sb
@@ -43,7 +47,10 @@ import yaml
 import sentencepiece as spm
 import wandb
 from mySchedulers import MyIntervalScheduler
-from pyctcdecode import build_ctcdecoder
+from myDecoder import BeamSearchDecoderCTC, build_ctcdecoder, split_padded_batch
+from myDecoderService import DecoderService
+from myLanguageModel import NgramModel, compile_arpa
+from myLongForm import transcribe_long_form
 
 logger = logging.getLogger(__name__)
 
@@ -92,9 +99,28 @@ class ASR(sb.core.Brain):
             
             # Beam Search Decoding
                 
-            p_ctc = p_ctc.detach().cpu().numpy()
-            sequence = self.beam_search_decoder.decode_batch(pool=None, logits_list=p_ctc,
-                                                             beam_width=self.hparams.beam_size)
+            # cache the log-posteriors as <ID>.npy for offline decoder benchmarks
+            if stage == sb.Stage.TEST and getattr(self.hparams, "decoder_logits_dir", None):
+                os.makedirs(self.hparams.decoder_logits_dir, exist_ok=True)
+                for utt_id, utt_logits in zip(ids, split_padded_batch(p_ctc, wav_lens)):
+                    np.save(os.path.join(self.hparams.decoder_logits_dir, f"{utt_id}.npy"),
+                            utt_logits)
+
+            # entropy-adaptive beam width between min_beam_size and beam_size, fixed if unset
+            min_beam_width = getattr(self.hparams, "min_beam_size", None)
+            # p_ctc holds log-softmax outputs, only the valid (non-padding) frames are decoded
+            if self.decoder_service is not None:
+                # persistent worker processes, logits are passed through shared memory
+                sequence = self.decoder_service.decode_padded_batch(p_ctc, wav_lens,
+                                                                    beam_width=self.hparams.beam_size,
+                                                                    min_beam_width=min_beam_width,
+                                                                    is_log_probs=True)
+            else:
+                sequence = self.beam_search_decoder.decode_padded_batch(pool=None, logits=p_ctc,
+                                                                        relative_lens=wav_lens,
+                                                                        beam_width=self.hparams.beam_size,
+                                                                        min_beam_width=min_beam_width,
+                                                                        is_log_probs=True)
             # pool: multiprocessing pool for parallel execution
 
             
@@ -238,6 +264,16 @@ class ASR(sb.core.Brain):
             loss = self.compute_objectives(predictions, batch, stage=stage)
         return loss.detach()
 
+    def encode_window(self, wav):
+        """Log-posteriors of one waveform window, shape (n_frames, n_labels), for long-form
+        transcription."""
+        wavs = torch.from_numpy(wav).unsqueeze(0).to(self.device)
+        wav_lens = torch.ones(1, device=self.device)
+        with torch.no_grad():
+            feats = self.modules.wav2vec2(wavs, wav_lens)
+            p_ctc = self.hparams.log_softmax(self.modules.ctc_lin(feats))
+        return p_ctc[0].cpu().numpy()
+
     def on_stage_start(self, stage, epoch):
         """Gets called at the beginning of each epoch"""
         if stage != sb.Stage.TRAIN:
@@ -299,6 +335,16 @@ class ASR(sb.core.Brain):
         
 
 
+def read_audio_blocks(path, sample_rate, block_s=30.0):
+    """Read an audio file block by block, so that long recordings are never loaded at once."""
+    info = torchaudio.info(path)
+    resample = torchaudio.transforms.Resample(info.sample_rate, sample_rate)
+    block_frames = int(block_s * info.sample_rate)
+    for offset in range(0, info.num_frames, block_frames):
+        sig, _ = torchaudio.load(path, frame_offset=offset, num_frames=block_frames)
+        yield resample(sig.mean(dim=0)).numpy()
+
+
 # Define custom data procedure
 def dataio_prepare(hparams, tokenizer):
     """This function prepares the datasets to be used in the brain class.
@@ -510,19 +556,43 @@ if __name__ == "__main__":
     
 
     uppercase_lm_path = asr_brain.hparams.save_folder + '/3-gram.pruned.1e-7.arpa'
-   
-    # load unigram list
-    with open(asr_brain.hparams.save_folder + "/librispeech-vocab.txt") as f:
-        unigram_list = [t.upper() for t in f.read().strip().split("\n")]
-        
-
-    asr_brain.beam_search_decoder = build_ctcdecoder(
-        labels = labels, #asr_model.decoder.vocabulary,
-        kenlm_model_path = uppercase_lm_path,
-        unigrams = unigram_list,
-        alpha = 0.7,
-        beta = 1.8,
+    decoder_path = asr_brain.hparams.save_folder + '/decoder_3-gram.pruned.1e-7'
+
+    # compile the alphabet, the unigram list and the arpa file once into a decoder directory,
+    # later runs and the decoder workers load it in milliseconds without kenlm
+    def save_compiled_decoder():
+        # load unigram list
+        with open(asr_brain.hparams.save_folder + "/librispeech-vocab.txt") as f:
+            unigram_list = [t.upper() for t in f.read().strip().split("\n")]
+        compiled_lm_path = asr_brain.hparams.save_folder + '/3-gram.pruned.1e-7.ngram'
+        if not NgramModel.is_compiled_dir(compiled_lm_path):
+            compile_arpa(uppercase_lm_path, compiled_lm_path, unigrams=unigram_list)
+        # an interrupted earlier run leaves a directory without manifest
+        shutil.rmtree(decoder_path, ignore_errors=True)
+        os.makedirs(decoder_path)
+        build_ctcdecoder(labels, compiled_lm_path).save_to_dir(decoder_path, compiled=True)
+
+    if BeamSearchDecoderCTC.read_manifest(decoder_path) is None:
+        run_on_main(save_compiled_decoder)
+
+    # lm_alpha / lm_beta as tuned offline with `decoder_benchmark.py rescore` on the saved
+    # decoder_logits_dir log-posteriors
+    decoder_factory = functools.partial(
+        BeamSearchDecoderCTC.load_from_dir,
+        decoder_path,
+        alpha = hparams.get("lm_alpha", 0.7),
+        beta = hparams.get("lm_beta", 1.8),
     )
+    asr_brain.beam_search_decoder = decoder_factory()
+    
+    # decoder worker processes (fork or spawn), each worker loads the LM only once
+    asr_brain.decoder_service = None
+    if hparams.get("num_decoder_workers", 0) > 0:
+        asr_brain.decoder_service = DecoderService(
+            decoder_factory,
+            vocab_size = len(labels),
+            num_workers = hparams["num_decoder_workers"],
+        )
     """
     alpha: weight for language model during shallow fusion
     beta: weight for length score adjustment of during scoring
@@ -548,6 +618,25 @@ if __name__ == "__main__":
         test_loader_kwargs=hparams["test_dataloader_options"],
     )
     
+    # long-form transcription of recordings far longer than the training utterances: windows
+    # of avoid_if_longer_than seconds are encoded one at a time and decoded incrementally
+    asr_brain.modules.eval()
+    for long_form_wav in hparams.get("long_form_audio", []):
+        result = transcribe_long_form(
+            asr_brain.beam_search_decoder,
+            asr_brain.encode_window,
+            read_audio_blocks(long_form_wav, hparams["sample_rate"]),
+            sample_rate = hparams["sample_rate"],
+            window_s = hparams["avoid_if_longer_than"],
+            beam_width = hparams["beam_size"],
+            is_log_probs = True,
+        )
+        logger.info("%s (%.1f s, RTF %.3f): %s", long_form_wav, result.audio_seconds,
+                    result.rtf, result.text)
+
+    if asr_brain.decoder_service is not None:
+        asr_brain.decoder_service.close()
+    
 
     
     
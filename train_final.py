@@ -13,6 +13,7 @@ import yaml
 import sentencepiece as spm
 import wandb
 from mySchedulers import MyIntervalScheduler
+from myTorchDecoder import ctc_prefix_beam_search
 #from speechbrain.tokenizers.SentencePiece import SentencePiece
 #from pyctcdecode import build_ctcdecoder
 
@@ -50,12 +51,21 @@ class ASR(sb.core.Brain):
 
         loss = self.hparams.ctc_cost(p_ctc, tokens, wav_lens, tokens_lens)
 
-        if stage == sb.Stage.TEST:
+        if stage != sb.Stage.TRAIN:
             # Decode token terms to words
 
-            sequence = sb.decoders.ctc_greedy_decode(
-                p_ctc, wav_lens, blank_id=-1
-            )
+            if stage == sb.Stage.VALID:
+                # batched prefix beam search without LM on the device of p_ctc, a small beam
+                # keeps the validation pass of every epoch cheap
+                batch_beams = ctc_prefix_beam_search(p_ctc, wav_lens,
+                                                     beam_width=self.hparams.valid_beam_size,
+                                                     blank_id=self.hparams.blank_index,
+                                                     is_log_probs=True)
+                sequence = [beams[0].tokens for beams in batch_beams]
+            else:
+                sequence = sb.decoders.ctc_greedy_decode(
+                    p_ctc, wav_lens, blank_id=-1
+                )
             
             """
             # Beam Search Decoding
@@ -214,7 +224,7 @@ class ASR(sb.core.Brain):
             self.optimizer_step = 0
             self.model_optimizer.param_groups[0]["lr"] = 0.0 
             
-        if stage == sb.Stage.TEST:
+        if stage != sb.Stage.TRAIN:
             self.cer_metric = self.hparams.cer_computer()
             self.wer_metric = self.hparams.error_rate_computer()
     
@@ -224,7 +234,7 @@ class ASR(sb.core.Brain):
         stage_stats = {"loss": stage_loss}
         if stage == sb.Stage.TRAIN:
             self.train_stats = stage_stats
-        elif stage == sb.Stage.TEST:
+        else:
             stage_stats["CER"] = self.cer_metric.summarize("error_rate")
             stage_stats["WER"] = self.wer_metric.summarize("error_rate")
 